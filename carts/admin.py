@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Cart,CartItem
+from .models import Cart,CartItem,StockReservation
 # Register your models here.
 admin.site.register(Cart)
 admin.site.register(CartItem)
+admin.site.register(StockReservation)
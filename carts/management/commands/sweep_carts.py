@@ -0,0 +1,70 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from carts.reservations import reap_reservations
+from carts.sweeper import sweep_carts
+from carts.tasks import schedule_cart_sweeper
+
+
+class Command(BaseCommand):
+    help = "Delete expired empty carts and abandoned carts in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--empty-hours',
+            type=int,
+            default=settings.CART_EMPTY_MAX_AGE_HOURS,
+            help='Delete empty carts idle for longer than this many hours',
+        )
+        parser.add_argument(
+            '--abandoned-days',
+            type=int,
+            default=settings.CART_ABANDONED_MAX_AGE_DAYS,
+            help='Delete carts with items idle for longer than this many days',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.CART_SWEEP_BATCH_SIZE,
+            help='Number of carts deleted per transaction',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=None,
+            help='Stop after this many batches per cart kind (default: until done)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count what would be deleted',
+        )
+        parser.add_argument(
+            '--schedule',
+            action='store_true',
+            help='Queue the periodic sweeper and reservation reaper instead of sweeping now',
+        )
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            queued = schedule_cart_sweeper()
+            if queued:
+                self.stdout.write(self.style.SUCCESS(f"Scheduled {', '.join(queued)}"))
+            else:
+                self.stdout.write("Cart sweeper and reservation reaper are already scheduled")
+            return
+
+        stats = sweep_carts(
+            empty_max_age=timedelta(hours=options['empty_hours']),
+            abandoned_max_age=timedelta(days=options['abandoned_days']),
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            dry_run=options['dry_run'],
+        )
+        released = 0 if options['dry_run'] else reap_reservations(batch_size=options['batch_size'])
+        prefix = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {stats['empty_carts']} empty carts and {stats['abandoned_carts']} abandoned carts "
+            f"({stats['abandoned_items']} items) in {stats['batches']} batches, {stats['seconds']}s; "
+            f"released {released} expired reservations"
+        ))
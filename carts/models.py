@@ -1,37 +1,78 @@
 # models.py
-from django.db import models
-from products.models import ProductVariant
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import Case, DecimalField, Exists, ExpressionWrapper, F, OuterRef, Prefetch, Sum, Value, When
+from django.db.models.functions import Coalesce
+from products.models import CATEGORY_LIST_FIELDS, Category, ProductVariant
 from django.forms import ValidationError
 from django.utils import timezone
 from datetime import timedelta
 
-class CartManager(models.Manager):
-    def get_or_create_with_cleanup(self, session_key):
-        import random
-        if random.randint(1, 100) == 1:
-            self.cleanup_old_empty_carts()
-        
-        return self.get_or_create(session_key=session_key)
-    
-    def cleanup_old_empty_carts(self):
-        """Delete empty carts older than 1 day"""
-        one_day_ago = timezone.now() - timedelta(days=1)
-        
-        empty_carts = self.filter(
-            items__isnull=True,
-            updated_at__lt=one_day_ago
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self.annotate(
+            line_total=ExpressionWrapper(F('quantity') * F('variant__product__price'), output_field=MONEY)
         )
-        
-        count = empty_carts.count()
-        if count > 0:
-            empty_carts.delete()
-            print(f"Cleaned up {count} empty carts")
-        return count
+
+    def for_detail(self):
+        """Everything CartItemSerializer reads, in two queries however many lines."""
+        return self.with_totals().select_related('variant__product').prefetch_related(
+            Prefetch('variant__product__categories', queryset=Category.objects.only(*CATEGORY_LIST_FIELDS))
+        ).order_by('pk')
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self.annotate(
+            total_items=Coalesce(Sum('items__quantity'), 0),
+            total_amount=Coalesce(
+                Sum(F('items__quantity') * F('items__variant__product__price'), output_field=MONEY),
+                Value(Decimal('0.00')),
+                output_field=MONEY,
+            ),
+        )
+
+    def for_detail(self):
+        """Cart rows with totals plus their items: three queries for any cart size."""
+        return self.with_totals().prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.for_detail())
+        )
+
+    def empty(self):
+        return self.filter(~Exists(CartItem.objects.filter(cart=OuterRef('pk'))))
+
+    def non_empty(self):
+        return self.filter(Exists(CartItem.objects.filter(cart=OuterRef('pk'))))
+
+    def idle_since(self, before):
+        """Carts untouched (including their items, see CartItem.save) since `before`."""
+        return self.filter(updated_at__lt=before)
+
+    def touch(self):
+        return self.update(updated_at=timezone.now())
+
+    def for_session(self, session_key):
+        """The session's cart (the oldest, should there be several), or None."""
+        if not session_key:
+            return None
+        return self.filter(session_key=session_key).order_by('pk').first()
+
+
+class CartManager(models.Manager.from_queryset(CartQuerySet)):
+    def materialize(self, session_key):
+        """Return the session's cart, creating it on the first write."""
+        with transaction.atomic():
+            cart = self.select_for_update().for_session(session_key)
+            return cart or self.create(session_key=session_key)
+
 
 class Cart(models.Model):
     session_key = models.CharField(max_length=40, null=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)  
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # range-scanned by carts.sweeper
 
     objects = CartManager()
 
@@ -40,11 +81,32 @@ class Cart(models.Model):
 
     @property
     def total(self):
+        if hasattr(self, 'total_amount'):
+            return self.total_amount  # annotated by CartQuerySet.with_totals()
         return sum(item.total_price for item in self.items.all())
     
     @property
     def is_empty(self):
         return self.items.count() == 0
+
+    def add_variants(self, quantities):
+        """
+        Add {variant_id: quantity} to the cart, safe under concurrent adds:
+        missing lines are inserted at 0 (conflicts on cart/variant ignored),
+        then every line is incremented in SQL by one UPDATE.
+        """
+        with transaction.atomic():
+            CartItem.objects.bulk_create(
+                [CartItem(cart=self, variant_id=variant_id, quantity=0) for variant_id in quantities],
+                ignore_conflicts=True,
+            )
+            CartItem.objects.filter(cart=self, variant_id__in=quantities).update(
+                quantity=F('quantity') + Case(
+                    *[When(variant_id=variant_id, then=Value(quantity)) for variant_id, quantity in quantities.items()],
+                    output_field=models.IntegerField(),
+                )
+            )
+            Cart.objects.filter(pk=self.pk).touch()
     
     def should_be_deleted(self):
         """Check if cart should be deleted (empty and older than 1 day)"""
@@ -59,18 +121,58 @@ class CartItem(models.Model):
     variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ['cart', 'variant']
 
     def __str__(self):
         return f"{self.variant} x {self.quantity}"
 
+    # Item changes count as cart activity, so the sweeper leaves the cart alone.
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Cart.objects.filter(pk=self.cart_id).touch()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Cart.objects.filter(pk=self.cart_id).touch()
+        return result
+
     @property
     def total_price(self):
+        if hasattr(self, 'line_total'):
+            return self.line_total  # annotated by CartItemQuerySet.with_totals()
         price = getattr(self.variant, 'price', None) or self.variant.product.price
         return price * self.quantity
     
     def clean(self):
         # Ensure quantity is at least 1
         if self.quantity < 1:
-            raise ValidationError("Quantity must be at least 1")
\ No newline at end of file
+            raise ValidationError("Quantity must be at least 1")
+
+class StockReservationQuerySet(models.QuerySet):
+    def active(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+
+class StockReservation(models.Model):
+    """Variant stock held for a cart line until `expires_at` (see carts.reservations)."""
+    cart_item = models.OneToOneField(CartItem, related_name='reservation', on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)  # reaper range scan
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Active reservations per variant, summed for available-to-sell.
+            models.Index(fields=['variant', 'expires_at'], name='reservation_variant_exp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.variant} x {self.quantity} until {self.expires_at}"
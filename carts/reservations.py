@@ -0,0 +1,119 @@
+"""
+Time-boxed stock reservations.
+
+Adding to a cart reserves the line's quantity for CART_RESERVATION_TTL
+seconds. Available-to-sell is on-hand minus other carts' active
+reservations, so a flash sale fails at add-to-cart rather than at payment.
+Expired rows are ignored by every check and deleted by reap_reservations().
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from products.models import ProductVariant
+from .models import CartItem, StockReservation
+
+
+class InsufficientStock(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _reserved_by_others(cart):
+    reserved = StockReservation.objects.active().filter(variant=OuterRef('pk'))
+    if cart is not None:
+        reserved = reserved.exclude(cart_item__cart=cart)
+    return Coalesce(
+        Subquery(reserved.order_by().values('variant').annotate(total=Sum('quantity')).values('total')[:1]),
+        Value(0),
+    )
+
+
+def available_to_sell(variant_ids, cart=None):
+    """{variant_id: on-hand minus active reservations of carts other than `cart`}, one query."""
+    return dict(
+        ProductVariant.objects.filter(pk__in=variant_ids).annotate(
+            available=F('quantity') - _reserved_by_others(cart)
+        ).values_list('pk', 'available')
+    )
+
+
+def stock_shortfalls(cart, quantities, lock=False):
+    """
+    {variant_id: message} for each line of {variant_id: quantity to add}
+    that would take the cart past what is available to sell. One query;
+    with lock the variant rows stay locked until the transaction ends.
+    """
+    in_cart = CartItem.objects.filter(cart=cart, variant=OuterRef('pk')).values('quantity')[:1]
+    variants = ProductVariant.objects.filter(pk__in=quantities)
+    if lock:
+        variants = variants.select_for_update()
+    rows = variants.annotate(
+        available=F('quantity') - _reserved_by_others(cart),
+        in_cart=Coalesce(Subquery(in_cart), Value(0)),
+    ).values_list('pk', 'available', 'in_cart')
+    return _shortfalls({pk: (max(available, 0), held) for pk, available, held in rows}, quantities)
+
+
+def held_shortfalls(held, quantities):
+    """
+    stock_shortfalls() for a cart that is not in the database (carts.storage):
+    `held` is {variant_id: quantity already in the cart}.
+    """
+    stock = {
+        pk: (max(available, 0), held.get(pk, 0))
+        for pk, available in available_to_sell(quantities).items()
+    }
+    return _shortfalls(stock, quantities)
+
+
+def _shortfalls(stock, quantities):
+    errors = {}
+    for variant_id, quantity in quantities.items():
+        if variant_id not in stock:
+            errors[variant_id] = "Product variant does not exist"
+        elif stock[variant_id][1] + quantity > stock[variant_id][0]:
+            errors[variant_id] = f"Only {stock[variant_id][0]} items available in stock"
+    return errors
+
+
+def reserve(cart, variant_ids):
+    """
+    (Re)reserve the cart's current quantity of these variants for another
+    TTL. Call inside the transaction that changed the lines; raises
+    InsufficientStock (so the caller rolls back) if they no longer fit.
+    """
+    errors = stock_shortfalls(cart, {variant_id: 0 for variant_id in variant_ids}, lock=True)
+    if errors:
+        raise InsufficientStock(errors)
+
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+    lines = CartItem.objects.filter(cart=cart, variant_id__in=variant_ids).values_list('pk', 'variant_id', 'quantity')
+    StockReservation.objects.bulk_create(
+        [
+            StockReservation(cart_item_id=pk, variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+            for pk, variant_id, quantity in lines
+        ],
+        update_conflicts=True,
+        unique_fields=['cart_item'],
+        update_fields=['variant', 'quantity', 'expires_at'],
+    )
+
+
+def reap_reservations(batch_size=None, max_batches=None):
+    """Delete expired reservations in primary-key batches; returns the number deleted."""
+    batch_size = batch_size or settings.CART_SWEEP_BATCH_SIZE
+    now = timezone.now()
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        pks = list(StockReservation.objects.expired(now).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            count, _ = StockReservation.objects.expired(now).filter(pk__in=pks).delete()
+        deleted += count
+        batches += 1
+    return deleted
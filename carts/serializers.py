@@ -1,4 +1,5 @@
 # serializers.py (separate file)
+from decimal import Decimal
 from rest_framework import serializers
 from .models import Cart, CartItem
 from products.models import ProductVariant
@@ -22,7 +23,21 @@ class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = ['id', 'session_key', 'created_at', 'updated_at', 'items', 'total', 'total_items']
-        
+
+
+def empty_cart(session_key=None):
+    """What CartSerializer renders for a cart that has not been stored yet."""
+    return {
+        'id': None,
+        'session_key': session_key,
+        'created_at': None,
+        'updated_at': None,
+        'items': [],
+        'total': Decimal('0.00'),
+        'total_items': 0,
+    }
+
+
 class AddToCartSerializer(serializers.Serializer):
     variant_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1)
@@ -42,6 +57,26 @@ class AddToCartSerializer(serializers.Serializer):
         data['variant'] = variant
         return data
 
+class AddItemsSerializer(serializers.Serializer):
+    """Several (variant_id, quantity) lines; repeated variants are summed. Stock is checked by the view."""
+    items = serializers.ListField(
+        child=serializers.DictField(child=serializers.IntegerField()),
+        min_length=1,
+        max_length=100,
+    )
+
+    def validate_items(self, value):
+        quantities = {}
+        for line in value:
+            variant_id, quantity = line.get('variant_id'), line.get('quantity', 1)
+            if variant_id is None:
+                raise serializers.ValidationError("Each item needs a variant_id")
+            if quantity < 1:
+                raise serializers.ValidationError("Quantity must be at least 1")
+            quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+        return quantities
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
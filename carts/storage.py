@@ -0,0 +1,327 @@
+"""
+Where the caller's current cart lives (settings.CART_STORAGE_BACKEND):
+
+- 'db': Cart/CartItem rows, as before.
+- 'cache': anonymous carts in the CART_CACHE_ALIAS cache, keyed by a signed cart-token cookie.
+- 'cookie': anonymous carts in a signed cookie.
+
+Anonymous carts are written to the database only when they are checked out
+or when the caller is signed in (the next cart request with credentials).
+Until then they hold no stock reservations. Their line ids are the variant
+ids, and the API renders them with the same serializers as stored carts.
+"""
+import json
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import serializers
+from products.models import CATEGORY_LIST_FIELDS, Category, ProductVariant
+from .models import Cart, CartItem
+from .reservations import InsufficientStock, held_shortfalls, reserve, stock_shortfalls
+from .serializers import empty_cart
+
+CART_TOKEN_COOKIE = 'cart_token'
+CART_STATE_COOKIE = 'cart'
+
+
+def _timestamp():
+    # As CartSerializer renders created_at/updated_at, so the state stays JSON.
+    return serializers.DateTimeField().to_representation(timezone.now())
+
+
+class DatabaseCartStorage:
+    """Carts are Cart/CartItem rows keyed by session key (or an earlier cart token)."""
+    anonymous = False
+
+    def __init__(self, request, session_key=None, previous=None):
+        self.request = request
+        self.requested_key = session_key
+        self.previous = previous  # anonymous storage whose cart was just persisted
+
+    @property
+    def session_key(self):
+        return (
+            self.requested_key
+            or self.request.session.session_key
+            or self.request.get_signed_cookie(CART_TOKEN_COOKIE, default=None)
+        )
+
+    def load(self):
+        return Cart.objects.for_detail().for_session(self.session_key)
+
+    def get_line(self, cart, variant_id):
+        return CartItem.objects.get(cart=cart, variant_id=variant_id)
+
+    def add(self, quantities, cart=None):
+        """
+        Add {variant_id: quantity} and reserve the stock; returns the cart.
+        Without `cart` the session cart is used, and created together with
+        its first items. Raises InsufficientStock before writing anything
+        if a line does not fit.
+        """
+        cart = cart or Cart.objects.for_session(self.session_key)
+        errors = stock_shortfalls(cart, quantities)
+        if errors:
+            raise InsufficientStock(errors)
+
+        # Start the session outside the transaction: a rollback must not drop its row.
+        session_key = None
+        if cart is None:
+            session_key = self.session_key
+            if not session_key:
+                self.request.session.create()
+                session_key = self.request.session.session_key
+        with transaction.atomic():
+            cart = cart or Cart.objects.materialize(session_key)
+            cart.add_variants(quantities)
+            reserve(cart, quantities)  # re-checks under lock
+        return cart
+
+    def items(self):
+        cart = self.load()
+        return list(cart.items.all()) if cart else []
+
+    def finalize(self, response):
+        if self.previous is not None:
+            self.previous.finalize(response)
+
+
+class AnonymousCartStorage:
+    """
+    Base for carts kept outside the database. State is
+    {'token', 'created_at', 'updated_at', 'items': {variant_id: quantity}}.
+    """
+    anonymous = True
+
+    def __init__(self, request, session_key=None):
+        self.request = request
+        self.token = session_key or request.get_signed_cookie(CART_TOKEN_COOKIE, default=None)
+        self.new_token = self.retired_token = False
+        self._state = None
+        self._loaded = False
+
+    @property
+    def session_key(self):
+        return self.token
+
+    # Backends implement these three.
+    def read_state(self):
+        raise NotImplementedError
+
+    def write_state(self, state):
+        raise NotImplementedError
+
+    def delete_state(self):
+        raise NotImplementedError
+
+    @property
+    def state(self):
+        if not self._loaded:
+            state = self.read_state()
+            if state:
+                state['items'] = {int(pk): quantity for pk, quantity in state['items'].items()}
+            self._state, self._loaded = state, True
+        return self._state
+
+    def save(self, items):
+        state = self.state or {'created_at': _timestamp()}
+        if not self.token:
+            self.token, self.new_token = uuid.uuid4().hex, True
+        state.update(token=self.token, updated_at=_timestamp(), items=items)
+        self._state = state
+        self.write_state(state)
+
+    def items(self):
+        """Unsaved CartItems (id = variant id) with variants loaded as CartItemSerializer needs them."""
+        quantities = (self.state or {}).get('items', {})
+        if not quantities:
+            return []
+        variants = ProductVariant.objects.filter(pk__in=quantities).select_related('product').prefetch_related(
+            Prefetch('product__categories', queryset=Category.objects.only(*CATEGORY_LIST_FIELDS))
+        ).in_bulk()
+        lines = []
+        for variant_id, quantity in quantities.items():
+            variant = variants.get(variant_id)
+            if variant is None:
+                continue  # variant deleted since it was added
+            line = CartItem(id=variant_id, variant=variant, quantity=quantity)
+            line.line_total = variant.product.price * quantity
+            lines.append(line)
+        return lines
+
+    def load(self):
+        if not self.state:
+            return None
+        lines = self.items()
+        cart = empty_cart(self.token)
+        cart.update(
+            created_at=self.state['created_at'],
+            updated_at=self.state['updated_at'],
+            items=lines,
+            total=sum((line.line_total for line in lines), Decimal('0.00')),
+            total_items=sum(line.quantity for line in lines),
+        )
+        return cart
+
+    def get_line(self, cart, variant_id):
+        return next((line for line in self.items() if line.pk == variant_id), None)
+
+    def add(self, quantities, cart=None):
+        held = dict((self.state or {}).get('items', {}))
+        errors = held_shortfalls(held, quantities)
+        if errors:
+            raise InsufficientStock(errors)
+        for variant_id, quantity in quantities.items():
+            held[variant_id] = held.get(variant_id, 0) + quantity
+        self.save(held)
+        return None
+
+    def update_line(self, line_id, variant_id, quantity):
+        """Set a line's variant and quantity; raises InsufficientStock, KeyError if the line is unknown."""
+        held = dict((self.state or {}).get('items', {}))
+        del held[line_id]
+        errors = held_shortfalls(held, {variant_id: quantity})
+        if errors:
+            raise InsufficientStock(errors)
+        held[variant_id] = held.get(variant_id, 0) + quantity
+        self.save(held)
+
+    def remove(self, line_id):
+        held = dict((self.state or {}).get('items', {}))
+        if held.pop(line_id, None) is None:
+            return False
+        self.save(held)
+        return True
+
+    def clear(self):
+        count = len((self.state or {}).get('items', {}))
+        self.save({})
+        return count
+
+    def persist(self, forget=True):
+        """
+        Write the cart to the database (keyed by its token), replacing what
+        an earlier persist() wrote there. Returns (cart, {line id: CartItem id}).
+        With forget=False the anonymous copy stays the caller's cart until
+        forget() is called, so a checkout that fails can simply be retried.
+        """
+        quantities = (self.state or {}).get('items')
+        if not quantities:
+            return None, {}
+        with transaction.atomic():
+            cart = Cart.objects.materialize(self.token)
+            cart.items.exclude(variant_id__in=quantities).delete()
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, variant_id=variant_id, quantity=quantity) for variant_id, quantity in quantities.items()],
+                update_conflicts=True,
+                unique_fields=['cart', 'variant'],
+                update_fields=['quantity'],
+            )
+            try:
+                with transaction.atomic():
+                    reserve(cart, quantities)
+            except InsufficientStock:
+                pass  # the order still re-checks stock; don't lose the cart over it
+        lines = dict(CartItem.objects.filter(cart=cart, variant_id__in=quantities).values_list('variant_id', 'pk'))
+        if forget:
+            self.forget()
+        return cart, lines
+
+    def forget(self):
+        """Drop the anonymous copy; the database cart written by persist() takes over."""
+        self.delete_state()
+        self._state = None
+
+    def checked_out(self):
+        """
+        Drop the anonymous copy and the token of the database cart it was
+        ordered from. A token that still named a stored cart would send every
+        later request to DatabaseCartStorage (get_cart_storage), so the next
+        cart starts anonymous under a new token instead.
+        """
+        self.forget()
+        self.token, self.retired_token = None, True
+
+    def finalize(self, response):
+        if self.new_token:
+            response.set_signed_cookie(
+                CART_TOKEN_COOKIE, self.token, max_age=settings.CART_ANONYMOUS_TTL, httponly=True, samesite='Lax'
+            )
+        elif self.retired_token:
+            response.delete_cookie(CART_TOKEN_COOKIE)
+
+
+class CacheCartStorage(AnonymousCartStorage):
+    def _key(self):
+        return f"carts:anonymous:{self.token}"
+
+    def _cache(self):
+        return caches[settings.CART_CACHE_ALIAS]
+
+    def read_state(self):
+        return self._cache().get(self._key()) if self.token else None
+
+    def write_state(self, state):
+        self._cache().set(self._key(), state, settings.CART_ANONYMOUS_TTL)
+
+    def delete_state(self):
+        self._cache().delete(self._key())
+
+
+class SignedCookieCartStorage(AnonymousCartStorage):
+    def __init__(self, request, session_key=None):
+        super().__init__(request, session_key)
+        self.cookie = None  # pending cookie value; '' deletes the cookie
+
+    def read_state(self):
+        value = self.request.get_signed_cookie(
+            CART_STATE_COOKIE, default=None, max_age=settings.CART_ANONYMOUS_TTL
+        )
+        if not value:
+            return None
+        state = json.loads(value)
+        # The cookie is the cart; a session_key naming another cart finds nothing.
+        if self.token and state.get('token') != self.token:
+            return None
+        return state
+
+    def write_state(self, state):
+        self.cookie = json.dumps(state, separators=(',', ':'))
+
+    def delete_state(self):
+        self.cookie = ''
+
+    def finalize(self, response):
+        super().finalize(response)
+        if self.cookie == '':
+            response.delete_cookie(CART_STATE_COOKIE)
+        elif self.cookie is not None:
+            response.set_signed_cookie(
+                CART_STATE_COOKIE, self.cookie, max_age=settings.CART_ANONYMOUS_TTL, httponly=True, samesite='Lax'
+            )
+
+
+CART_STORAGE_BACKENDS = {
+    'db': DatabaseCartStorage,
+    'cache': CacheCartStorage,
+    'cookie': SignedCookieCartStorage,
+}
+
+
+def get_cart_storage(request, session_key=None):
+    """
+    The storage holding the caller's cart. Signed-in callers, and anonymous
+    carts already written to the database, always get DatabaseCartStorage.
+    """
+    storage = CART_STORAGE_BACKENDS[settings.CART_STORAGE_BACKEND](request, session_key)
+    if not storage.anonymous:
+        return storage
+    if request.user.is_authenticated:
+        storage.persist()
+    elif not (storage.token and storage.state is None and Cart.objects.filter(session_key=storage.token).exists()):
+        return storage
+    return DatabaseCartStorage(request, session_key or storage.token, previous=storage)
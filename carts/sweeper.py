@@ -0,0 +1,85 @@
+"""
+Stale cart cleanup, run from `manage.py sweep_carts` or the periodic
+carts.tasks.sweep_stale_carts worker; never from a user request.
+
+Carts are deleted in primary-key batches, each in its own short
+transaction, so the sweeper never holds a long write lock on the database.
+Each run is logged, and its stats are kept in the shared catalog cache for
+the staff-only /api/carts/sweeper-stats/ endpoint (last_sweep()).
+"""
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from products.cache_utils import get_cache
+from .models import Cart
+
+logger = logging.getLogger(__name__)
+
+LAST_RUN_KEY = 'carts:sweeper:last-run'
+
+
+def _sweep(queryset, batch_size, max_batches, dry_run):
+    """Delete `queryset` batch by batch; returns (carts, items, batches)."""
+    carts = items = batches = 0
+    while max_batches is None or batches < max_batches:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        batches += 1
+        if dry_run:
+            carts += len(pks)
+            if len(pks) < batch_size:
+                break
+            queryset = queryset.filter(pk__gt=pks[-1])
+            continue
+        with transaction.atomic():
+            # Re-apply the filter: a cart that got an item since it was picked stays.
+            _, deleted = queryset.filter(pk__in=pks).delete()
+        carts += deleted.get(Cart._meta.label, 0)
+        items += deleted.get('carts.CartItem', 0)
+    return carts, items, batches
+
+
+def sweep_carts(empty_max_age=None, abandoned_max_age=None, batch_size=None, max_batches=None, dry_run=False):
+    """
+    Delete empty carts idle for longer than `empty_max_age` and carts with
+    items idle for longer than `abandoned_max_age` (timedeltas; defaults from
+    settings). Orders keep their own copy of the lines (checkout.OrderLine).
+    """
+    if empty_max_age is None:
+        empty_max_age = timedelta(hours=settings.CART_EMPTY_MAX_AGE_HOURS)
+    if abandoned_max_age is None:
+        abandoned_max_age = timedelta(days=settings.CART_ABANDONED_MAX_AGE_DAYS)
+    batch_size = batch_size or settings.CART_SWEEP_BATCH_SIZE
+
+    started = time.monotonic()
+    now = timezone.now()
+    empty = Cart.objects.empty().idle_since(now - empty_max_age)
+    abandoned = Cart.objects.non_empty().idle_since(now - abandoned_max_age)
+
+    empty_carts, _, empty_batches = _sweep(empty, batch_size, max_batches, dry_run)
+    abandoned_carts, abandoned_items, abandoned_batches = _sweep(abandoned, batch_size, max_batches, dry_run)
+
+    stats = {
+        'empty_carts': empty_carts,
+        'abandoned_carts': abandoned_carts,
+        'abandoned_items': abandoned_items,
+        'batches': empty_batches + abandoned_batches,
+        'seconds': round(time.monotonic() - started, 3),
+        'dry_run': dry_run,
+        'finished_at': timezone.now().isoformat(),
+    }
+    logger.info("Cart sweep: %s", stats, extra={'cart_sweep': stats})
+    if not dry_run:
+        # The sweeper runs in a command or task process, so keep the stats in the
+        # cache every process shares (see CATALOG_CACHE_BACKEND), not the default locmem one.
+        get_cache().set(LAST_RUN_KEY, stats, timeout=None)
+    return stats
+
+
+def last_sweep():
+    """Stats of the last completed sweep, from any process; None if none is recorded."""
+    return get_cache().get(LAST_RUN_KEY)
@@ -0,0 +1,36 @@
+import logging
+from background_task import background
+from background_task.models import Task
+from django.conf import settings
+from .reservations import reap_reservations
+from .sweeper import sweep_carts
+
+SWEEP_TASK_NAME = 'carts.sweep_stale_carts'
+REAP_TASK_NAME = 'carts.reap_stock_reservations'
+
+logger = logging.getLogger(__name__)
+
+
+@background(schedule=0)
+def sweep_stale_carts():
+    sweep_carts()
+
+
+@background(schedule=0)
+def reap_stock_reservations():
+    count = reap_reservations()
+    if count:
+        logger.info("Released %d expired stock reservations", count)
+
+
+def schedule_cart_sweeper():
+    """Queue the repeating sweeper and reservation reaper unless already queued; returns the names queued now."""
+    queued = []
+    for task, name, interval in (
+        (sweep_stale_carts, SWEEP_TASK_NAME, settings.CART_SWEEP_INTERVAL),
+        (reap_stock_reservations, REAP_TASK_NAME, settings.CART_RESERVATION_REAP_INTERVAL),
+    ):
+        if not Task.objects.filter(verbose_name=name).exists():
+            task(repeat=interval, verbose_name=name)
+            queued.append(name)
+    return queued
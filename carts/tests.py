@@ -1,3 +1,296 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products.cache_utils import get_cache
+from products.models import Product, ProductVariant
+from .models import Cart, CartItem, StockReservation
+from .reservations import reap_reservations
+from .sweeper import sweep_carts
+
+ADD_ITEM = '/api/carts/carts/current/add_item/'
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        self.variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=3)
+
+    def add(self, client, quantity):
+        return client.post(ADD_ITEM, {'variant_id': self.variant.pk, 'quantity': quantity}, format='json')
+
+    def test_reserved_stock_is_not_sold_to_another_cart_until_it_expires(self):
+        first, second = APIClient(), APIClient()
+        self.assertEqual(self.add(first, 3).status_code, 201)
+
+        self.assertEqual(self.add(second, 1).status_code, 400)
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.add(second, 1).status_code, 201)
+
+    def test_quantity_update_is_checked_against_variant_stock(self):
+        client = APIClient()
+        line_id = self.add(client, 1).json()['id']
+        session_key = client.get('/api/carts/carts/current/').json()['session_key']
+        url = f'/api/carts/cart-items/{line_id}/?session_key={session_key}'
+
+        response = client.put(url, {'variant': self.variant.pk, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)  # the product itself has quantity 0
+        self.assertEqual(StockReservation.objects.get().quantity, 3)
+
+        response = client.put(url, {'variant': self.variant.pk, 'quantity': 4}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.get().quantity, 3)
+
+    def test_reaper_deletes_only_expired_reservations(self):
+        first, second = APIClient(), APIClient()
+        self.add(first, 1)
+        self.add(second, 1)
+        expired = StockReservation.objects.first()
+        StockReservation.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(reap_reservations(batch_size=1), 1)
+        self.assertEqual(StockReservation.objects.count(), 1)
+        self.assertFalse(StockReservation.objects.filter(pk=expired.pk).exists())
+
+
+class AnonymousCartStorageTests:
+    """Run against each anonymous backend by the subclasses below."""
+
+    def setUp(self):
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        self.variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=3)
+        self.client = APIClient()
+
+    def test_cart_lives_outside_the_database(self):
+        response = self.client.post(ADD_ITEM, {'variant_id': self.variant.pk, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['id'], self.variant.pk)  # anonymous line ids are variant ids
+
+        cart = self.client.get('/api/carts/carts/current/').json()
+
+        self.assertEqual(cart['total_items'], 2)
+        self.assertEqual(cart['total'], '200.00')
+        self.assertFalse(Cart.objects.exists())
+
+    def test_stock_is_checked_on_add(self):
+        response = self.client.post(ADD_ITEM, {'variant_id': self.variant.pk, 'quantity': 4}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/carts/carts/current/').json()['total_items'], 0)
+
+    def test_sign_in_moves_the_cart_to_the_database(self):
+        self.client.post(ADD_ITEM, {'variant_id': self.variant.pk, 'quantity': 2}, format='json')
+        self.client.force_authenticate(get_user_model().objects.create_user('buyer@example.com', 'pw'))
+
+        cart = self.client.get('/api/carts/carts/current/').json()
+
+        self.assertEqual(cart['total_items'], 2)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+
+@override_settings(CART_STORAGE_BACKEND='cache')
+class CacheCartStorageTests(AnonymousCartStorageTests, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.CART_CACHE_ALIAS].clear()
+
+
+@override_settings(CART_STORAGE_BACKEND='cookie')
+class SignedCookieCartStorageTests(AnonymousCartStorageTests, TestCase):
+    pass
+
+
+class CartSweeperTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        self.variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=50)
+
+    def carts(self, count, items=0, idle=timedelta(0)):
+        pks = []
+        for _ in range(count):
+            cart = Cart.objects.create(session_key=f'cart-{Cart.objects.count()}')
+            if items:
+                CartItem.objects.create(cart=cart, variant=self.variant, quantity=items)
+            pks.append(cart.pk)
+        Cart.objects.filter(pk__in=pks).update(updated_at=timezone.now() - idle)
+        return pks
+
+    def test_stale_carts_are_deleted_in_batches(self):
+        self.carts(5, idle=timedelta(hours=25))
+        fresh_empty = self.carts(2, idle=timedelta(hours=1))
+        self.carts(3, items=2, idle=timedelta(days=31))
+        recent = self.carts(1, items=1, idle=timedelta(days=29))
+
+        stats = sweep_carts(batch_size=2)
+
+        self.assertEqual((stats['empty_carts'], stats['abandoned_carts'], stats['abandoned_items']), (5, 3, 3))
+        self.assertEqual(stats['batches'], 5)  # 2+2+1 empty, 2+1 abandoned
+        self.assertEqual(sorted(Cart.objects.values_list('pk', flat=True)), sorted(fresh_empty + recent))
+
+    def test_max_batches_bounds_a_run(self):
+        self.carts(5, idle=timedelta(hours=25))
+        self.carts(3, items=1, idle=timedelta(days=31))
+
+        stats = sweep_carts(batch_size=2, max_batches=1)
+
+        self.assertEqual((stats['empty_carts'], stats['abandoned_carts']), (2, 2))
+        self.assertEqual(Cart.objects.count(), 4)
+
+    def test_dry_run_only_counts(self):
+        self.carts(3, idle=timedelta(hours=25))
+
+        stats = sweep_carts(batch_size=2, dry_run=True)
+
+        self.assertEqual(stats['empty_carts'], 3)
+        self.assertEqual(Cart.objects.count(), 3)
+
+    def test_last_run_is_reported_to_staff(self):
+        self.carts(2, idle=timedelta(hours=25))
+        call_command('sweep_carts', stdout=StringIO())
+        client = APIClient()
+        self.assertIn(client.get('/api/carts/sweeper-stats/').status_code, (401, 403))
+
+        client.force_authenticate(get_user_model().objects.create_superuser('staff@example.com', 'pw'))
+        last_run = client.get('/api/carts/sweeper-stats/').json()['last_run']
+
+        self.assertEqual(last_run['empty_carts'], 2)
+        self.assertFalse(last_run['dry_run'])
+
+
+class CartDetailTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.variants = []
+        for n in range(5):
+            product = Product.objects.create(name=f'Tee {n}', slug=f'tee-{n}', price=10 + n, sku=f'TEE{n}')
+            self.variants.append(ProductVariant.objects.create(product=product, color='red', size='M', quantity=5))
+
+    def add(self, variants):
+        for variant in variants:
+            self.client.post(ADD_ITEM, {'variant_id': variant.pk, 'quantity': 2}, format='json')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/carts/carts/current/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        self.add(self.variants[:1])
+        small, _ = self.count_queries()
+
+        self.add(self.variants[1:])
+        large, cart = self.count_queries()
+
+        self.assertEqual(large, small)
+        self.assertEqual(len(cart['items']), 5)
+
+    def test_totals_are_computed_in_sql(self):
+        self.add(self.variants[:2])
+
+        cart = Cart.objects.for_detail().get()
+
+        self.assertEqual(cart.total_items, 4)
+        self.assertEqual(cart.total_amount, Decimal('42.00'))
+        self.assertEqual([item.line_total for item in cart.items.all()], [Decimal('20.00'), Decimal('22.00')])
+
+    def test_empty_cart_totals_are_zero(self):
+        cart = Cart.objects.create(session_key='empty')
+
+        cart = Cart.objects.for_detail().get(pk=cart.pk)
+
+        self.assertEqual((cart.total_items, cart.total_amount), (0, Decimal('0.00')))
+
+
+class CartReadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertNothingStored(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+    def test_reading_the_current_cart_stores_nothing(self):
+        response = self.client.get('/api/carts/carts/current/')
+
+        self.assertNothingStored(response)
+        self.assertEqual(response.json()['items'], [])
+        self.assertEqual(response.json()['total_items'], 0)
+
+    def test_listing_carts_and_lines_stores_nothing(self):
+        response = self.client.get('/api/carts/carts/')
+        self.assertNothingStored(response)
+        self.assertEqual(response.json()['results'][0]['id'], None)
+
+        self.assertNothingStored(self.client.get('/api/carts/carts/current/items/'))
+
+    def test_first_add_stores_the_cart(self):
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=3)
+
+        self.client.post(ADD_ITEM, {'variant_id': variant.pk, 'quantity': 1}, format='json')
+
+        self.assertEqual(Cart.objects.get().session_key, self.client.session.session_key)
+
+
+class AddItemsTests(TestCase):
+    url = '/api/carts/carts/current/add_items/'
+
+    def setUp(self):
+        self.client = APIClient()
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        self.red = ProductVariant.objects.create(product=product, color='red', size='M', quantity=3)
+        self.blue = ProductVariant.objects.create(product=product, color='blue', size='M', quantity=1)
+
+    def add_items(self, *items):
+        items = [{'variant_id': variant.pk, 'quantity': quantity} for variant, quantity in items]
+        return self.client.post(self.url, {'items': items}, format='json')
+
+    def test_lines_are_added_and_the_cart_returned(self):
+        response = self.add_items((self.red, 1), (self.blue, 1), (self.red, 1))
+
+        self.assertEqual(response.status_code, 200, response.content)
+        cart = response.json()
+        self.assertEqual(cart['total_items'], 3)
+        self.assertEqual(cart['total'], '300.00')
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('variant', 'quantity')),
+            sorted([(self.red.pk, 2), (self.blue.pk, 1)]),
+        )
+
+    def test_nothing_is_added_unless_every_line_fits(self):
+        self.add_items((self.red, 1))
+
+        response = self.add_items((self.red, 2), (self.blue, 2))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.blue.pk), response.json()['items'])
+        self.assertEqual(list(CartItem.objects.values_list('variant', 'quantity')), [(self.red.pk, 1)])
+        self.assertEqual(list(StockReservation.objects.values_list('variant', 'quantity')), [(self.red.pk, 1)])
+
+    def test_stock_already_in_the_cart_counts(self):
+        self.add_items((self.red, 2))
+
+        self.assertEqual(self.add_items((self.red, 2)).status_code, 400)
+        self.assertEqual(self.add_items((self.red, 1)).json()['total_items'], 3)
+
+    def test_invalid_lines_are_rejected(self):
+        self.assertEqual(self.client.post(self.url, {'items': []}, format='json').status_code, 400)
+        self.assertEqual(self.add_items((self.red, 0)).status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
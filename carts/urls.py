@@ -1,10 +1,11 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from .views import CartViewSet, CartItemViewSet
+from .views import CartViewSet, CartItemViewSet, CartSweepStatsView
 
 router = DefaultRouter()
 router.register(r'carts', CartViewSet, basename='cart')
 router.register(r'cart-items', CartItemViewSet, basename='cartitem')
 urlpatterns = [
     path('', include(router.urls)),
+    path('sweeper-stats/', CartSweepStatsView.as_view(), name='cart-sweeper-stats'),
 ]
\ No newline at end of file
@@ -2,77 +2,142 @@
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from .models import Cart, CartItem
-from .serializers import CartSerializer, CartItemSerializer,UpdateCartItemSerializer,AddToCartSerializer
+from .reservations import InsufficientStock, reserve
+from .storage import DatabaseCartStorage, get_cart_storage
+from .sweeper import last_sweep
+from .serializers import CartSerializer, CartItemSerializer,UpdateCartItemSerializer,AddToCartSerializer,empty_cart,AddItemsSerializer
 from products.models import ProductVariant
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 
-class CartViewSet(viewsets.GenericViewSet, 
+class CartStorageMixin:
+    """The caller's cart storage (carts.storage), resolved once per request; it may set cookies on the response."""
+
+    def get_cart_storage(self):
+        if not hasattr(self, '_cart_storage'):
+            data = self.request.data if isinstance(self.request.data, dict) else {}
+            session_key = self.request.query_params.get('session_key') or data.get('session_key')
+            self._cart_storage = get_cart_storage(self.request, session_key)
+        return self._cart_storage
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if hasattr(self, '_cart_storage'):
+            self._cart_storage.finalize(response)
+        return response
+
+
+class CartViewSet(CartStorageMixin,
+                 viewsets.GenericViewSet, 
                  mixins.RetrieveModelMixin,
                  mixins.ListModelMixin):
     serializer_class = CartSerializer
     permission_classes = [AllowAny]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['session_key']
+
+    # Reads never create sessions or carts: until the first item is added the
+    # cart is virtual and rendered as empty_cart(). See add_item.
+    def get_session_key(self):
+        return self.get_cart_storage().session_key
+
     def get_queryset(self):
-        session_key = self.request.query_params.get('session_key')
-        if not session_key:
-            self.request.session.create()
-            session_key = self.request.session.session_key
-        
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-        return Cart.objects.filter(session_key=session_key)
-    
+        session_key = self.get_session_key()
+        if not session_key or self.get_cart_storage().anonymous:
+            return Cart.objects.none()
+        return Cart.objects.for_detail().filter(session_key=session_key)
+
     def get_object(self):
-        session_key = self.request.session.session_key
-        if not session_key:
-            self.request.session.create()
-            session_key = self.request.session.session_key
-        
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-        return cart
-    
-    @action(detail=True, methods=['post'])
-    def add_item(self, request, pk=None):
+        storage = self.get_cart_storage()
+        return storage.load() or empty_cart(storage.session_key)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        results = response.data['results'] if isinstance(response.data, dict) else response.data
+        if not results:
+            storage = self.get_cart_storage()
+            cart = storage.load() if storage.anonymous else None  # a stored cart would have been listed
+            page = self.paginate_queryset([cart or empty_cart(storage.session_key)])
+            data = self.get_serializer(page, many=True).data
+            response = self.get_paginated_response(data) if page is not None else Response(data)
+        return response
+
+    def add_to_cart(self, pk, quantities):
+        """
+        Add {variant_id: quantity} to cart `pk` (or the caller's cart for
+        'current'); returns (storage, cart, None) or (None, None, error
+        response). Nothing is written if a line does not fit.
+        """
+        storage, cart = self.get_cart_storage(), None
+        if pk != 'current':
+            cart = Cart.objects.filter(pk=pk).first() if str(pk).isdigit() else None
+            if cart is None:
+                return None, None, Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+            storage = DatabaseCartStorage(self.request)  # numbered carts are stored carts
         try:
-            cart = Cart.objects.get(pk=pk)
-        except Cart.DoesNotExist:
-            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+            cart = storage.add(quantities, cart)
+        except InsufficientStock as e:
+            return None, None, Response({"items": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return storage, cart, None
 
+    @action(detail=True, methods=['post'])
+    def add_item(self, request, pk=None):
         add_serializer = AddToCartSerializer(data=request.data)
+        if not add_serializer.is_valid():
+            return Response(add_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        if add_serializer.is_valid():
-            variant = add_serializer.validated_data['variant']
-            quantity = add_serializer.validated_data['quantity']
+        variant = add_serializer.validated_data['variant']
+        quantity = add_serializer.validated_data['quantity']
 
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                variant=variant,
-                defaults={'quantity': quantity}
-            )
+        storage, cart, error = self.add_to_cart(pk, {variant.pk: quantity})
+        if error is not None:
+            if 'items' in error.data:
+                error.data = {"non_field_errors": list(error.data['items'].values())}
+            return error
+
+        serializer = CartItemSerializer(storage.get_line(cart, variant.pk))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def add_items(self, request, pk=None):
+        """
+        Add several variants at once: {"items": [{"variant_id": 1, "quantity": 2}, ...]}.
 
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
+        Available-to-sell for every line (including what is already in the
+        cart) is checked in one query; nothing is added unless all lines fit.
+        Returns the updated cart.
+        """
+        add_serializer = AddItemsSerializer(data=request.data)
+        if not add_serializer.is_valid():
+            return Response(add_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = CartItemSerializer(cart_item)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        storage, cart, error = self.add_to_cart(pk, add_serializer.validated_data['items'])
+        if error is not None:
+            return error
 
-        return Response(add_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        cart = storage.load() if cart is None else Cart.objects.for_detail().get(pk=cart.pk)
+        return Response(self.get_serializer(cart).data, status=status.HTTP_200_OK)
     
     @action(detail=True, methods=['get'])
     def items(self, request, pk=None):
+        if pk == 'current':
+            serializer = CartItemSerializer(self.get_cart_storage().items(), many=True, context=self.get_serializer_context())
+            return Response(serializer.data)
         try:
             cart = Cart.objects.get(id=pk)  # ← Get cart by ID from URL
-            items = cart.items.all()
-            serializer = CartItemSerializer(items, many=True)
+            items = CartItem.objects.for_detail().filter(cart=cart)
+            serializer = CartItemSerializer(items, many=True, context=self.get_serializer_context())
             return Response(serializer.data)
-        except Cart.DoesNotExist:
+        except (Cart.DoesNotExist, ValueError):
             return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
 
 class CartItemViewSet(
+    CartStorageMixin,
     viewsets.GenericViewSet,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -80,6 +145,10 @@ class CartItemViewSet(
     mixins.UpdateModelMixin,
     mixins.DestroyModelMixin
 ):
+    """
+    Lines of the caller's cart. For anonymous carts kept in the cache or a
+    cookie (carts.storage) the line id is the variant id.
+    """
     permission_classes = [AllowAny]
     serializer_class = UpdateCartItemSerializer
     filter_backends = [DjangoFilterBackend]
@@ -95,31 +164,74 @@ class CartItemViewSet(
             return CartItem.objects.filter(cart=cart)
         except Cart.DoesNotExist:
             return CartItem.objects.none()
+
+    def get_anonymous_storage(self):
+        storage = self.get_cart_storage()
+        return storage if storage.anonymous else None
+
+    def get_anonymous_line(self, storage):
+        pk = self.kwargs[self.lookup_field]
+        line = storage.get_line(None, int(pk)) if str(pk).isdigit() else None
+        if line is None:
+            raise Http404
+        return line
+
+    def list(self, request, *args, **kwargs):
+        storage = self.get_anonymous_storage()
+        if storage is None:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(storage.items())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data) if page is not None else Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        storage = self.get_anonymous_storage()
+        if storage is None:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_serializer(self.get_anonymous_line(storage)).data)
+
+    def update_anonymous(self, storage, request):
+        line = self.get_anonymous_line(storage)
+        serializer = self.get_serializer(line, data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        variant, quantity = serializer.validated_data['variant'], serializer.validated_data['quantity']
+        try:
+            storage.update_line(line.pk, variant.pk, quantity)
+        except InsufficientStock as e:
+            return Response({"error": next(iter(e.errors.values()))}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(storage.get_line(None, variant.pk)).data)
     
     def update(self, request, *args, **kwargs):
+        storage = self.get_anonymous_storage()
+        if storage is not None:
+            return self.update_anonymous(storage, request)
+
         cart_item = self.get_object()
         serializer = self.get_serializer(cart_item, data=request.data)
     
         if serializer.is_valid():
-            new_quantity = serializer.validated_data['quantity']
-            
-            # Use product quantity instead of variant quantity
-            max_available = cart_item.variant.product.quantity
-            
-            print(f"Requested: {new_quantity}, Available: {max_available}")  # Debug
-            
-            if new_quantity > max_available:
-                return Response(
-                    {"error": f"Only {max_available} items available"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            serializer.save()
+            # reserve() checks the new quantity against available-to-sell and rolls the change back if it does not fit.
+            try:
+                with transaction.atomic():
+                    cart_item = serializer.save()
+                    reserve(cart_item.cart, [cart_item.variant_id])
+            except InsufficientStock as e:
+                return Response({"error": next(iter(e.errors.values()))}, status=status.HTTP_400_BAD_REQUEST)
             return Response(serializer.data)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     def destroy(self, request, *args, **kwargs):
         """Clear a specific cart item"""
+        storage = self.get_anonymous_storage()
+        if storage is not None:
+            pk = kwargs[self.lookup_field]
+            if not (str(pk).isdigit() and storage.remove(int(pk))):
+                return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(
+                {"message": "Item removed from cart successfully"},
+                status=status.HTTP_204_NO_CONTENT
+            )
         try:
             cart_item = self.get_object()
             cart_item.delete()
@@ -135,6 +247,16 @@ class CartItemViewSet(
 
     @action(detail=False, methods=['delete'])
     def clear_all(self, request):
+        storage = self.get_anonymous_storage()
+        if storage is not None:
+            if storage.state is None:
+                return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+            items_count = storage.clear()
+            return Response({
+                "message": f"Cleared {items_count} items from cart",
+                "cart_id": None
+            }, status=status.HTTP_200_OK)
+
         session_key = self.request.query_params.get('session_key')
         if not session_key:
             return Response(
@@ -153,4 +275,12 @@ class CartItemViewSet(
             }, status=status.HTTP_200_OK)
             
         except Cart.DoesNotExist:
-            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+            return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class CartSweepStatsView(APIView):
+    """Stats of the last stale-cart sweep (carts.sweeper), staff only."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'last_run': last_sweep()})
@@ -1,4 +1,7 @@
 from django.contrib import admin
-from .models import Order
+from .models import EmailOutbox, IdempotencyKey, Order, OrderLine
 # Register your models here.
-admin.site.register(Order)
\ No newline at end of file
+admin.site.register(Order)
+admin.site.register(OrderLine)
+admin.site.register(IdempotencyKey)
+admin.site.register(EmailOutbox)
\ No newline at end of file
@@ -0,0 +1,281 @@
+"""
+Payment gateway client (settings.PAYMENT_GATEWAY_BACKEND):
+
+- 'sslcommerz': the SSLCommerz API (sandbox or live, per SSLCZ_SANDBOX)
+  over one pooled keep-alive session per process.
+- 'fake': an in-process stand-in that never leaves the process, for
+  offline development and checkout load tests.
+
+Calls have separate connect and read timeouts. A circuit breaker fails
+fast while the gateway is down, and a retry budget caps retries at a
+fraction of recent calls, so a gateway outage cannot multiply its own
+traffic or pin every worker on a dead socket.
+
+Async views (ASGI deployments) use get_async_gateway(), which awaits the
+same pooled client from a worker thread.
+"""
+import logging
+import threading
+import time
+import uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {502, 503, 504}
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or gave an unusable answer."""
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit is open: recent calls failed, so this one was not attempted."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; after `reset_timeout`
+    seconds one trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures, self.opened_at, self.trial_running = 0, None, False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Every call deposits `ratio` of a retry token and every retry spends
+    one, so retries stay below `ratio` of traffic (plus an initial
+    `minimum`, so a quiet process can still retry at all).
+    """
+
+    def __init__(self, ratio, minimum=3):
+        self.ratio = ratio
+        self.cap = max(minimum, 1)
+        self.tokens = float(minimum)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class SSLCommerzBackend:
+    def __init__(self):
+        host = 'sandbox.sslcommerz.com' if settings.SSLCZ_SANDBOX else 'securepay.sslcommerz.com'
+        self.init_url = f"https://{host}/gwprocess/v4/api.php"
+        self.validation_url = f"https://{host}/validator/api/validationserverAPI.php"
+        self.timeout = (settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT, settings.PAYMENT_GATEWAY_READ_TIMEOUT)
+        self.session = requests.Session()
+        # Retries are the client's job (breaker + budget); the adapter only pools.
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE, max_retries=0
+        )
+        self.session.mount('https://', adapter)
+
+    def credentials(self):
+        return {'store_id': settings.SSLCZ_STORE_ID, 'store_passwd': settings.SSLCZ_STORE_PASS}
+
+    def init_payment(self, payload):
+        return self.session.post(self.init_url, data={**payload, **self.credentials()}, timeout=self.timeout)
+
+    def validate(self, val_id):
+        params = {'val_id': val_id, 'format': 'json', **self.credentials()}
+        return self.session.get(self.validation_url, params=params, timeout=self.timeout)
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+
+class FakeGatewayBackend:
+    """
+    Accepts every payment after PAYMENT_FAKE_LATENCY seconds. complete()
+    returns the form data the real gateway would POST to success_url, so
+    a load test can drive the whole checkout without the network.
+    """
+
+    def __init__(self):
+        self.latency = settings.PAYMENT_FAKE_LATENCY
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def init_payment(self, payload):
+        time.sleep(self.latency)
+        session_key = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[payload['tran_id']] = {
+                'session_key': session_key,
+                'val_id': uuid.uuid4().hex[:16],
+                'amount': payload['total_amount'],
+                'currency': payload.get('currency', 'BDT'),
+            }
+        return FakeResponse({
+            'status': 'SUCCESS',
+            'sessionkey': session_key,
+            'GatewayPageURL': f"fake://gateway/pay/{session_key}",
+        })
+
+    def validate(self, val_id):
+        time.sleep(self.latency)
+        with self.lock:
+            for tran_id, payment in self.sessions.items():
+                if payment['val_id'] == val_id:
+                    return FakeResponse({
+                        'status': 'VALID', 'tran_id': tran_id, 'val_id': val_id,
+                        'amount': payment['amount'], 'currency': payment['currency'],
+                    })
+        return FakeResponse({'status': 'INVALID_TRANSACTION'})
+
+    def complete(self, tran_id):
+        with self.lock:
+            payment = self.sessions[tran_id]
+        return {'tran_id': tran_id, 'val_id': payment['val_id'], 'status': 'VALID', 'amount': payment['amount']}
+
+
+GATEWAY_BACKENDS = {
+    'sslcommerz': SSLCommerzBackend,
+    'fake': FakeGatewayBackend,
+}
+
+
+class PaymentGatewayClient:
+    def __init__(self, backend, breaker, budget, retries):
+        self.backend = backend
+        self.breaker = breaker
+        self.budget = budget
+        self.retries = retries
+
+    def _call(self, name, *args):
+        """Run backend.<name>(*args) and return its JSON body; raises GatewayError."""
+        if not self.breaker.allow():
+            raise GatewayUnavailable("Payment gateway is unavailable, try again shortly")
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                response = getattr(self.backend, name)(*args)
+                if response.status_code in RETRY_STATUSES:
+                    raise GatewayError(f"Gateway returned HTTP {response.status_code}")
+                data = response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout, GatewayError) as e:
+                # Connection failures and 5xx: retry (opening a session or validating is safe to repeat).
+                error = e
+                retry = True
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # Read timeouts and bad bodies: a slow gateway is not helped by more traffic.
+                error = e
+                retry = False
+            except Exception:
+                # Anything else still ends the call (and a half-open trial) as a failure.
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return data
+
+            attempt += 1
+            if not retry or attempt > self.retries or not self.budget.withdraw():
+                self.breaker.record_failure()
+                logger.warning("Payment gateway %s failed after %d attempt(s): %s", name, attempt, error)
+                raise GatewayError(str(error)) from error
+            time.sleep(0.1 * 2 ** (attempt - 1))
+
+    def init_payment(self, payload):
+        """Open a payment session; returns the gateway's JSON (status, GatewayPageURL, ...)."""
+        return self._call('init_payment', payload)
+
+    def validate(self, val_id):
+        """Look up a completed payment by the val_id posted to the success URL."""
+        return self._call('validate', val_id)
+
+
+class AsyncPaymentGatewayClient:
+    """
+    The same client for async views. Calls run on a worker thread with the
+    shared pooled session, so the event loop never waits on the gateway.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def init_payment(self, payload):
+        return await sync_to_async(self.client.init_payment, thread_sensitive=False)(payload)
+
+    async def validate(self, val_id):
+        return await sync_to_async(self.client.validate, thread_sensitive=False)(val_id)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide client, built on first use from settings."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaymentGatewayClient(
+                    GATEWAY_BACKENDS[settings.PAYMENT_GATEWAY_BACKEND](),
+                    CircuitBreaker(settings.PAYMENT_GATEWAY_BREAKER_THRESHOLD, settings.PAYMENT_GATEWAY_BREAKER_RESET),
+                    RetryBudget(settings.PAYMENT_GATEWAY_RETRY_RATIO),
+                    settings.PAYMENT_GATEWAY_RETRIES,
+                )
+    return _client
+
+
+def get_async_gateway():
+    """get_gateway() for async views; shares its session, breaker and retry budget."""
+    return AsyncPaymentGatewayClient(get_gateway())
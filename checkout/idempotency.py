@@ -0,0 +1,117 @@
+"""
+Run-once requests. The first request with a (scope, key) claims a row in
+IdempotencyKey, runs, and stores its response; repeats are answered from
+that row with one lookup on the unique (scope, key) index and nothing is
+recomputed. Failed runs (5xx/4xx or an exception) release the key so the
+client can fix the request and try again.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.shortcuts import redirect
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_fingerprint(request):
+    """Hash of the request body, to spot a key reused for a different request."""
+    return hashlib.sha256(JSONRenderer().render(request.data)).hexdigest()
+
+
+def _claim(scope, key, fingerprint):
+    """(record, True) if this call now owns the key, else (existing record, False)."""
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(scope=scope, key=key, fingerprint=fingerprint, created_at=now), True
+        except IntegrityError:
+            # Claimed concurrently; fall through to that caller's row.
+            record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+            if record is None:
+                return _claim(scope, key, fingerprint)
+
+    expired = record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    stalled = record.status_code is None and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    if expired or stalled:
+        # Take the key over; the conditional UPDATE lets only one caller win.
+        taken = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+            fingerprint=fingerprint, status_code=None, body=None, location='', created_at=now
+        )
+        if taken:
+            record.fingerprint, record.status_code, record.body, record.location, record.created_at = (
+                fingerprint, None, None, '', now
+            )
+            return record, True
+    return record, False
+
+
+def _replay(record):
+    if record.location:
+        response = redirect(record.location)
+    else:
+        response = Response(record.body, status=record.status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent_response(scope, key, fingerprint, run):
+    """
+    The response of run() for the first request with this key, and the
+    stored copy of it for every repeat.
+    """
+    record, owner = _claim(scope, key, fingerprint)
+    if not owner:
+        if record.status_code is None:
+            return Response(
+                {"error": "A request with this idempotency key is still being processed"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if record.fingerprint != fingerprint:
+            logger.warning("Idempotency key %s:%s reused with a different request", scope, key)
+            if not record.location:
+                return Response(
+                    {"error": "This idempotency key was already used for a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+        return _replay(record)
+
+    try:
+        response = run()
+    except Exception:
+        record.delete()
+        raise
+    if response.status_code >= 400:
+        record.delete()
+        return response
+
+    record.status_code = response.status_code
+    if response.has_header('Location') and not isinstance(response, Response):
+        record.location = response['Location']
+    else:
+        record.body = json.loads(JSONRenderer().render(response.data))
+    record.save(update_fields=['status_code', 'body', 'location'])
+    return response
+
+
+def purge_expired_keys(batch_size=1000):
+    """Delete keys older than IDEMPOTENCY_KEY_TTL in primary-key batches; returns the number deleted."""
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted = 0
+    while True:
+        pks = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        count, _ = IdempotencyKey.objects.filter(pk__in=pks).delete()
+        deleted += count
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from checkout.outbox import deliver_outbox
+from checkout.tasks import schedule_email_outbox
+
+
+class Command(BaseCommand):
+    help = "Send due emails from the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            help='Number of emails claimed per batch',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=None,
+            help='Stop after this many batches (default: until nothing is due)',
+        )
+        parser.add_argument(
+            '--schedule',
+            action='store_true',
+            help='Queue the periodic outbox worker instead of sending now',
+        )
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            if schedule_email_outbox():
+                self.stdout.write(self.style.SUCCESS("Scheduled the email outbox worker"))
+            else:
+                self.stdout.write("Email outbox worker is already scheduled")
+            return
+
+        stats = deliver_outbox(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {stats['sent']}, retrying {stats['retried']}, failed {stats['failed']} "
+            f"in {stats['batches']} batches"
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0005_order_city'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-placed_at', '-id'], name='order_placed_id_idx'),
+        ),
+    ]
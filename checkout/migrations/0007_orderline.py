@@ -0,0 +1,64 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_order_lines(apps, schema_editor):
+    # Lines from the cart items still attached to each order, priced at the
+    # product's current price (the purchase price was never recorded).
+    Order = apps.get_model('checkout', 'Order')
+    OrderLine = apps.get_model('checkout', 'OrderLine')
+    links = Order.cart_items.through.objects.select_related('cartitem__variant__product').order_by('order_id', 'cartitem_id')
+    lines = []
+    for link in links.iterator(chunk_size=1000):
+        item = link.cartitem
+        variant = item.variant
+        product = variant.product
+        lines.append(OrderLine(
+            order_id=link.order_id,
+            variant=variant,
+            product=product,
+            product_name=product.name,
+            sku=product.sku,
+            color=variant.color,
+            size=variant.size,
+            unit_price=product.price,
+            quantity=item.quantity,
+            line_total=product.price * item.quantity,
+        ))
+        if len(lines) >= 1000:
+            OrderLine.objects.bulk_create(lines)
+            lines = []
+    OrderLine.objects.bulk_create(lines)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_home_collection_idx'),
+        ('checkout', '0006_order_placed_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=255)),
+                ('sku', models.CharField(blank=True, max_length=100, null=True)),
+                ('color', models.CharField(blank=True, max_length=20)),
+                ('size', models.CharField(blank=True, max_length=5)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='checkout.order')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='products.product')),
+                ('variant', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='products.productvariant')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
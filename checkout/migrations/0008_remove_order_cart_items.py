@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0007_orderline'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='order',
+            name='cart_items',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.24 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0007_stock_reservation'),
+        ('checkout', '0010_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='cart_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='carts.cartitem'),
+        ),
+    ]
@@ -1,12 +1,18 @@
 from django.db import models
+from django.utils import timezone
 from carts.models import CartItem
+from products.models import Product, ProductVariant
 SHIPPING_METHOD_CHOICES = [
         ('cash_on_delivery', 'Cash on Delivery'),
         ('online_payment', 'Online Payment'),
     ]
 
+class OrderQuerySet(models.QuerySet):
+    def with_lines(self):
+        return self.prefetch_related('lines')
+
+
 class Order(models.Model):
-    cart_items = models.ManyToManyField(CartItem, related_name='orders')
     total = models.DecimalField(max_digits=10, decimal_places=2,null=True)  # better for money
     full_name = models.CharField(max_length=255)
     address = models.TextField()
@@ -21,6 +27,133 @@ class Order(models.Model):
     is_paid = models.BooleanField(default=False)
     transaction_id = models.CharField(max_length=100, null=True, blank=True) 
     city = models.CharField(max_length=100, null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination key for OrderViewSet (serverside.pagination).
+            models.Index(fields=['-placed_at', '-id'], name='order_placed_id_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} for {self.full_name} - {self.get_shipping_method_display()}"
 
+
+    def save_lines(self, lines):
+        """Attach unsaved OrderLines (see OrderLine.snapshot) to this order in one INSERT."""
+        for line in lines:
+            line.order = self
+        return OrderLine.objects.bulk_create(lines)
+
+
+class OrderLine(models.Model):
+    """
+    What was bought, as it was at purchase time. Lines never change and
+    need nothing from the live catalog; variant and product are kept only
+    as links and are nulled if those rows are deleted.
+    """
+    order = models.ForeignKey(Order, related_name='lines', on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, related_name='order_lines', null=True, on_delete=models.SET_NULL)
+    product = models.ForeignKey(Product, related_name='order_lines', null=True, on_delete=models.SET_NULL)
+    # The cart line it was ordered from; deleted (releasing its reservation) once the order is paid.
+    cart_item = models.ForeignKey(CartItem, related_name='order_lines', null=True, blank=True, on_delete=models.SET_NULL)
+    product_name = models.CharField(max_length=255)
+    sku = models.CharField(max_length=100, null=True, blank=True)
+    color = models.CharField(max_length=20, blank=True)
+    size = models.CharField(max_length=5, blank=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    line_total = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name} ({self.color}/{self.size})"
+
+    @classmethod
+    def snapshot(cls, cart_items):
+        """Unsaved lines for these cart items at the current product prices."""
+        lines = []
+        for item in cart_items:
+            variant = item.variant
+            product = variant.product
+            lines.append(cls(
+                cart_item=item,
+                variant=variant,
+                product=product,
+                product_name=product.name,
+                sku=product.sku,
+                color=variant.color,
+                size=variant.size,
+                unit_price=product.price,
+                quantity=item.quantity,
+                line_total=product.price * item.quantity,
+            ))
+        return lines
+
+
+class IdempotencyKey(models.Model):
+    """
+    The outcome of a request that must not run twice (see checkout.idempotency):
+    an order create keyed by the client's Idempotency-Key header, or a
+    payment callback keyed by tran_id. status_code is null while running.
+    """
+    scope = models.CharField(max_length=32)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    body = models.JSONField(null=True)
+    location = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_scope_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+
+class EmailOutboxQuerySet(models.QuerySet):
+    def due(self, now=None):
+        return self.filter(status=EmailOutbox.PENDING, next_attempt_at__lte=now or timezone.now())
+
+
+class EmailOutbox(models.Model):
+    """An email waiting for (or done with) delivery by checkout.outbox."""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    html = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = EmailOutboxQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The worker's "what is due" scan.
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to_email} ({self.status})"
@@ -0,0 +1,179 @@
+"""
+Email outbox delivery. Requests only insert an EmailOutbox row
+(checkout.emails_utils.send_checkout_email); deliver_outbox() claims due
+rows in batches and sends them to Brevo from a fixed-size thread pool that
+shares one keep-alive session. Failures are retried with exponential
+backoff until EMAIL_OUTBOX_MAX_ATTEMPTS, then left as 'failed'.
+
+Run it with `manage.py deliver_emails`, or `--schedule` for the periodic
+checkout.tasks.deliver_email_outbox worker.
+"""
+import logging
+import os
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+import requests
+from requests.adapters import HTTPAdapter
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+BREVO_URL = 'https://api.brevo.com/v3/smtp/email'
+SENDER = {
+    'name': 'Aurify Studio',
+    'email': 'aursifystudio@gmail.com',
+}
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class BrevoSender:
+    """Posts emails to the Brevo API over one pooled session."""
+
+    def __init__(self, api_key, pool_size):
+        self.api_key = api_key
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+        self.timeout = settings.EMAIL_OUTBOX_TIMEOUT
+
+    def send(self, email):
+        try:
+            response = self.session.post(
+                BREVO_URL,
+                headers={'api-key': self.api_key, 'Content-Type': 'application/json'},
+                json={
+                    'sender': SENDER,
+                    'to': [{'email': email.to_email}],
+                    'subject': email.subject,
+                    'htmlContent': email.html,
+                },
+                timeout=self.timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            raise DeliveryError(str(e))
+        if response.status_code != 201:
+            # Bad requests won't get better; rate limits and server errors might.
+            retry = response.status_code == 429 or response.status_code >= 500
+            raise DeliveryError(f"Brevo API {response.status_code}: {response.text[:500]}", retry=retry)
+
+
+_sender = None
+
+
+def get_sender():
+    """The process-wide sender, or None while BREVO_API_KEY is not set."""
+    global _sender
+    api_key = os.environ.get('BREVO_API_KEY')
+    if not api_key:
+        return None
+    if _sender is None or _sender.api_key != api_key:
+        _sender = BrevoSender(api_key, settings.EMAIL_OUTBOX_CONCURRENCY)
+    return _sender
+
+
+def backoff(attempts):
+    """Seconds before retry number `attempts`: exponential, capped at an hour, with jitter."""
+    delay = min(settings.EMAIL_OUTBOX_RETRY_BASE * 2 ** (attempts - 1), 3600)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claim(batch_size, now):
+    """Mark up to batch_size due rows as ours; returns them."""
+    # Rows claimed by a worker that died are due again after the claim timeout.
+    # That counts as an attempt, so a message that keeps killing the worker
+    # still runs out of attempts and ends up 'failed'.
+    reclaimed = EmailOutbox.objects.filter(
+        status=EmailOutbox.SENDING,
+        claimed_at__lt=now - timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT),
+    ).update(
+        attempts=F('attempts') + 1,
+        status=Case(
+            When(attempts__gte=settings.EMAIL_OUTBOX_MAX_ATTEMPTS - 1, then=Value(EmailOutbox.FAILED)),
+            default=Value(EmailOutbox.PENDING),
+        ),
+        claimed_by='',
+        last_error='Worker stopped while sending',
+    )
+    if reclaimed:
+        logger.warning("Email outbox: reclaimed %d rows left in 'sending'", reclaimed)
+
+    token = uuid.uuid4().hex
+    pks = list(EmailOutbox.objects.due(now).order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return []
+    EmailOutbox.objects.filter(pk__in=pks, status=EmailOutbox.PENDING).update(
+        status=EmailOutbox.SENDING, claimed_by=token, claimed_at=now
+    )
+    return list(EmailOutbox.objects.filter(claimed_by=token, status=EmailOutbox.SENDING))
+
+
+def _send(sender, email):
+    try:
+        sender.send(email)
+    except DeliveryError as e:
+        return e
+    return None
+
+
+def deliver_batch(sender, batch_size=None):
+    """Claim and send one batch; returns (sent, retried, failed)."""
+    now = timezone.now()
+    emails = _claim(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE, now)
+    if not emails:
+        return 0, 0, 0
+
+    with ThreadPoolExecutor(max_workers=settings.EMAIL_OUTBOX_CONCURRENCY) as pool:
+        errors = list(pool.map(lambda email: _send(sender, email), emails))
+
+    sent, retried, failed = [], [], []
+    finished_at = timezone.now()
+    for email, error in zip(emails, errors):
+        email.attempts += 1
+        email.claimed_by = ''
+        if error is None:
+            email.status, email.sent_at, email.last_error = EmailOutbox.SENT, finished_at, ''
+            sent.append(email)
+            continue
+        email.last_error = str(error)
+        if error.retry and email.attempts < settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            email.status = EmailOutbox.PENDING
+            email.next_attempt_at = finished_at + timedelta(seconds=backoff(email.attempts))
+            retried.append(email)
+        else:
+            email.status = EmailOutbox.FAILED
+            failed.append(email)
+            logger.error("Email %s to %s failed for good: %s", email.pk, email.to_email, error)
+
+    EmailOutbox.objects.bulk_update(
+        emails, ['status', 'attempts', 'claimed_by', 'sent_at', 'last_error', 'next_attempt_at']
+    )
+    return len(sent), len(retried), len(failed)
+
+
+def deliver_outbox(batch_size=None, max_batches=None, sender=None):
+    """Send due emails batch by batch until none are due; returns counts."""
+    sender = sender or get_sender()
+    stats = {'sent': 0, 'retried': 0, 'failed': 0, 'batches': 0}
+    if sender is None:
+        logger.error("BREVO_API_KEY not set; outbox left as is")
+        return stats
+    while max_batches is None or stats['batches'] < max_batches:
+        sent, retried, failed = deliver_batch(sender, batch_size)
+        if not (sent or retried or failed):
+            break
+        stats['batches'] += 1
+        stats['sent'] += sent
+        stats['retried'] += retried
+        stats['failed'] += failed
+    if stats['batches']:
+        logger.info("Email outbox: %s", stats)
+    return stats
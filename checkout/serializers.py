@@ -1,6 +1,5 @@
-from .models import Order
+from .models import Order, OrderLine
 from rest_framework import serializers
-from .models import Order
 from carts.models import CartItem
 from django.db.models import Sum, Count
 from django.utils import timezone
@@ -8,11 +7,21 @@ from django.db.models.functions import ExtractYear, ExtractMonth
 from django.db import transaction
 from rest_framework import serializers
 
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'variant', 'product', 'product_name', 'sku', 'color', 'size', 'unit_price', 'quantity', 'line_total']
+        read_only_fields = fields
+
+
 class OrderSerializer(serializers.ModelSerializer):
+    # Input only: the cart lines being ordered. Orders are read back as `lines`.
     cart_items = serializers.PrimaryKeyRelatedField(
         many=True,
-        queryset=CartItem.objects.all()
+        write_only=True,
+        queryset=CartItem.objects.select_related('variant__product')
     )
+    lines = OrderLineSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
@@ -24,6 +33,7 @@ class OrderSerializer(serializers.ModelSerializer):
             'phone',
             'placed_at',
             'cart_items',
+            'lines',
             'total',
             'is_paid',
             'shipping_method',
@@ -40,11 +50,9 @@ class OrderSerializer(serializers.ModelSerializer):
         try:
             cart_items = validated_data.pop('cart_items')
             with transaction.atomic():  # ✅ Add this
-                order = Order.objects.create(**validated_data)
-                order.cart_items.set(cart_items)
-                total = sum(item.quantity * item.variant.product.price for item in cart_items)
-                order.total = total
-                order.save()
+                lines = OrderLine.snapshot(cart_items)
+                order = Order.objects.create(**validated_data, total=sum(line.line_total for line in lines))
+                order.save_lines(lines)
             
                 return order
         except Exception as e:
@@ -150,11 +158,10 @@ class TotalSalesSerializer(serializers.Serializer):
             total_customers=Count('email', distinct=True)
         )
         
-        # Calculate total items sold by summing quantities from cart_items
-        total_items = 0
-        for order in paid_orders:
-            for cart_item in order.cart_items.all():
-                total_items += cart_item.quantity
+        # Items sold, summed over the order lines in the same query
+        total_items = OrderLine.objects.filter(order__in=paid_orders).aggregate(
+            total=Sum('quantity')
+        )['total'] or 0
         
         total_revenue = sales_data['total_revenue']
         if isinstance(total_revenue, str):
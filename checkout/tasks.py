@@ -1,22 +1,19 @@
 from background_task import background
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from background_task.models import Task
 from django.conf import settings
+from .outbox import deliver_outbox
 
-@background(schedule=5)  # Run 5 seconds later
-def send_checkout_email_background(email, subject, template, context):
-    try:
-        message = render_to_string(template, context)
-        send_email = EmailMultiAlternatives(
-            subject, 
-            '', 
-            from_email=settings.EMAIL_HOST_USER, 
-            to=[email]
-        )
-        send_email.attach_alternative(message, "text/html")
-        send_email.send()
-        print(f"Email sent successfully to {email}")
-        return True
-    except Exception as e:
-        print(f"Email sending failed: {str(e)}")
-        return False
\ No newline at end of file
+OUTBOX_TASK_NAME = 'checkout.deliver_email_outbox'
+
+
+@background(schedule=0)
+def deliver_email_outbox():
+    deliver_outbox()
+
+
+def schedule_email_outbox():
+    """Queue the repeating outbox worker unless already queued; returns True if queued now."""
+    if Task.objects.filter(verbose_name=OUTBOX_TASK_NAME).exists():
+        return False
+    deliver_email_outbox(repeat=settings.EMAIL_OUTBOX_INTERVAL, verbose_name=OUTBOX_TASK_NAME)
+    return True
@@ -1,3 +1,533 @@
-from django.test import TestCase
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from carts.models import Cart, CartItem, StockReservation
+from products.inventory import OutOfStock
+from products.models import Product, ProductVariant
+from . import gateway
+from .emails_utils import send_checkout_email
+from .models import EmailOutbox, Order, OrderLine
+from .outbox import DeliveryError, backoff, deliver_outbox
+
+ORDER = {
+    'full_name': 'Test Buyer',
+    'address': '1 Road',
+    'email': 'buyer@example.com',
+    'phone': '0123',
+    'city': 'Dhaka',
+}
+
+
+@override_settings(PAYMENT_GATEWAY_BACKEND='fake', PAYMENT_FAKE_LATENCY=0)
+class CheckoutTestCase(TestCase):
+    def setUp(self):
+        # The gateway client is built once per process; give each test a fresh fake.
+        gateway._client = None
+        self.addCleanup(setattr, gateway, '_client', None)
+        self.client = APIClient()
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        self.variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=5)
+
+    def add_to_cart(self, quantity, client=None):
+        response = (client or self.client).post(
+            '/api/carts/carts/current/add_item/', {'variant_id': self.variant.pk, 'quantity': quantity}, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def place_order(self, line_ids, shipping_method='cash_on_delivery', client=None, **headers):
+        return (client or self.client).post(
+            '/api/checkout/orders/',
+            {**ORDER, 'shipping_method': shipping_method, 'cart_items': line_ids},
+            format='json',
+            **headers,
+        )
+
+    def stock(self):
+        self.variant.refresh_from_db()
+        return self.variant.quantity
+
+
+class OnlinePaymentTests(CheckoutTestCase):
+    def pay(self, tran_id):
+        form = gateway.get_gateway().backend.complete(tran_id)
+        return self.client.post('/api/checkout/payment/success/', form)
+
+    def test_paid_order_allocates_stock_and_releases_the_cart_lines(self):
+        line_id = self.add_to_cart(2)
+        response = self.place_order([line_id], 'online_payment')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(StockReservation.objects.count(), 1)  # held while the customer pays
+
+        response = self.pay(response.json()['transaction_id'])
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/payment/success/', response['Location'])
+        self.assertTrue(Order.objects.get().is_paid)
+        self.assertEqual(self.stock(), 3)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(EmailOutbox.objects.get().to_email, ORDER['email'])
+
+    def test_forged_success_callback_is_rejected(self):
+        response = self.place_order([self.add_to_cart(2)], 'online_payment')
+        tran_id = response.json()['transaction_id']
+
+        response = self.client.post(
+            '/api/checkout/payment/success/', {'tran_id': tran_id, 'val_id': 'made-up', 'status': 'VALID'}
+        )
+
+        self.assertIn('reason=invalid_payment', response['Location'])
+        self.assertFalse(Order.objects.get().is_paid)
+        self.assertEqual(self.stock(), 5)
+
+    def test_replayed_success_callback_allocates_once(self):
+        response = self.place_order([self.add_to_cart(2)], 'online_payment')
+        form = gateway.get_gateway().backend.complete(response.json()['transaction_id'])
+
+        first = self.client.post('/api/checkout/payment/success/', form)
+        second = self.client.post('/api/checkout/payment/success/', form)
+
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.stock(), 3)
+
+
+@override_settings(CART_STORAGE_BACKEND='cache')
+class AnonymousCartCheckoutTests(CheckoutTestCase):
+    def setUp(self):
+        super().setUp()
+        # Someone else's stored cart, so CartItem ids and variant ids overlap.
+        other = ProductVariant.objects.create(product=self.variant.product, color='blue', size='S', quantity=5)
+        CartItem.objects.create(cart=Cart.objects.create(session_key='someone-else'), variant=other, quantity=1)
+
+    def test_rejected_order_can_be_retried_with_the_same_line_ids(self):
+        line_id = self.add_to_cart(2)
+
+        response = self.place_order([line_id], 'carrier_pigeon')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/carts/carts/current/').json()['total_items'], 2)
+
+        response = self.place_order([line_id])
+        self.assertEqual(response.status_code, 201, response.content)
+        line = Order.objects.get().lines.get()
+        self.assertEqual((line.variant, line.quantity), (self.variant, 2))
+        self.assertEqual(self.stock(), 3)
+        self.assertFalse(CartItem.objects.exclude(cart__session_key='someone-else').exists())
+        self.assertEqual(self.client.get('/api/carts/carts/current/').json()['total_items'], 0)
+
+    def test_next_cart_after_checkout_is_anonymous_again(self):
+        response = self.place_order([self.add_to_cart(2)], 'online_payment')  # lines stay stored until payment
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.cookies['cart_token'].value, '')  # the ordered cart's token is retired
+        carts = Cart.objects.count()
+
+        self.add_to_cart(1)
+
+        self.assertEqual(Cart.objects.count(), carts)
+        cart = self.client.get('/api/carts/carts/current/').json()
+        self.assertEqual(cart['total_items'], 1)
+        self.assertIsNone(cart['id'])  # not a stored cart
+
+    def test_retry_does_not_double_the_persisted_quantities(self):
+        line_id = self.add_to_cart(2)
+        self.place_order([line_id], 'carrier_pigeon')
+        self.place_order([line_id], 'carrier_pigeon')
+
+        self.assertEqual(CartItem.objects.get(variant=self.variant).quantity, 2)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+
+class StockAllocationTests(CheckoutTestCase):
+    def test_cod_order_takes_the_stock(self):
+        response = self.place_order([self.add_to_cart(2)])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.stock(), 3)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(EmailOutbox.objects.get().subject, f'Order Confirmation - #{Order.objects.get().pk}')
+
+    def test_order_is_not_placed_without_its_email(self):
+        line_id = self.add_to_cart(2)
+
+        with mock.patch('checkout.emails_utils.EmailOutbox.objects.create', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                self.place_order([line_id])
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 5)
+        self.assertTrue(CartItem.objects.exists())
+
+    def test_order_fails_closed_when_allocation_fails(self):
+        line_id = self.add_to_cart(2)
+
+        def sold_out(quantities):
+            raise OutOfStock({})  # shortfalls unknown, e.g. stock was restocked in between
+
+        with mock.patch('checkout.views.allocate_stock', sold_out):
+            response = self.place_order([line_id])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 5)
+
+    def test_stock_held_by_another_cart_is_not_sold(self):
+        line_id = self.add_to_cart(3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))  # ours lapsed
+        self.add_to_cart(3, client=APIClient())  # and someone else took the stock
+
+        for shipping_method in ('cash_on_delivery', 'online_payment'):
+            response = self.place_order([line_id], shipping_method)
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertIn('Only 2 items available in stock', str(response.json()))
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 5)
+
+    def test_checkout_renews_a_lapsed_reservation(self):
+        line_id = self.add_to_cart(3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.place_order([line_id], 'online_payment')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertTrue(StockReservation.objects.active().filter(cart_item_id=line_id).exists())
+
+    def test_short_line_is_named(self):
+        line_id = self.add_to_cart(2)
+        ProductVariant.objects.filter(pk=self.variant.pk).update(quantity=1)  # sold elsewhere meanwhile
+
+        response = self.place_order([line_id])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Not enough stock for Tee', str(response.json()))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 1)
+
+
+class OrderLineSnapshotTests(CheckoutTestCase):
+    def test_lines_keep_what_was_bought(self):
+        response = self.place_order([self.add_to_cart(2)])
+        self.assertEqual(response.status_code, 201, response.content)
+        order_id = Order.objects.get().pk
+
+        product = self.variant.product
+        product.name, product.price = 'Renamed', 250
+        product.save()
+        self.variant.delete()
+
+        line = OrderLine.objects.get()
+        self.assertEqual(
+            (line.product_name, line.sku, line.color, line.size, line.unit_price, line.quantity, line.line_total),
+            ('Tee', 'TEE', 'red', 'M', 100, 2, 200),
+        )
+        self.assertIsNone(line.variant)
+        self.assertEqual(Order.objects.get().total, 300)  # lines plus shipping
+        lines = self.client.get(f'/api/checkout/orders/{order_id}/').json()['lines']
+        self.assertEqual([(line['product_name'], line['unit_price']) for line in lines], [('Tee', '100.00')])
+
+
+class IdempotentOrderTests(CheckoutTestCase):
+    def test_retried_create_replays_the_first_order(self):
+        line_id = self.add_to_cart(2)
+
+        first = self.place_order([line_id], HTTP_IDEMPOTENCY_KEY='order-1')
+        retry = self.place_order([line_id], HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.stock(), 3)
+
+    def test_key_reused_with_a_different_body_is_rejected(self):
+        line_id = self.add_to_cart(2)
+        self.place_order([line_id], HTTP_IDEMPOTENCY_KEY='order-1')
+
+        response = self.place_order([line_id], 'online_payment', HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_does_not_burn_the_key(self):
+        line_id = self.add_to_cart(2)
+        ProductVariant.objects.filter(pk=self.variant.pk).update(quantity=1)
+        self.assertEqual(self.place_order([line_id], HTTP_IDEMPOTENCY_KEY='order-1').status_code, 400)
+
+        ProductVariant.objects.filter(pk=self.variant.pk).update(quantity=5)
+        response = self.place_order([line_id], HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Hundreds of simultaneous COD checkouts of one SKU never oversell it."""
+    buyers = 300
+    stock = 50
+
+    def setUp(self):
+        # Lock errors are retried below; don't render a 500 report for each one.
+        request_logger = logging.getLogger('django.request')
+        self.addCleanup(request_logger.setLevel, request_logger.level)
+        request_logger.setLevel(logging.CRITICAL)
+
+    def test_no_oversell(self):
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=self.stock)
+        lines = [
+            CartItem.objects.create(cart=Cart.objects.create(session_key=f'buyer-{n}'), variant=variant, quantity=1).pk
+            for n in range(self.buyers)
+        ]
+        statuses = []
+        start = threading.Barrier(self.buyers)
+
+        def checkout(line_id):
+            # The test client reports exceptions through a process-wide signal,
+            # so with many threads a failure must come back as a 500, not be raised.
+            client = APIClient(raise_request_exception=False)
+            start.wait()
+            try:
+                while True:
+                    response = client.post(
+                        '/api/checkout/orders/',
+                        {**ORDER, 'shipping_method': 'cash_on_delivery', 'cart_items': [line_id]},
+                        format='json',
+                    )
+                    if response.status_code != 500:  # SQLite: locked by another writer; the order rolled back
+                        break
+                    time.sleep(random.uniform(0, 0.05))
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(line_id,)) for line_id in lines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(statuses.count(201), self.stock)
+        self.assertEqual(statuses.count(400), self.buyers - self.stock)
+        self.assertEqual(variant.quantity, 0)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(EmailOutbox.objects.count(), self.stock)  # one per committed order, none for rollbacks
+
+
+class OrderLineBackfillTests(TransactionTestCase):
+    """checkout.0007 builds lines for orders placed when orders linked cart items."""
+    before = [('checkout', '0006_order_placed_id_idx')]
+    after = [('checkout', '0007_orderline')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_lines_are_built_from_the_linked_cart_items(self):
+        Order = self.migrate(self.before).get_model('checkout', 'Order')
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        variant = ProductVariant.objects.create(product=product, color='red', size='M', quantity=5)
+        item = CartItem.objects.create(cart=Cart.objects.create(session_key='old'), variant=variant, quantity=3)
+        order = Order.objects.create(**ORDER, total=300)
+        order.cart_items.add(item.pk)
+        Order.objects.create(**ORDER, total=0)  # nothing linked, nothing built
+
+        apps = self.migrate(self.after)
+
+        line = apps.get_model('checkout', 'OrderLine').objects.get()
+        self.assertEqual(
+            (line.order_id, line.variant_id, line.product_name, line.sku, line.unit_price, line.quantity, line.line_total),
+            (order.pk, variant.pk, 'Tee', 'TEE', 100, 3, 300),
+        )
+
+
+class FlakyBackend:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def validate(self, val_id):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def client_for(backend, threshold=2, reset_timeout=60, retries=2):
+    return gateway.PaymentGatewayClient(
+        backend, gateway.CircuitBreaker(threshold, reset_timeout), gateway.RetryBudget(0.1), retries
+    )
+
+
+class PaymentGatewayClientTests(TestCase):
+    def test_connection_errors_are_retried(self):
+        backend = FlakyBackend(requests.exceptions.ConnectionError('reset'), gateway.FakeResponse({'status': 'VALID'}))
+
+        self.assertEqual(client_for(backend).validate('v')['status'], 'VALID')
+        self.assertEqual(backend.calls, 2)
+
+    def test_read_timeouts_are_not_retried(self):
+        backend = FlakyBackend(requests.exceptions.ReadTimeout('slow'), gateway.FakeResponse({}))
+
+        with self.assertRaises(gateway.GatewayError):
+            client_for(backend).validate('v')
+        self.assertEqual(backend.calls, 1)
+
+    def test_open_circuit_fails_fast(self):
+        backend = FlakyBackend(*[requests.exceptions.ReadTimeout('slow')] * 2)
+        client = client_for(backend)
+        for _ in range(2):
+            with self.assertRaises(gateway.GatewayError):
+                client.validate('v')
+
+        with self.assertRaises(gateway.GatewayUnavailable):
+            client.validate('v')
+        self.assertEqual(backend.calls, 2)
+
+    def test_unexpected_error_in_half_open_trial_does_not_wedge_the_breaker(self):
+        backend = FlakyBackend(RuntimeError('bug'), gateway.FakeResponse({'status': 'VALID'}))
+        client = client_for(backend, threshold=1, reset_timeout=0)
+        client.breaker.record_failure()  # open; half-open straight away with reset_timeout=0
+
+        with self.assertRaises(RuntimeError):
+            client.validate('v')
+        self.assertFalse(client.breaker.trial_running)
+
+        self.assertEqual(client.validate('v')['status'], 'VALID')
+        self.assertEqual(client.breaker.state, 'closed')
+
+
+class AsyncPaymentGatewayClientTests(TestCase):
+    def test_calls_run_off_the_event_loop_thread(self):
+        threads = []
+
+        class Backend(FlakyBackend):
+            def validate(self, val_id):
+                threads.append(threading.get_ident())
+                return super().validate(val_id)
+
+        client = gateway.AsyncPaymentGatewayClient(client_for(Backend(gateway.FakeResponse({'status': 'VALID'}))))
+
+        async def validate():
+            return threading.get_ident(), await client.validate('v')
+
+        loop_thread, payment = async_to_sync(validate)()
+
+        self.assertEqual(payment['status'], 'VALID')
+        self.assertNotEqual(threads, [loop_thread])
+
+    @override_settings(PAYMENT_GATEWAY_BACKEND='fake', PAYMENT_FAKE_LATENCY=0)
+    def test_shares_the_process_client(self):
+        gateway._client = None
+        self.addCleanup(setattr, gateway, '_client', None)
+        client = gateway.get_async_gateway()
+
+        data = async_to_sync(client.init_payment)({'tran_id': 'order_1_ab', 'total_amount': '200'})
+
+        self.assertIs(client.client, gateway.get_gateway())
+        self.assertEqual(data['status'], 'SUCCESS')
+        payment = async_to_sync(client.validate)(gateway.get_gateway().backend.complete('order_1_ab')['val_id'])
+        self.assertEqual(payment['tran_id'], 'order_1_ab')
+
+
+class RecordingSender:
+    """Stands in for BrevoSender; fails the recipients in `failures` with the given DeliveryErrors."""
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+
+    def send(self, email):
+        if email.to_email in self.failures:
+            raise self.failures[email.to_email]
+        self.sent.append(email.to_email)
+
+
+@override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=3, EMAIL_OUTBOX_RETRY_BASE=30, EMAIL_OUTBOX_CLAIM_TIMEOUT=300)
+class EmailOutboxTests(TestCase):
+    def queue(self, to_email):
+        return EmailOutbox.objects.create(to_email=to_email, subject='Order', html='<p>hi</p>')
+
+    def test_checkout_email_is_only_queued(self):
+        send_checkout_email('buyer@example.com', 'Order', 'emails/order_confirmation.html', {'items': []})
+
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.PENDING)
+
+    def test_due_emails_are_sent(self):
+        self.queue('a@example.com')
+        self.queue('b@example.com')
+        sender = RecordingSender()
+
+        stats = deliver_outbox(sender=sender)
+
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(sorted(sender.sent), ['a@example.com', 'b@example.com'])
+        self.assertFalse(EmailOutbox.objects.exclude(status=EmailOutbox.SENT).exists())
+
+    def test_retryable_failure_backs_off(self):
+        email = self.queue('a@example.com')
+        sender = RecordingSender({'a@example.com': DeliveryError('Brevo API 503')})
+
+        self.assertEqual(deliver_outbox(sender=sender)['retried'], 1)
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (EmailOutbox.PENDING, 1))
+        delay = (email.next_attempt_at - timezone.now()).total_seconds()
+        self.assertTrue(20 < delay <= 36, delay)  # 30s base with +-20% jitter
+        self.assertEqual(deliver_outbox(sender=sender)['batches'], 0)  # not due yet
+
+    def test_backoff_doubles_per_attempt(self):
+        with mock.patch('checkout.outbox.random.uniform', return_value=1):
+            self.assertEqual([backoff(n) for n in (1, 2, 3)], [30, 60, 120])
+
+    def test_gives_up_after_max_attempts_or_on_permanent_errors(self):
+        flaky = self.queue('flaky@example.com')
+        bad = self.queue('bad@example.com')
+        sender = RecordingSender({
+            'flaky@example.com': DeliveryError('Brevo API 503'),
+            'bad@example.com': DeliveryError('Brevo API 400', retry=False),
+        })
+        for _ in range(3):
+            EmailOutbox.objects.update(next_attempt_at=timezone.now())
+            deliver_outbox(sender=sender)
+
+        flaky.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((flaky.status, flaky.attempts), (EmailOutbox.FAILED, 3))
+        self.assertEqual((bad.status, bad.attempts), (EmailOutbox.FAILED, 1))
+
+    def test_stuck_sends_are_reclaimed_as_attempts(self):
+        email = self.queue('crash@example.com')
+        stale = timezone.now() - timedelta(seconds=301)
+        for attempt in range(1, 4):
+            # Keep the reclaimed row out of the batch so only the sweep touches it.
+            EmailOutbox.objects.filter(pk=email.pk).update(
+                status=EmailOutbox.SENDING, claimed_by='dead-worker', claimed_at=stale,
+                next_attempt_at=timezone.now() + timedelta(hours=1),
+            )
+            deliver_outbox(sender=RecordingSender())
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, attempt)
+
+        self.assertEqual(email.status, EmailOutbox.FAILED)
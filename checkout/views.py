@@ -1,64 +1,135 @@
-from .models import Order
+from .models import Order, OrderLine
 from .serializers import OrderSerializer,MonthlySalesSerializer,DailySalesSerializer,TotalSalesSerializer
 from rest_framework import viewsets,status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.shortcuts import redirect
-from django.conf import settings
+import logging
 import uuid
-import requests
 from rest_framework.decorators import api_view,permission_classes
 from django.db import transaction
 from rest_framework import serializers 
 from .emails_utils import send_checkout_email
+from .gateway import GatewayError, get_gateway
+from .idempotency import idempotent_response, request_fingerprint
+from serverside.pagination import OptionalCursorPagination
+from carts.models import CartItem
+from carts.reservations import InsufficientStock, reserve
+from carts.views import CartStorageMixin
+from products.inventory import OutOfStock, allocate_stock
 
+logger = logging.getLogger(__name__)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+def order_quantities(cart_items):
+    """{variant_id: quantity} over the order's cart items."""
+    quantities = {}
+    for item in cart_items:
+        quantities[item.variant_id] = quantities.get(item.variant_id, 0) + item.quantity
+    return quantities
+
+
+class OrderViewSet(CartStorageMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.with_lines()
     serializer_class = OrderSerializer
     permission_classes = [AllowAny]
     http_method_names = ['get', 'post', 'delete']
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('-placed_at', '-id')  # see Order.Meta.indexes
+
+    def get_order_data(self):
+        """
+        The request data, with an anonymous cart (carts.storage) written to
+        the database first and its line ids mapped to the stored CartItems.
+        The anonymous cart is kept until the order succeeds (create_order).
+        """
+        data = self.request.data
+        storage = self.get_cart_storage()
+        if not storage.anonymous:
+            return data
+        _, lines = storage.persist(forget=False)
+        lines = {str(line_id): pk for line_id, pk in lines.items()}
+        data = data.copy()
+        cart_items = data.getlist('cart_items') if hasattr(data, 'getlist') else data.get('cart_items') or []
+        cart_items = [lines.get(str(line_id), line_id) for line_id in cart_items]
+        if hasattr(data, 'setlist'):
+            data.setlist('cart_items', cart_items)
+        else:
+            data['cart_items'] = cart_items
+        return data
+
+    def check_stock(self, cart_items, on_hand, quantities):
+        for item in cart_items:
+            available = on_hand.get(item.variant_id)
+            if available is not None and available < quantities[item.variant_id]:
+                raise serializers.ValidationError(
+                    f"Not enough stock for {item.variant.product.name}. "
+                    f"Available: {available}, Requested: {quantities[item.variant_id]}"
+                )
+
+    def hold_stock(self, cart_items):
+        """
+        Re-reserve the ordered lines (carts.reservations) inside the order's
+        transaction, so stock another cart holds is not sold to a cart whose
+        own reservation has lapsed.
+        """
+        variant_ids = {}
+        for item in cart_items:
+            variant_ids.setdefault(item.cart, []).append(item.variant_id)
+        try:
+            for cart, ids in variant_ids.items():
+                reserve(cart, ids)
+        except InsufficientStock as e:
+            raise serializers.ValidationError(list(e.errors.values()))
 
     def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+        """
+        With an Idempotency-Key header, a retried request gets the first
+        response back instead of placing (and paying for) a second order.
+        """
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return self.create_order(request)
+        return idempotent_response('order-create', key, request_fingerprint(request), lambda: self.create_order(request))
+
+    def create_order(self, request):
+        response = self.place_order(request)
+        storage = self.get_cart_storage()
+        if storage.anonymous and response.status_code == status.HTTP_201_CREATED:
+            storage.checked_out()  # the ordered cart is the database copy; the next one starts afresh
+        return response
+
+    def place_order(self, request):
+        serializer = self.get_serializer(data=self.get_order_data())
         serializer.is_valid(raise_exception=True)
 
         validated_data = serializer.validated_data
         cart_items = validated_data.pop('cart_items')
         
-        # Stock validation
-        for item in cart_items:
-            variant = item.variant
-            product = variant.product
-        
-            if product.quantity < item.quantity:
-                raise serializers.ValidationError(
-                    f"Not enough stock for {product.name}. "
-                    f"Available: {product.quantity}, Requested: {item.quantity}"
-                )
+        # Stock validation (fail fast; allocate_stock() is what guarantees no oversell)
+        quantities = order_quantities(cart_items)
+        self.check_stock(cart_items, {item.variant_id: item.variant.quantity for item in cart_items}, quantities)
 
-        subtotal = sum(item.quantity * item.variant.product.price for item in cart_items)
+        lines = OrderLine.snapshot(cart_items)
+        subtotal = sum(line.line_total for line in lines)
         shipping_price = 100  # 100 taka shipping
         total = subtotal + shipping_price
 
         if validated_data.get('shipping_method') == 'online_payment':
             with transaction.atomic():
+                self.hold_stock(cart_items)  # held for the customer while they pay
                 order = Order.objects.create(
                     **validated_data,
                     total=total,
                 )
-                order.cart_items.set(cart_items)
+                order.save_lines(lines)
 
             tran_id = f"order_{order.id}_{uuid.uuid4().hex[:8]}"
             order.transaction_id = tran_id
             order.save()
 
-            sslcz_url = "https://sandbox.sslcommerz.com/gwprocess/v4/api.php"
             payload = {
-                "store_id": settings.SSLCZ_STORE_ID,
-                "store_passwd": settings.SSLCZ_STORE_PASS,
                 "total_amount": str(total),
                 "currency": "BDT",
                 "tran_id": tran_id,
@@ -78,8 +149,7 @@ class OrderViewSet(viewsets.ModelViewSet):
             }
 
             try:
-                response = requests.post(sslcz_url, data=payload, timeout=10)
-                data = response.json()
+                data = get_gateway().init_payment(payload)
 
                 if data.get("status") == "SUCCESS":
                     return Response(
@@ -97,7 +167,7 @@ class OrderViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-            except requests.exceptions.RequestException as e:
+            except GatewayError as e:
                 order.delete()
                 return Response(
                     {"error": "SSLCommerz request failed", "details": str(e)},
@@ -107,32 +177,34 @@ class OrderViewSet(viewsets.ModelViewSet):
         # 🟡 Cash on Delivery (COD)
         else:
             with transaction.atomic():
+                self.hold_stock(cart_items)
                 order = Order.objects.create(
                     **validated_data,
                     total=total,
                 )
-                order.cart_items.set(cart_items)
-                
-                for item in cart_items:
-                    variant = item.variant
-                    product = variant.product
-                    
-                    product.quantity -= item.quantity
-                    product.save()
-            
-            if cart_items:  # Check if list is not empty
-                cart = cart_items[0].cart  # Get cart from first item
-                if cart:
-                    cart.items.all().delete()
+                order.save_lines(lines)
 
-            try:
+                try:
+                    allocate_stock(quantities)
+                except OutOfStock as e:
+                    # check_stock() names the short line when it can; either way the order rolls back.
+                    self.check_stock(cart_items, e.shortfalls, quantities)
+                    raise serializers.ValidationError("Not enough stock for this order.")
+
+                # Emptied with the order, so a placed order never leaves its cart behind.
+                if cart_items:  # Check if list is not empty
+                    cart = cart_items[0].cart  # Get cart from first item
+                    if cart:
+                        cart.items.all().delete()
+
+                # Queued in the order's transaction: the order and its email commit together.
                 email_context = {
                     'order': order,
                     'customer_name': validated_data.get('full_name'),
                     'order_id': order.id,
                     'order_date': order.placed_at,
                     'total_amount': total,
-                    'items': cart_items,
+                    'items': lines,
                     'subtotal': subtotal,
                     'shipping_price': shipping_price,
                     'shipping_address': validated_data.get('address'),
@@ -141,15 +213,12 @@ class OrderViewSet(viewsets.ModelViewSet):
                     'payment_method': 'Cash on Delivery',
                     'order_status': 'Confirmed'
                 }
-                
                 send_checkout_email(
                     email=validated_data.get('email'),
                     subject=f'Order Confirmation - #{order.id}',
                     template='emails/order_confirmation.html',  # Create this template
                     context=email_context
                 )
-            except Exception as e:
-                print(f"COD email failed: {str(e)}")
 
             return Response(
                 {
@@ -168,40 +237,53 @@ def ssl_payment_success(request):
     
     if status_val != 'VALID':
         return redirect(f"http://localhost:5173/payment/fail?reason=invalid_status&status={status_val}")
-    
+
+    # The POST can be forged; only the gateway's own record of val_id counts.
+    try:
+        payment = get_gateway().validate(val_id)
+    except GatewayError as e:
+        logger.warning("Payment success: could not validate %s: %s", tran_id, e)
+        return redirect(f"http://localhost:5173/payment/fail?reason=validation_unavailable&tran_id={tran_id}")
+    if payment.get('status') not in ('VALID', 'VALIDATED') or payment.get('tran_id') != tran_id:
+        logger.warning("Payment success: validation rejected %s: %s", tran_id, payment.get('status'))
+        return redirect(f"http://localhost:5173/payment/fail?reason=invalid_payment&tran_id={tran_id}")
+
+    # A replayed callback gets the first redirect back; stock is allocated once per tran_id.
+    if tran_id:
+        return idempotent_response('payment-success', tran_id, val_id or '', lambda: confirm_payment(tran_id))
+    return confirm_payment(tran_id)
+
+
+def confirm_payment(tran_id):
     try:
         if tran_id and tran_id.startswith("order_"):
             parts = tran_id.split('_')
             if len(parts) >= 2:
                 order_id = int(parts[1])
                 order = Order.objects.get(id=order_id)
+                if order.is_paid:
+                    return redirect(f"http://localhost:5173/payment/success/{order.id}")
+                lines = list(order.lines.select_related('product'))
                 with transaction.atomic():
-                    print("Atomic transaction started")
-                    for item in order.cart_items.all():
-                        variant = item.variant
-                        print("variant", variant)
-                        product = variant.product
-                        print("Product", product)
-
-                        if product.quantity < item.quantity:
-                            print(f"Insufficient stock for product {product}: {product.quantity} available, {item.quantity} requested")
-                            return redirect(f"http://localhost:5173/payment/fail?reason=insufficient_stock_product&order_id={order.id}")
-                        
-                        product.quantity -= item.quantity
-                        product.save()
-                        print(f"Product {product} quantity updated to {product.quantity}")
-                    
-                    print("All items processed, updating order status")
+                    try:
+                        allocate_stock(order_quantities(lines))
+                    except OutOfStock as e:
+                        logger.warning("Insufficient stock for order %s: %s", order.id, e.shortfalls)
+                        return redirect(f"http://localhost:5173/payment/fail?reason=insufficient_stock_product&order_id={order.id}")
+
                     order.is_paid = True
                     order.transaction_id = tran_id
                     order.status = 'confirmed'
                     order.save()
-                    print(f"Order {order_id} marked as paid")
+                    logger.info("Order %s marked as paid", order_id)
 
-                subtotal = sum(item.quantity * item.variant.product.price for item in order.cart_items.all())
-                shipping_price = 100  # 100 taka shipping
-                total = subtotal + shipping_price
-                try:
+                    # The ordered cart lines held their stock until payment; drop them (and their reservations).
+                    CartItem.objects.filter(pk__in=[line.cart_item_id for line in lines if line.cart_item_id]).delete()
+
+                    # Queued in the payment's transaction: the paid order and its email commit together.
+                    subtotal = sum(line.line_total for line in lines)
+                    shipping_price = 100  # 100 taka shipping
+                    total = subtotal + shipping_price
                     email_context = {
                         'order': order,
                         'customer_name': order.full_name,
@@ -210,7 +292,7 @@ def ssl_payment_success(request):
                         'subtotal': subtotal,
                         'shipping_price': shipping_price,
                         'total_amount': total,
-                        'items': order.cart_items.all(),
+                        'items': lines,
                         'shipping_address': order.address,
                         'city': order.city,
                         'phone': order.phone,
@@ -218,28 +300,21 @@ def ssl_payment_success(request):
                         'order_status': 'Confirmed',
                         'transaction_id': tran_id
                     }
-                    
                     send_checkout_email(
                         email=order.email,
                         subject=f'Order Confirmation - #{order.id}',
                         template='emails/order_confirmation.html',
                         context=email_context
                     )
-                    print(f"Confirmation email sent to {order.email}")
-
-                    
-                except Exception as e:
-                    print(f"Failed to send confirmation email: {str(e)}")
-                    # Don't fail the payment process if email fails
 
                 return redirect(f"http://localhost:5173/payment/success/{order.id}")
         
         # If not a valid order transaction
-        print(f"Invalid transaction ID format: {tran_id}")
+        logger.warning("Invalid transaction ID format: %s", tran_id)
         return redirect("http://localhost:5173/payment/fail?reason=invalid_tran_id")
 
     except (Order.DoesNotExist, ValueError, IndexError) as e:
-        print(f"[Payment Success] Error processing order: {e}")
+        logger.warning("Payment success: error processing order %s: %s", tran_id, e)
         return redirect(f"http://localhost:5173/payment/fail?reason=order_not_found&tran_id={tran_id}")
     
     
@@ -257,7 +332,7 @@ def ssl_payment_fail(request):
                 if not order.is_paid:
                     order.delete()
     except (Order.DoesNotExist, ValueError, IndexError) as e:
-        print(f"[Payment Fail] Skipping deletion due to error: {e}")
+        logger.warning("Payment fail: skipping deletion of %s: %s", tran_id, e)
         pass
 
     return redirect(f"http://localhost:5173/payment/fail?tran_id={tran_id}")
@@ -277,7 +352,7 @@ def ssl_payment_cancel(request):
                 if not order.is_paid:
                     order.delete()
     except (Order.DoesNotExist, ValueError, IndexError) as e:
-        print(f"[Payment Cancel] Skipping deletion due to error: {e}")
+        logger.warning("Payment cancel: skipping deletion of %s: %s", tran_id, e)
         pass
 
     return redirect(f"http://localhost:5173/payment/cancel?tran_id={tran_id}")
@@ -0,0 +1,95 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+INVENTORY_SUMMARY_VERSION_KEY = 'products:inventory-summary:version'
+CATALOG_VERSION_KEY = 'products:catalog:version'
+CATALOG_MODIFIED_KEY = 'products:catalog:modified'
+RESPONSE_STATS_KEY = 'products:response-cache:{}'
+RESPONSE_STATS = ('hits', 'misses', 'invalidations')
+
+
+def get_cache():
+    """The cache holding catalog versions and everything keyed on them (settings.CATALOG_CACHE_ALIAS)."""
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _seed():
+    # Time-based starting point, so a version lost with the cache is never reissued.
+    return int(time.time() * 1000)
+
+
+def _get_version(key):
+    return get_cache().get_or_set(key, _seed, timeout=None)
+
+
+def _bump_version(key):
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key was evicted; any fresh value invalidates the old entries.
+        version = _seed()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def inventory_summary_key(threshold):
+    return f"products:inventory-summary:{_get_version(INVENTORY_SUMMARY_VERSION_KEY)}:{threshold}"
+
+
+def invalidate_inventory_summary():
+    """Drop every cached inventory snapshot, whatever threshold it was built for."""
+    _bump_version(INVENTORY_SUMMARY_VERSION_KEY)
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def get_catalog_stamp():
+    """
+    (version, last_modified) for the whole catalog.
+
+    last_modified is a Unix timestamp in whole seconds. If the cache lost it
+    we can't tell when the last delete happened, so we fall back to "now".
+    """
+    version = get_catalog_version()
+    modified = get_cache().get_or_set(CATALOG_MODIFIED_KEY, lambda: int(time.time()), timeout=None)
+    return version, modified
+
+
+def bump_catalog_version():
+    """
+    Invalidate everything derived from the catalog (facets, cached
+    responses, ETags) by moving to a new key namespace.
+    """
+    get_cache().set(CATALOG_MODIFIED_KEY, int(time.time()), timeout=None)
+    record_response_cache_event('invalidations')
+    return _bump_version(CATALOG_VERSION_KEY)
+
+
+def facets_key(fragment):
+    return f"products:facets:{get_catalog_version()}:{fragment}"
+
+
+def response_key(normalized_url):
+    digest = hashlib.md5(normalized_url.encode()).hexdigest()
+    return f"products:response:{get_catalog_version()}:{digest}"
+
+
+def record_response_cache_event(name):
+    cache = get_cache()
+    key = RESPONSE_STATS_KEY.format(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_response_cache_stats():
+    cache = get_cache()
+    values = cache.get_many([RESPONSE_STATS_KEY.format(name) for name in RESPONSE_STATS])
+    return {name: values.get(RESPONSE_STATS_KEY.format(name), 0) for name in RESPONSE_STATS}
@@ -0,0 +1,329 @@
+"""
+Bulk catalog import/export: one row per variant (or per product without
+variants), streamed in chunks so memory stays flat for large feeds.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from .cache_utils import bump_catalog_version, invalidate_inventory_summary
+from .home import rebuild_collections
+from .models import COLOR_CHOICES, SIZE_CHOICES, Category, Product, ProductVariant
+from .search import index_products
+
+CATALOG_FIELDS = [
+    'sku',
+    'name',
+    'slug',
+    'description',
+    'price',
+    'product_quantity',
+    'is_new',
+    'is_featured',
+    'categories',   # category names separated by '|'
+    'color',
+    'size',
+    'quantity',     # variant quantity
+]
+
+CATEGORY_SEPARATOR = '|'
+PRODUCT_UPDATE_FIELDS = ['name', 'description', 'price', 'quantity', 'is_new', 'is_featured']
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                # Unreadable lines are reported against their row by CatalogImporter.run().
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield RowError(f"invalid JSON: {e}")
+                    continue
+                yield row if isinstance(row, dict) else RowError("each line must be a JSON object")
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes')
+
+
+def _int(value, name):
+    try:
+        number = int(value or 0)
+    except (TypeError, ValueError):
+        raise RowError(f"{name} must be an integer")
+    if number < 0:
+        raise RowError(f"{name} must not be negative")
+    return number
+
+
+def parse_row(row):
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not sku or not name:
+        raise RowError("sku and name are required")
+    try:
+        price = Decimal(str(row.get('price')))
+    except (InvalidOperation, TypeError):
+        raise RowError("price must be a number")
+    if not price.is_finite():
+        raise RowError("price must be a number")
+
+    color = str(row.get('color') or '').strip()
+    size = str(row.get('size') or '').strip()
+    if bool(color) != bool(size):
+        raise RowError("color and size must be given together")
+    if color and color not in dict(COLOR_CHOICES):
+        raise RowError(f"unknown color {color!r}")
+    if size and size not in dict(SIZE_CHOICES):
+        raise RowError(f"unknown size {size!r}")
+
+    categories = row.get('categories') or ''
+    if isinstance(categories, str):
+        categories = categories.split(CATEGORY_SEPARATOR)
+
+    return {
+        'sku': sku,
+        'name': name,
+        'slug': str(row.get('slug') or '').strip() or slugify(f"{name}-{sku}"),
+        'description': row.get('description') or '',
+        'price': price,
+        'quantity': _int(row.get('product_quantity'), 'product_quantity'),
+        'is_new': _bool(row.get('is_new')),
+        'is_featured': _bool(row.get('is_featured')),
+        'categories': [c.strip() for c in categories if c.strip()],
+        'variant': (color, size, _int(row.get('quantity'), 'quantity')) if color else None,
+    }
+
+
+class CatalogImporter:
+    """
+    Upserts products (by SKU), categories (by slug) and variants (by
+    product/color/size) with bulk_create/bulk_update, one transaction per chunk.
+
+    A product's categories are replaced by the ones listed in its rows the
+    first time it appears in the import and added to after that, so a product
+    whose variants span several chunks keeps all of them.
+    """
+
+    def __init__(self, chunk_size=2000):
+        self.chunk_size = chunk_size
+        self.category_ids = dict(Category.objects.values_list('slug', 'pk'))
+        self.seen_products = set()
+        self.stats = {'rows': 0, 'errors': 0, 'products_created': 0, 'products_updated': 0,
+                      'variants_created': 0, 'variants_updated': 0, 'categories_created': 0}
+        self.errors = []
+
+    def run(self, rows):
+        try:
+            for index, chunk in enumerate(chunked(rows, self.chunk_size)):
+                parsed = []
+                for offset, row in enumerate(chunk):
+                    number = index * self.chunk_size + offset + 1
+                    try:
+                        if isinstance(row, RowError):  # unreadable line, see read_rows()
+                            raise row
+                        parsed.append({**parse_row(row), 'row': number})
+                    except (RowError, AttributeError) as e:
+                        self.report(number, e)
+                if parsed:
+                    with transaction.atomic():
+                        self.import_chunk(parsed)
+                self.stats['rows'] += len(chunk)
+        finally:
+            # Bulk writes skip model signals, so invalidate derived caches once here,
+            # also when a failure stops the import after some chunks were committed.
+            bump_catalog_version()
+            invalidate_inventory_summary()
+            rebuild_collections()
+        return self.stats
+
+    def report(self, number, error):
+        self.stats['errors'] += 1
+        self.errors.append(f"row {number}: {error}")
+
+    def ensure_categories(self, names):
+        missing = {}
+        for name in names:
+            slug = slugify(name)
+            if slug and slug not in self.category_ids:
+                missing[slug] = Category(name=name, slug=slug)
+        if missing:
+            Category.objects.bulk_create(missing.values(), ignore_conflicts=True)
+            self.category_ids.update(
+                Category.objects.filter(slug__in=missing).values_list('slug', 'pk')
+            )
+            self.stats['categories_created'] += len(missing)
+
+    def slug_conflicts(self, products, existing):
+        """
+        {sku: message} for new products whose slug is already taken, by a
+        stored product or by another new product earlier in the chunk.
+        """
+        new = {sku: row['slug'] for sku, row in products.items() if sku not in existing}
+        taken = dict(Product.objects.filter(slug__in=new.values()).values_list('slug', 'sku'))
+        conflicts = {}
+        for sku, slug in new.items():
+            if slug in taken:
+                conflicts[sku] = f"slug {slug!r} is already used by product {taken[slug]}"
+            else:
+                taken[slug] = sku
+        return conflicts
+
+    def import_chunk(self, rows):
+        # Last row wins for product-level fields.
+        products = {row['sku']: row for row in rows}
+        existing = {p.sku: p for p in Product.objects.filter(sku__in=products)}
+
+        # Slugs are unique: report the clashing products' rows and skip them.
+        conflicts = self.slug_conflicts(products, existing)
+        if conflicts:
+            for row in rows:
+                if row['sku'] in conflicts:
+                    self.report(row['row'], conflicts[row['sku']])
+            rows = [row for row in rows if row['sku'] not in conflicts]
+            products = {sku: row for sku, row in products.items() if sku not in conflicts}
+            if not rows:
+                return
+
+        self.ensure_categories({name for row in rows for name in row['categories']})
+
+        to_create, to_update = [], []
+        for sku, row in products.items():
+            product = existing.get(sku)
+            if product is None:
+                to_create.append(Product(
+                    sku=sku, slug=row['slug'],
+                    **{field: row[field] for field in PRODUCT_UPDATE_FIELDS}
+                ))
+            else:
+                for field in PRODUCT_UPDATE_FIELDS:
+                    setattr(product, field, row[field])
+                to_update.append(product)
+        Product.objects.bulk_create(to_create, batch_size=500)
+        Product.objects.bulk_update(to_update, PRODUCT_UPDATE_FIELDS, batch_size=500)
+        self.stats['products_created'] += len(to_create)
+        self.stats['products_updated'] += len(to_update)
+
+        product_ids = dict(Product.objects.filter(sku__in=products).values_list('sku', 'pk'))
+        self.sync_categories(rows, product_ids)
+        self.upsert_variants(rows, product_ids)
+
+        touched = list(product_ids.values())
+        Product.objects.filter(pk__in=touched).rebuild_stock()
+        index_products(touched)
+
+    def sync_categories(self, rows, product_ids):
+        Through = Product.categories.through
+        wanted = {}
+        for row in rows:
+            pk = product_ids[row['sku']]
+            wanted.setdefault(pk, set()).update(
+                self.category_ids[slugify(name)] for name in row['categories'] if slugify(name)
+            )
+
+        current = {}
+        for product_id, category_id in Through.objects.filter(
+            product_id__in=wanted
+        ).values_list('product_id', 'category_id'):
+            current.setdefault(product_id, set()).add(category_id)
+
+        to_add, to_remove = [], []
+        for product_id, category_ids in wanted.items():
+            have = current.get(product_id, set())
+            to_add.extend(
+                Through(product_id=product_id, category_id=category_id)
+                for category_id in category_ids - have
+            )
+            if product_id not in self.seen_products:
+                to_remove.extend((product_id, category_id) for category_id in have - category_ids)
+        self.seen_products.update(wanted)
+
+        Through.objects.bulk_create(to_add, batch_size=1000, ignore_conflicts=True)
+        for batch in chunked(to_remove, 200):
+            condition = Q()
+            for product_id, category_id in batch:
+                condition |= Q(product_id=product_id, category_id=category_id)
+            Through.objects.filter(condition).delete()
+
+    def upsert_variants(self, rows, product_ids):
+        wanted = {}
+        for row in rows:
+            if row['variant']:
+                color, size, quantity = row['variant']
+                wanted[(product_ids[row['sku']], color, size)] = quantity
+
+        existing = {
+            (v.product_id, v.color, v.size): v
+            for v in ProductVariant.objects.filter(product_id__in=product_ids.values())
+        }
+        to_create, to_update = [], []
+        for key, quantity in wanted.items():
+            variant = existing.get(key)
+            if variant is None:
+                product_id, color, size = key
+                to_create.append(ProductVariant(product_id=product_id, color=color, size=size, quantity=quantity))
+            elif variant.quantity != quantity:
+                variant.quantity = quantity
+                to_update.append(variant)
+        ProductVariant.objects.bulk_create(to_create, batch_size=1000)
+        ProductVariant.objects.bulk_update(to_update, ['quantity'], batch_size=1000)
+        self.stats['variants_created'] += len(to_create)
+        self.stats['variants_updated'] += len(to_update)
+
+
+def export_rows(chunk_size=2000):
+    """Yield one dict per variant (or per variant-less product), streaming from the DB."""
+    products = Product.objects.order_by('pk').prefetch_related('categories', 'variants')
+    for product in products.iterator(chunk_size=chunk_size):
+        base = {
+            'sku': product.sku or '',
+            'name': product.name,
+            'slug': product.slug,
+            'description': product.description,
+            'price': str(product.price),
+            'product_quantity': product.quantity,
+            'is_new': product.is_new,
+            'is_featured': product.is_featured,
+            'categories': CATEGORY_SEPARATOR.join(c.name for c in product.categories.all()),
+        }
+        variants = sorted(product.variants.all(), key=lambda v: v.pk)
+        if not variants:
+            yield {**base, 'color': '', 'size': '', 'quantity': 0}
+        for variant in variants:
+            yield {**base, 'color': variant.color, 'size': variant.size, 'quantity': variant.quantity}
+
+
+def write_rows(rows, stream, fmt):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=CATALOG_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(row) + '\n')
+            count += 1
+    return count
@@ -0,0 +1,152 @@
+from decimal import Decimal, InvalidOperation
+from django.db.models import Count, Exists, OuterRef, Q
+from rest_framework.exceptions import ValidationError
+from .models import COLOR_CHOICES, SIZE_CHOICES, Product, ProductVariant
+
+# (min, max) in store currency; max is exclusive, None means open-ended.
+PRICE_BANDS = [
+    (0, 500),
+    (500, 1000),
+    (1000, 2000),
+    (2000, 5000),
+    (5000, None),
+]
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def _decimal(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name: "Must be a number."})
+
+
+def parse_filters(params):
+    """
+    Normalize the query string into a filter dict with sorted values, so
+    equivalent requests share one cache entry.
+    """
+    colors = dict(COLOR_CHOICES)
+    sizes = dict(SIZE_CHOICES)
+    try:
+        categories = sorted({int(pk) for pk in _split(params.get('category', ''))})
+    except ValueError:
+        raise ValidationError({'category': "Must be a comma-separated list of ids."})
+
+    available = params.get('available', '').lower()
+    return {
+        'color': sorted({c for c in _split(params.get('color', '')) if c in colors}),
+        'size': sorted({s for s in _split(params.get('size', '')) if s in sizes}),
+        'category': categories,
+        'min_price': _decimal(params, 'min_price'),
+        'max_price': _decimal(params, 'max_price'),
+        'available': {'true': True, '1': True, 'false': False, '0': False}.get(available),
+    }
+
+
+def cache_key_fragment(filters):
+    return '|'.join(
+        f"{name}={','.join(map(str, value)) if isinstance(value, list) else value}"
+        for name, value in sorted(filters.items())
+    )
+
+
+def filter_products(filters, ignore=None):
+    """Products matching every filter except the facet named in `ignore`."""
+    queryset = Product.objects.order_by()
+    if filters['available'] is not None:
+        queryset = queryset.filter(available=filters['available'])
+    if ignore != 'category' and filters['category']:
+        queryset = queryset.filter(
+            pk__in=Product.categories.through.objects.filter(
+                category_id__in=filters['category']
+            ).values('product_id')
+        )
+    if ignore != 'price':
+        if filters['min_price'] is not None:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if filters['max_price'] is not None:
+            # Exclusive, like PRICE_BANDS, so picking a band returns exactly its count.
+            queryset = queryset.filter(price__lt=filters['max_price'])
+
+    # Colour and size must be satisfied by the same variant.
+    variant_filter = _variant_filter(filters, ignore)
+    if variant_filter:
+        queryset = queryset.filter(Exists(
+            ProductVariant.objects.filter(variant_filter, product=OuterRef('pk'))
+        ))
+    return queryset
+
+
+def _variant_filter(filters, ignore=None):
+    q = Q()
+    if ignore != 'color' and filters['color']:
+        q &= Q(color__in=filters['color'])
+    if ignore != 'size' and filters['size']:
+        q &= Q(size__in=filters['size'])
+    return q
+
+
+def _variant_counts(filters, field):
+    # Filters on the other variant attribute apply to the same variant row.
+    return dict(
+        ProductVariant.objects.filter(
+            _variant_filter(filters, ignore=field),
+            product__in=filter_products(filters, ignore=field).values('pk'),
+        ).order_by().values_list(field).annotate(count=Count('product_id', distinct=True))
+    )
+
+
+def compute_facets(filters):
+    """
+    Counts of matching products per colour, size, category and price band.
+
+    Each facet ignores its own selection (so the sidebar shows what else the
+    user could pick) and is computed by one grouped query; five queries total.
+    """
+    total = filter_products(filters).count()
+
+    color_counts = _variant_counts(filters, 'color')
+    size_counts = _variant_counts(filters, 'size')
+
+    category_rows = Product.categories.through.objects.filter(
+        product__in=filter_products(filters, ignore='category').values('pk')
+    ).order_by().values(
+        'category_id', 'category__name', 'category__slug'
+    ).annotate(count=Count('product_id')).order_by('category__name')
+
+    band_counts = filter_products(filters, ignore='price').aggregate(**{
+        f"band_{index}": Count('pk', filter=Q(price__gte=low, **({'price__lt': high} if high is not None else {})))
+        for index, (low, high) in enumerate(PRICE_BANDS)
+    })
+
+    return {
+        'total': total,
+        'colors': [
+            {'value': value, 'label': label, 'count': color_counts.get(value, 0)}
+            for value, label in COLOR_CHOICES
+        ],
+        'sizes': [
+            {'value': value, 'label': label, 'count': size_counts.get(value, 0)}
+            for value, label in SIZE_CHOICES
+        ],
+        'categories': [
+            {
+                'id': row['category_id'],
+                'name': row['category__name'],
+                'slug': row['category__slug'],
+                'count': row['count'],
+            }
+            for row in category_rows
+        ],
+        'price': [
+            {'min': low, 'max': high, 'count': band_counts[f"band_{index}"]}
+            for index, (low, high) in enumerate(PRICE_BANDS)
+        ],
+    }
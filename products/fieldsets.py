@@ -0,0 +1,100 @@
+"""
+Sparse fieldsets: `?fields=` / `?expand=` parsing, and a queryset built
+from the serializer that is left once the selection has been applied.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ForeignKey, ManyToManyField, Prefetch
+from rest_framework import serializers
+
+
+def parse_fieldset(value):
+    """
+    'id,name,categories.name' -> {'id': {}, 'name': {}, 'categories': {'name': {}}}
+
+    An empty subtree means "the whole field". Returns None when the
+    parameter was not given at all.
+    """
+    if value is None:
+        return None
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def subtree(tree, name):
+    """Selection for a nested serializer; None means no restriction."""
+    if tree is None or not tree.get(name):
+        return None
+    return tree[name]
+
+
+def _nested(field):
+    """The ModelSerializer behind a (possibly many=True) nested field, if any."""
+    child = getattr(field, 'child', field)
+    return child if isinstance(child, serializers.ModelSerializer) else None
+
+
+def _columns(serializer, prefix=''):
+    """
+    (only() columns, select_related paths, prefetches) for every field the
+    serializer will read, or None if a field reads something we cannot map
+    to a column (method fields, properties, source='*').
+    """
+    opts = serializer.Meta.model._meta
+    columns, joins, prefetches = {prefix + opts.pk.name}, [], []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            return None
+        try:
+            model_field = opts.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+
+        nested = _nested(field)
+        if isinstance(model_field, ManyToManyField):
+            related = model_field.related_model
+            if nested is None:
+                queryset = related.objects.only(related._meta.pk.name)
+            else:
+                plan = _columns(nested)
+                if plan is None:
+                    return None
+                queryset = related.objects.only(*plan[0]).prefetch_related(*plan[2])
+                if plan[1]:
+                    queryset = queryset.select_related(*plan[1])
+            prefetches.append(Prefetch(prefix + model_field.name, queryset=queryset))
+        elif isinstance(model_field, ForeignKey) and nested is not None:
+            plan = _columns(nested, prefix=f"{prefix}{model_field.name}__")
+            if plan is None:
+                return None
+            columns.add(prefix + model_field.name)
+            columns.update(plan[0])
+            joins.append(prefix + model_field.name)
+            joins.extend(plan[1])
+            prefetches.extend(plan[2])
+        elif model_field.concrete:
+            columns.add(prefix + model_field.name)
+        else:
+            return None
+    return columns, joins, prefetches
+
+
+def queryset_for_serializer(queryset, serializer, extra_columns=()):
+    """
+    Restrict `queryset` to the columns, joins and prefetches a trimmed
+    serializer actually reads. Returns None if some field cannot be traced
+    to the database, so the caller keeps its regular query plan.
+    """
+    plan = _columns(serializer)
+    if plan is None:
+        return None
+    columns, joins, prefetches = plan
+    queryset = queryset.only(*columns, *extra_columns).prefetch_related(*prefetches)
+    # select_related() with no arguments would follow every foreign key.
+    return queryset.select_related(*joins) if joins else queryset
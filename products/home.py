@@ -0,0 +1,204 @@
+"""
+Materialized storefront collections: featured, new arrivals and the top
+products of each category, kept as pre-rendered JSON in the catalog cache.
+
+Each collection remembers its member ids and the rank of its last member
+(its "floor"), so a product change only rebuilds the collections the
+product is in or would now enter. The home endpoint is one cache read.
+"""
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework.renderers import JSONRenderer
+from .cache_utils import get_cache
+from .fieldsets import queryset_for_serializer
+from .models import Category, Product
+from .serializers import ProductSerializer
+
+HOME_KEY = 'products:home:blob'
+STATE_KEY = 'products:home:state'
+CARD_FIELDS = ('id', 'name', 'slug', 'price', 'image', 'images', 'is_new', 'is_featured', 'created_at')
+
+FLAG_COLLECTIONS = {
+    'featured': 'is_featured',
+    'new_arrivals': 'is_new',
+}
+
+
+def _category_name(category_id):
+    return f"category:{category_id}"
+
+
+def _rank(product, name):
+    # Higher is better; matches the ORDER BY of the query building `name`.
+    if name in FLAG_COLLECTIONS:
+        return (product['created_at'], product['id'])
+    return (product['is_featured'], product['created_at'], product['id'])
+
+
+def _serialize(product_ids):
+    """Card dicts by id, one query for all of them."""
+    fields = {name: {} for name in CARD_FIELDS}
+    products = list(queryset_for_serializer(
+        Product.objects.filter(pk__in=product_ids), ProductSerializer(fields=fields)
+    ))
+    return {
+        product.pk: data
+        for product, data in zip(products, ProductSerializer(products, many=True, fields=fields).data)
+    }
+
+
+def _build(names):
+    """Fresh state entries for the given collection names."""
+    size = settings.HOME_COLLECTION_SIZE
+    members = {}
+    for name, flag in FLAG_COLLECTIONS.items():
+        if name in names:
+            members[name] = list(
+                Product.objects.filter(available=True, **{flag: True})
+                .order_by('-created_at', '-id').values('id', 'created_at', 'is_featured')[:size]
+            )
+
+    category_ids = [int(name.split(':')[1]) for name in names if name.startswith('category:')]
+    categories = {}
+    if category_ids:
+        categories = {
+            c['id']: c for c in Category.objects.filter(pk__in=category_ids).values('id', 'name', 'slug')
+        }
+        ranked = Product.categories.through.objects.filter(
+            category_id__in=category_ids, product__available=True
+        ).annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=F('category_id'),
+                order_by=[F('product__is_featured').desc(), F('product__created_at').desc(), F('product_id').desc()],
+            )
+        ).filter(position__lte=size).order_by('category_id', 'position').values(
+            'category_id', 'product_id', 'product__created_at', 'product__is_featured'
+        )
+        for name in names:
+            if name.startswith('category:'):
+                members[name] = []
+        for row in ranked:
+            members[_category_name(row['category_id'])].append({
+                'id': row['product_id'],
+                'created_at': row['product__created_at'],
+                'is_featured': row['product__is_featured'],
+            })
+
+    cards = _serialize({product['id'] for rows in members.values() for product in rows})
+    state = {}
+    for name, rows in members.items():
+        if name.startswith('category:') and int(name.split(':')[1]) not in categories:
+            state[name] = None  # category was deleted
+            continue
+        state[name] = {
+            'ids': [product['id'] for product in rows],
+            'floor': _rank(rows[-1], name) if len(rows) >= size else None,
+            'items': [cards[product['id']] for product in rows if product['id'] in cards],
+        }
+        if name.startswith('category:'):
+            state[name]['category'] = categories[int(name.split(':')[1])]
+    return state
+
+
+def _render(state):
+    categories = sorted(
+        (entry for name, entry in state.items() if name.startswith('category:') and entry['items']),
+        key=lambda entry: entry['category']['name'],
+    )
+    data = {name: state[name]['items'] for name in FLAG_COLLECTIONS}
+    data['categories'] = [{**entry['category'], 'products': entry['items']} for entry in categories]
+    return JSONRenderer().render(data)
+
+
+def _store(state):
+    blob = _render(state)
+    cache = get_cache()
+    cache.set_many({STATE_KEY: state, HOME_KEY: blob}, settings.HOME_COLLECTIONS_TTL)
+    return blob
+
+
+def rebuild_collections():
+    """Rebuild every collection from scratch; returns the rendered blob."""
+    names = list(FLAG_COLLECTIONS) + [
+        _category_name(pk) for pk in Category.objects.values_list('pk', flat=True)
+    ]
+    return _store(_build(names))
+
+
+def _update(state, names):
+    for name, entry in _build(names).items():
+        if entry is None:
+            state.pop(name, None)
+        else:
+            state[name] = entry
+    _store(state)
+
+
+def refresh_products(product_ids, stock_only=False):
+    """
+    Rebuild the collections affected by changes to these products.
+
+    A collection is rebuilt when the product is in it or now ranks above
+    its floor. With stock_only the card data is unchanged, so only a
+    membership flip (the product became (un)available) triggers a rebuild.
+    """
+    state = get_cache().get(STATE_KEY)
+    if state is None:
+        rebuild_collections()
+        return
+
+    product_ids = set(product_ids)
+    products = {
+        p['id']: p for p in Product.objects.filter(pk__in=product_ids).values(
+            'id', 'available', 'is_featured', 'is_new', 'created_at'
+        )
+    }
+    product_categories = {}
+    for product_id, category_id in Product.categories.through.objects.filter(
+        product_id__in=products
+    ).values_list('product_id', 'category_id'):
+        product_categories.setdefault(product_id, set()).add(category_id)
+
+    stale = set()
+    for product_id in product_ids:
+        product = products.get(product_id)
+        candidates = {name for name, entry in state.items() if product_id in entry['ids']}
+        if product is not None and product['available']:
+            candidates.update(name for name, flag in FLAG_COLLECTIONS.items() if product[flag])
+            candidates.update(_category_name(pk) for pk in product_categories.get(product_id, ()))
+
+        for name in candidates:
+            entry = state.get(name)
+            if entry is None:
+                stale.add(name)  # category collection not built yet
+                continue
+            member = product_id in entry['ids']
+            qualifies = (
+                product is not None and product['available']
+                and (name not in FLAG_COLLECTIONS or product[FLAG_COLLECTIONS[name]])
+                and (name in FLAG_COLLECTIONS or int(name.split(':')[1]) in product_categories.get(product_id, ()))
+                and (entry['floor'] is None or _rank(product, name) >= entry['floor'])
+            )
+            if member != qualifies or (member and not stock_only):
+                stale.add(name)
+
+    if stale:
+        _update(state, stale)
+
+
+def refresh_categories(category_ids):
+    """Rebuild (or drop, if deleted) the collections of these categories."""
+    state = get_cache().get(STATE_KEY)
+    if state is None:
+        rebuild_collections()
+        return
+    _update(state, {_category_name(pk) for pk in category_ids})
+
+
+def get_home_blob():
+    blob = get_cache().get(HOME_KEY)
+    if blob is None:
+        blob = rebuild_collections()
+    return blob
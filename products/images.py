@@ -0,0 +1,77 @@
+import os
+from PIL import Image, ImageOps
+
+# Bounding boxes for each derivative; aspect ratio is preserved.
+DERIVATIVE_SIZES = {
+    'thumbnail': (150, 150),
+    'card': (400, 400),
+    'detail': (1000, 1000),
+}
+
+# format name -> (Pillow format, file extension, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DERIVATIVE_SEPARATOR = '__'
+
+
+def derivative_name(source_name, size, extension):
+    """products/shirt.jpg -> products/shirt__card.webp"""
+    stem, _ = os.path.splitext(source_name)
+    return f"{stem}{DERIVATIVE_SEPARATOR}{size}.{extension}"
+
+
+def _flatten(image):
+    """JPEG has no alpha channel; composite transparent images onto white."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_derivatives(media_root, source_name):
+    """
+    Write every size/format derivative of `source_name` next to it under
+    `media_root` and return the metadata stored in `image_derivatives`.
+
+    Works on plain paths so it can run in a worker process without Django.
+    """
+    source_path = os.path.join(media_root, source_name)
+    derivatives = {'source': source_name}
+
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+        for size, box in DERIVATIVE_SIZES.items():
+            resized = original.copy()
+            resized.thumbnail(box, Image.LANCZOS)
+            derivatives[size] = {}
+
+            for fmt, (pillow_format, extension, options) in DERIVATIVE_FORMATS.items():
+                image = _flatten(resized) if pillow_format == 'JPEG' else resized
+                name = derivative_name(source_name, size, extension)
+                image.save(os.path.join(media_root, name), pillow_format, **options)
+                derivatives[size][fmt] = {
+                    'name': name,
+                    'width': image.width,
+                    'height': image.height,
+                }
+
+    return derivatives
+
+
+def remove_derivatives(media_root, derivatives):
+    """Delete the files listed in a previous `image_derivatives` value."""
+    for size, formats in derivatives.items():
+        if size == 'source':
+            continue
+        for meta in formats.values():
+            path = os.path.join(media_root, meta['name'])
+            if os.path.exists(path):
+                os.remove(path)
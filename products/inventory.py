@@ -0,0 +1,148 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from .cache_utils import bump_catalog_version, invalidate_inventory_summary
+from .home import refresh_products
+from .models import Product, ProductVariant
+
+UPDATE_BATCH_SIZE = 1000
+
+
+class OutOfStock(Exception):
+    """Raised by allocate_stock(); `shortfalls` is {variant_id: quantity on hand} for the lines that did not fit."""
+    def __init__(self, shortfalls):
+        super().__init__(shortfalls)
+        self.shortfalls = shortfalls
+
+
+def _plan(adjustments, current):
+    """
+    Replay the adjustments for one table against the current quantities.
+
+    Returns {pk: (base, offset)} where base None means "relative to the
+    stored quantity" (so the UPDATE uses F('quantity') + offset) and an
+    integer means an absolute value was set; plus the per-row results.
+    """
+    plans, results, running = {}, {}, dict(current)
+    for index, pk, delta, absolute in adjustments:
+        if pk not in running:
+            results[index] = {'status': 'not_found'}
+            continue
+        if absolute is not None:
+            running[pk] = absolute
+            plans[pk] = (absolute, 0)
+        elif running[pk] + delta < 0:
+            results[index] = {'status': 'insufficient_stock', 'quantity': running[pk]}
+            continue
+        else:
+            running[pk] += delta
+            base, offset = plans.get(pk, (None, 0))
+            plans[pk] = (base, offset + delta)
+        results[index] = {'status': 'applied', 'quantity': running[pk]}
+    return plans, results
+
+
+def _apply(model, plans):
+    """One UPDATE ... SET quantity = CASE ... per batch of rows."""
+    pks = list(plans)
+    for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+        batch = pks[start:start + UPDATE_BATCH_SIZE]
+        whens = []
+        for pk in batch:
+            base, offset = plans[pk]
+            value = Value(base + offset) if base is not None else F('quantity') + offset
+            whens.append(When(pk=pk, then=value))
+        model.objects.filter(pk__in=batch).update(
+            quantity=Case(*whens, default=F('quantity'), output_field=IntegerField())
+        )
+
+
+def apply_adjustments(rows):
+    """
+    Apply validated inventory adjustments in a single transaction.
+
+    Each row targets a variant (variant_id) or a product (sku) and carries
+    either a delta or an absolute quantity. Rows are replayed in order;
+    one that would take stock below zero is skipped and reported. Returns
+    one result dict per input row.
+    """
+    variant_rows, product_rows = [], []
+    for index, row in enumerate(rows):
+        entry = (row.get('delta'), row.get('absolute'))
+        if row.get('variant_id') is not None:
+            variant_rows.append((index, row['variant_id'], *entry))
+        else:
+            product_rows.append((index, row['sku'], *entry))
+
+    with transaction.atomic():
+        variants = dict(
+            ProductVariant.objects.select_for_update().filter(
+                pk__in={pk for _, pk, _, _ in variant_rows}
+            ).values_list('pk', 'quantity')
+        )
+        variant_plans, results = _plan(variant_rows, variants)
+
+        skus = {sku for _, sku, _, _ in product_rows}
+        sku_to_pk = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'pk'))
+        products = dict(
+            Product.objects.select_for_update().filter(pk__in=sku_to_pk.values()).values_list('pk', 'quantity')
+        )
+        product_plans, product_results = _plan(
+            [(index, sku_to_pk.get(sku), delta, absolute) for index, sku, delta, absolute in product_rows],
+            products,
+        )
+        results.update(product_results)
+
+        _apply(ProductVariant, variant_plans)
+        _apply(Product, product_plans)
+
+        # Availability is recomputed once per touched product, not once per row.
+        touched = set(product_plans) | set(
+            ProductVariant.objects.filter(pk__in=variant_plans).values_list('product_id', flat=True)
+        )
+        if touched:
+            Product.objects.filter(pk__in=touched).rebuild_stock()
+
+    if variant_plans or product_plans:
+        _stock_changed(touched)
+    return [results[index] for index in range(len(rows))]
+
+
+def _stock_changed(product_ids):
+    bump_catalog_version()
+    invalidate_inventory_summary()
+    refresh_products(product_ids, stock_only=True)
+
+
+def allocate_stock(quantities):
+    """
+    Take {variant_id: quantity} off variant stock with one conditional
+    UPDATE (quantity = quantity - n WHERE quantity >= n, for every line).
+    All lines are allocated or none: if any row falls short nothing is
+    changed and OutOfStock is raised. Call inside the order's transaction.
+    """
+    quantities = {pk: n for pk, n in quantities.items() if n}
+    if not quantities:
+        return
+    enough = Q()
+    for pk, n in quantities.items():
+        enough |= Q(pk=pk, quantity__gte=n)
+
+    try:
+        with transaction.atomic():
+            updated = ProductVariant.objects.filter(enough).update(quantity=Case(
+                *[When(pk=pk, then=F('quantity') - n) for pk, n in quantities.items()],
+                default=F('quantity'),
+                output_field=IntegerField(),
+            ))
+            if updated != len(quantities):
+                raise OutOfStock({})
+    except OutOfStock:
+        on_hand = dict(ProductVariant.objects.filter(pk__in=quantities).values_list('pk', 'quantity'))
+        raise OutOfStock({
+            pk: on_hand.get(pk, 0) for pk, n in quantities.items() if on_hand.get(pk, 0) < n
+        }) from None
+
+    touched = set(ProductVariant.objects.filter(pk__in=quantities).values_list('product_id', flat=True))
+    Product.objects.filter(pk__in=touched).rebuild_stock()
+    # Cache refreshes only; a failure there must not fail the committed order.
+    transaction.on_commit(lambda: _stock_changed(touched), robust=True)
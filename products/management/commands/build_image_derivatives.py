@@ -0,0 +1,73 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.cache_utils import bump_catalog_version
+from products.home import rebuild_collections
+from products.images import render_derivatives
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = "Render thumbnail/card/detail derivatives for existing Product and Category images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-render images that already have derivatives',
+        )
+
+    def handle(self, *args, **options):
+        media_root = str(settings.MEDIA_ROOT)
+
+        # The same upload can back several rows; render each file once.
+        rows_by_source = defaultdict(list)
+        for model in (Product, Category):
+            rows = model.objects.exclude(image='').exclude(image__isnull=True).values_list(
+                'pk', 'image', 'image_derivatives'
+            )
+            for pk, name, derivatives in rows:
+                if not options['force'] and (derivatives or {}).get('source') == name:
+                    continue
+                if not os.path.exists(os.path.join(media_root, name)):
+                    self.stderr.write(f"Missing file for {model.__name__} {pk}: {name}")
+                    continue
+                rows_by_source[name].append((model, pk))
+
+        if not rows_by_source:
+            self.stdout.write("No images to process")
+            return
+
+        rendered = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(render_derivatives, media_root, name): name
+                for name in rows_by_source
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    derivatives = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Failed to render {name}: {e}")
+                    continue
+
+                for model, pk in rows_by_source[name]:
+                    model.objects.filter(pk=pk).update(image_derivatives=derivatives)
+                rendered += 1
+
+        if rendered:
+            bump_catalog_version()
+            rebuild_collections()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered derivatives for {rendered} images ({failed} failed)"
+        ))
@@ -0,0 +1,26 @@
+import sys
+from django.core.management.base import BaseCommand
+from products.catalog_io import export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = "Stream the catalog to CSV or JSONL (one row per variant)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="Output file, or '-' for stdout")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Products fetched per query')
+
+    def handle(self, *args, **options):
+        path = options['output']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            count = write_rows(export_rows(options['chunk_size']), stream, fmt)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} rows to {path}"))
@@ -0,0 +1,37 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from products.catalog_io import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Upsert products, variants and categories from a CSV or JSONL feed (one row per variant)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        if path == '-' and not options['format']:
+            raise CommandError("--format is required when reading from stdin")
+
+        importer = CatalogImporter(chunk_size=options['chunk_size'])
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            stats = importer.run(read_rows(stream, fmt))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in importer.errors[:50]:
+            self.stderr.write(error)
+        if len(importer.errors) > 50:
+            self.stderr.write(f"... and {len(importer.errors) - 50} more errors")
+
+        self.stdout.write(self.style.SUCCESS(
+            "Imported {rows} rows: {products_created} products created, {products_updated} updated; "
+            "{variants_created} variants created, {variants_updated} updated; "
+            "{categories_created} categories created; {errors} rows skipped".format(**stats)
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.home import rebuild_collections
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.variant_quantity and Product.available from the variants"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of products to update per transaction',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+
+        updated = 0
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            with transaction.atomic():
+                updated += Product.objects.filter(pk__in=batch).rebuild_stock()
+
+        # Availability may have flipped for products on the home page.
+        rebuild_collections()
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock for {updated} products"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SQLite FTS5 product search index from the catalog"
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            self.stdout.write("Full-text index not available on this database; search uses the fallback")
+            return
+
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products"))
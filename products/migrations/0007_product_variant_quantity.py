@@ -0,0 +1,39 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:01
+
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_stock(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    variant_totals = ProductVariant.objects.filter(
+        product=OuterRef('pk')
+    ).order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    Product.objects.update(variant_quantity=Coalesce(Subquery(variant_totals), 0))
+    Product.objects.update(available=Case(
+        When(Q(quantity__gt=0) | Q(variant_quantity__gt=0), then=Value(True)),
+        default=Value(False),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_alter_product_options_remove_product_category_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='variant_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='available',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.RunPython(backfill_stock, migrations.RunPython.noop),
+    ]
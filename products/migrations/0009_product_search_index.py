@@ -0,0 +1,47 @@
+# Generated by Django 4.2.24 on 2026-10-18 12:10
+
+from django.db import migrations
+
+
+def fts5_available(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends use the icontains fallback in products.search.
+    if not fts5_available(schema_editor):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts USING fts5("
+        "name, description, sku, categories, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute("""
+        INSERT INTO products_product_fts (rowid, name, description, sku, categories)
+        SELECT p.id, p.name, p.description, COALESCE(p.sku, ''),
+               COALESCE((SELECT group_concat(c.name, ' ')
+                         FROM products_product_categories pc
+                         JOIN products_category c ON c.id = pc.category_id
+                         WHERE pc.product_id = p.id), '')
+        FROM products_product p
+    """)
+
+
+def drop_search_index(apps, schema_editor):
+    if fts5_available(schema_editor):
+        schema_editor.execute("DROP TABLE IF EXISTS products_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,11 +1,27 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
 
 
+class CategoryQuerySet(models.QuerySet):
+    def for_list(self):
+        return self.only(*CATEGORY_LIST_FIELDS)
+
+    def for_detail(self):
+        return self.for_list()
+
+    def for_write(self):
+        return self
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True, blank=True)  # allow blank for auto-fill
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)  # filled by products.tasks
+
+    objects = CategoryQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -23,6 +39,76 @@ class Category(models.Model):
         return self.products.count()
 
 
+# Columns the catalog serializers actually read; everything else stays deferred.
+CATEGORY_LIST_FIELDS = ('id', 'name', 'slug', 'image', 'image_derivatives')
+# Kept in SQL by ProductVariant and never written by Product.save() on an existing row.
+STOCK_FIELDS = ('variant_quantity', 'available')
+PRODUCT_LIST_FIELDS = (
+    'id', 'name', 'slug', 'description', 'price', 'image', 'image_derivatives', 'available',
+    'quantity', 'variant_quantity', 'created_at', 'is_new', 'is_featured',
+)
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_categories(self):
+        """Load categories for the whole page in one extra query."""
+        return self.prefetch_related(
+            Prefetch('categories', queryset=Category.objects.only(*CATEGORY_LIST_FIELDS))
+        )
+
+    def for_list(self):
+        return self.only(*PRODUCT_LIST_FIELDS).with_categories()
+
+    def for_detail(self):
+        return self.only(*PRODUCT_LIST_FIELDS).with_categories()
+
+    def for_write(self):
+        # Full rows: save() must not run against deferred fields.
+        return self.with_categories()
+
+    def rebuild_stock(self):
+        """Recompute variant_quantity and available for every product in the queryset."""
+        variant_totals = ProductVariant.objects.filter(
+            product=OuterRef('pk')
+        ).order_by().values('product').annotate(total=Sum('quantity')).values('total')
+        updated = self.update(variant_quantity=Coalesce(Subquery(variant_totals), 0))
+        self.refresh_available()
+        return updated
+
+    def refresh_available(self):
+        """Set available from the stored quantity and variant_quantity."""
+        return self.update(available=Case(
+            When(Q(quantity__gt=0) | Q(variant_quantity__gt=0), then=Value(True)),
+            default=Value(False),
+        ))
+
+    def stock_summary(self, threshold):
+        """
+        Bucket products and their variants by stock level in one aggregate
+        query. Products are bucketed on quantity + variant_quantity, the
+        total Product.save() derives availability from.
+        """
+        return self.alias(stock=F('quantity') + F('variant_quantity')).aggregate(
+            in_stock=Count('pk', filter=Q(stock__gt=threshold), distinct=True),
+            low_stock=Count('pk', filter=Q(stock__gt=0, stock__lte=threshold), distinct=True),
+            out_of_stock=Count('pk', filter=Q(stock=0), distinct=True),
+            unavailable=Count('pk', filter=Q(available=False), distinct=True),
+            variants_in_stock=Count('variants', filter=Q(variants__quantity__gt=threshold)),
+            variants_low_stock=Count('variants', filter=Q(variants__quantity__gt=0, variants__quantity__lte=threshold)),
+            variants_out_of_stock=Count('variants', filter=Q(variants__quantity=0)),
+        )
+
+    def adjust_variant_quantity(self, delta):
+        """Add delta to variant_quantity and refresh available in a single UPDATE."""
+        return self.update(
+            variant_quantity=F('variant_quantity') + delta,
+            available=Case(
+                When(Q(quantity__gt=0) | Q(variant_quantity__gt=-delta), then=Value(True)),
+                default=Value(False),
+            ),
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     categories = models.ManyToManyField(Category, related_name='products')
@@ -30,15 +116,26 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
-    available = models.BooleanField(default=True)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)  # filled by products.tasks
+    available = models.BooleanField(default=True, db_index=True)
     quantity = models.PositiveIntegerField(default=0)
+    variant_quantity = models.PositiveIntegerField(default=0, editable=False)  # sum of variant quantities, kept by ProductVariant.save() and products.signals
     sku = models.CharField(max_length=100, unique=True,null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_new = models.BooleanField(default=False)  # For new arrivals
     is_featured = models.BooleanField(default=False)  # For featured products
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination key for the catalog (serverside.pagination).
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            # Home page collections (products.home) only scan flagged rows.
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_featured=True), name='product_featured_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_new=True), name='product_new_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -46,8 +143,28 @@ class Product(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        self.available = self.is_in_stock
-        super().save(*args, **kwargs)
+        if self._state.adding:
+            self.available = self.is_in_stock
+            super().save(*args, **kwargs)
+            return
+
+        # variant_quantity is maintained in SQL by the variants, and available
+        # follows from it: writing back this instance's copies could undo a
+        # variant change committed since it was loaded. Leave both out of the
+        # UPDATE and recompute available from the stored row instead.
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            ]
+        update_fields = [name for name in update_fields if name not in STOCK_FIELDS]
+        with transaction.atomic():
+            super().save(*args, update_fields=update_fields, **kwargs)
+            stock = Product.objects.filter(pk=self.pk)
+            stock.refresh_available()
+            self.variant_quantity, self.available = stock.values_list('variant_quantity', 'available').get()
     
     def get_primary_category(self):
         """Get the first/main category for breadcrumbs, URLs, etc."""
@@ -55,7 +172,7 @@ class Product(models.Model):
     
     @property
     def is_in_stock(self):
-        return self.quantity > 0 or any(variant.quantity > 0 for variant in self.variants.all())
+        return self.quantity > 0 or self.variant_quantity > 0
 
         
 COLOR_CHOICES = [
@@ -74,11 +191,60 @@ SIZE_CHOICES = [
 ]
 
 
+class ProductVariantQuerySet(models.QuerySet):
+    def with_product(self):
+        """Join the product and prefetch its categories for nested serialization."""
+        return self.select_related('product').prefetch_related(
+            Prefetch('product__categories', queryset=Category.objects.only(*CATEGORY_LIST_FIELDS))
+        )
+
+    def for_list(self):
+        return self.with_product()
+
+    def for_detail(self):
+        return self.with_product()
+
+    def for_compact(self):
+        # Only the product id is emitted; products are side-loaded in bulk.
+        return self.only('id', 'product_id', 'color', 'size', 'quantity')
+
+    def for_write(self):
+        return self.select_related('product')
+
+
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, related_name='variants', on_delete=models.CASCADE)
     color = models.CharField(max_length=20, choices=COLOR_CHOICES)
     size = models.CharField(max_length=5, choices=SIZE_CHOICES)
     quantity = models.PositiveIntegerField(default=0)
 
+    objects = ProductVariantQuerySet.as_manager()
+
     def __str__(self):
-        return f"{self.product.name} - {self.color} / {self.size}"
\ No newline at end of file
+        return f"{self.product.name} - {self.color} / {self.size}"
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            # Deltas are taken against the stored row, not what this instance
+            # was loaded with: it may be stale (e.g. after allocate_stock()).
+            previous = None
+            if not self._state.adding:
+                previous = ProductVariant.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('product_id', 'quantity').first()
+            super().save(*args, **kwargs)
+            if previous is None:
+                Product.objects.filter(pk=self.product_id).adjust_variant_quantity(self.quantity)
+                return
+            old_product_id, old_quantity = previous
+            product_id, quantity = self.product_id, self.quantity
+            if update_fields is not None:
+                update_fields = set(update_fields)
+                product_id = product_id if {'product', 'product_id'} & update_fields else old_product_id
+                quantity = quantity if 'quantity' in update_fields else old_quantity
+            if old_product_id != product_id:
+                Product.objects.filter(pk=old_product_id).adjust_variant_quantity(-old_quantity)
+                Product.objects.filter(pk=product_id).adjust_variant_quantity(quantity)
+            elif old_quantity != quantity:
+                Product.objects.filter(pk=product_id).adjust_variant_quantity(quantity - old_quantity)
@@ -0,0 +1,151 @@
+import re
+from functools import lru_cache
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+from .models import Product
+
+SEARCH_TABLE = 'products_product_fts'
+
+# bm25() column weights, in table column order: name, description, sku, categories.
+COLUMN_WEIGHTS = (10.0, 1.0, 8.0, 4.0)
+
+# One row per product: its text plus the names of its categories.
+DOCUMENT_SQL = """
+    SELECT p.id, p.name, p.description, COALESCE(p.sku, ''),
+           COALESCE((SELECT group_concat(c.name, ' ')
+                     FROM products_product_categories pc
+                     JOIN products_category c ON c.id = pc.category_id
+                     WHERE pc.product_id = p.id), '')
+    FROM products_product p
+"""
+
+
+@lru_cache(maxsize=None)
+def fts_enabled():
+    """True when the default database is SQLite built with FTS5 (see migration 0009)."""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def remove_products(product_ids):
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", chunk)
+
+
+def index_products(product_ids):
+    """(Re)write the index rows for the given products from their current data."""
+    if not fts_enabled():
+        return
+    remove_products(product_ids)
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, sku, categories) "
+                f"{DOCUMENT_SQL} WHERE p.id IN ({placeholders})",
+                chunk,
+            )
+
+
+def rebuild_index():
+    """Repopulate the whole index in one statement; returns the number of rows."""
+    if not fts_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, sku, categories) {DOCUMENT_SQL}")
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def _match_expression(terms):
+    # Quote every term so user input can't inject FTS syntax; prefix-match each one.
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def ranked_product_ids(terms, limit, queryset=None):
+    """
+    Ids of the best `limit` matches, best first. With `queryset` only its
+    products are ranked, so the cap applies after the other filters.
+    """
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    scope, params = '', [_match_expression(terms)]
+    if queryset is not None:
+        subquery, subquery_params = queryset.order_by().values('pk').query.sql_with_params()
+        scope = f"AND rowid IN ({subquery}) "
+        params.extend(subquery_params)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s {scope}"
+            f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s",
+            [*params, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(queryset, query):
+    """
+    Filter `queryset` to products matching `query`, most relevant first.
+    Apply the other filters first: at most SEARCH_MAX_RESULTS of what is
+    left are ranked and returned.
+    """
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return queryset
+
+    if fts_enabled():
+        ids = ranked_product_ids(terms, settings.SEARCH_MAX_RESULTS, queryset)
+        positions = ',' + ','.join(str(pk) for pk in ids) + ','
+        rank = RawSQL(f"instr(%s, ',' || {Product._meta.db_table}.id || ',')", [positions])
+        return queryset.filter(pk__in=ids).annotate(search_rank=rank).order_by('search_rank')
+
+    # Fallback for other backends: every term must match somewhere, name hits first.
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term)
+            | Q(description__icontains=term)
+            | Q(sku__icontains=term)
+            | Q(categories__name__icontains=term)
+        )
+    rank = Case(
+        When(name__icontains=terms[0], then=Value(0)),
+        When(sku__icontains=terms[0], then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+    return queryset.distinct().annotate(search_rank=rank).order_by('search_rank', '-created_at')
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """
+    `?q=` full-text search over name, description, SKU and category names.
+    List it after the other filter backends (see search_products).
+    """
+    search_param = 'q'
+
+    @classmethod
+    def get_query(cls, request):
+        return request.query_params.get(cls.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_query(request)
+        if not query:
+            return queryset
+        return search_products(queryset, query)
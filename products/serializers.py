@@ -1,21 +1,95 @@
+from collections import defaultdict
+from django.conf import settings
+from django.core.files.storage import default_storage
 from rest_framework import serializers
-from .models import Category, Product, ProductVariant
+from .fieldsets import subtree
+from .models import Category, Product, ProductVariant, PRODUCT_LIST_FIELDS
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class ImageDerivativesField(serializers.Field):
+    """
+    Expose `image_derivatives` as
+    {size: {format: {url, width, height}}}; empty until the task has run.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image_derivatives')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        images = {}
+        for size, formats in (value or {}).items():
+            if size == 'source':
+                continue
+            images[size] = {}
+            for fmt, meta in formats.items():
+                url = default_storage.url(meta['name'])
+                images[size][fmt] = {
+                    'url': request.build_absolute_uri(url) if request else url,
+                    'width': meta['width'],
+                    'height': meta['height'],
+                }
+        return images
+
+
+class SparseFieldsetMixin:
+    """
+    Accept `fields` / `expand` selections (see products.fieldsets.parse_fieldset).
+
+    `fields` keeps only the listed fields. Nested relations are expanded by
+    default; once `expand` is given, relations not listed in it fall back to
+    the factory in `collapsed_fields` (None drops the field). Selections are
+    pushed down to nested serializers via dotted paths.
+    """
+    collapsed_fields = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            self.apply_fieldset(fields, expand)
+
+    def apply_fieldset(self, fields, expand):
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+        if expand is not None:
+            for name, factory in self.collapsed_fields.items():
+                if name in self.fields and name not in expand:
+                    self.fields.pop(name)
+                    if factory is not None:
+                        self.fields[name] = factory()
+        for name, field in self.fields.items():
+            child = getattr(field, 'child', field)
+            if isinstance(child, SparseFieldsetMixin):
+                nested_expand = None if expand is None else expand.get(name, {})
+                child.apply_fieldset(subtree(fields, name), nested_expand)
+
+
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    images = ImageDerivativesField()
+
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'image']
+        fields = ['id', 'name', 'slug', 'image', 'images']
+
+
+def _category_ids():
+    return serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     categories = CategorySerializer(many=True, read_only=True)
+    images = ImageDerivativesField()
     category_ids = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(),
         source='categories',
         many=True,
         write_only=True
     )
+    collapsed_fields = {'categories': _category_ids}   # ids unless ?expand=categories
 
     class Meta:
         model = Product
@@ -26,8 +100,10 @@ class ProductSerializer(serializers.ModelSerializer):
             'description',
             'price',
             'image',
+            'images',
             'available',
             'quantity',
+            'variant_quantity',
             'created_at',
             'categories',      # updated
             'category_ids',    # write-only field for assigning categories
@@ -44,20 +120,97 @@ class ProductInventorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'sku', 'quantity', 'stock_status']
 
     def get_stock_status(self, obj):
-        LOW_STOCK_THRESHOLD = 5  # Customize as needed
-
         if obj.quantity == 0:
             return 'Out of Stock'
-        elif obj.quantity <= LOW_STOCK_THRESHOLD:
+        elif obj.quantity <= settings.LOW_STOCK_THRESHOLD:
             return 'Low Stock'
         else:
             return 'In Stock'
 
 
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class InventoryAdjustmentSerializer(serializers.Serializer):
+    """One row of a bulk adjustment: a target (variant_id or product sku) and a delta or absolute quantity."""
+    variant_id = serializers.IntegerField(required=False)
+    sku = serializers.CharField(required=False, max_length=100)
+    delta = serializers.IntegerField(required=False)
+    absolute = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, data):
+        if ('variant_id' in data) == ('sku' in data):
+            raise serializers.ValidationError("Provide exactly one of variant_id or sku.")
+        if ('delta' in data) == ('absolute' in data):
+            raise serializers.ValidationError("Provide exactly one of delta or absolute.")
+        return data
+
+
+class ProductVariantSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product_details = ProductSerializer(source='product', read_only=True)
+    collapsed_fields = {'product_details': None}   # `product` already carries the id
 
     class Meta:
         model = ProductVariant
         fields = ['id', 'product','product_details', 'color', 'size', 'quantity']
+
+
+class CompactProductVariantSerializer(serializers.ModelSerializer):
+    """Variant row that references its product by id only (see side_load_products)."""
+
+    class Meta:
+        model = ProductVariant
+        fields = ['id', 'product', 'color', 'size', 'quantity']
+
+
+class IncludedProductSerializer(serializers.ModelSerializer):
+    categories = serializers.ListField(source='category_ids', child=serializers.IntegerField(), read_only=True)
+    images = ImageDerivativesField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id',
+            'name',
+            'slug',
+            'description',
+            'price',
+            'image',
+            'images',
+            'available',
+            'quantity',
+            'variant_quantity',
+            'created_at',
+            'categories',
+            'is_new',
+            'is_featured'
+        ]
+
+
+def side_load_products(product_ids, context=None):
+    """
+    Build the `included` block for a compact variant listing.
+
+    Every referenced product and category appears exactly once, and the
+    whole block costs three queries however many variants point at them.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {'products': [], 'categories': []}
+
+    category_ids = defaultdict(list)
+    links = Product.categories.through.objects.filter(
+        product_id__in=product_ids
+    ).values_list('product_id', 'category_id')
+    for product_id, category_id in links:
+        category_ids[product_id].append(category_id)
+
+    products = list(Product.objects.filter(id__in=product_ids).only(*PRODUCT_LIST_FIELDS).order_by('id'))
+    for product in products:
+        product.category_ids = category_ids[product.id]
+
+    all_category_ids = {cid for ids in category_ids.values() for cid in ids}
+    categories = Category.objects.for_list().filter(id__in=all_category_ids).order_by('id')
+
+    return {
+        'products': IncludedProductSerializer(products, many=True, context=context).data,
+        'categories': CategorySerializer(categories, many=True, context=context).data,
+    }
@@ -0,0 +1,137 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .cache_utils import bump_catalog_version, invalidate_inventory_summary
+from .home import refresh_categories, refresh_products
+from .models import Category, Product, ProductVariant
+from .search import index_products, remove_products
+from .tasks import build_image_derivatives
+
+
+@receiver(post_delete, sender=ProductVariant)
+def release_variant_stock(sender, instance, **kwargs):
+    """
+    Recount a deleted variant's product. A receiver rather than
+    ProductVariant.delete(), so queryset and admin bulk deletes are counted;
+    it runs inside the delete's transaction. The count comes from the
+    remaining rows, as the deleted instance's quantity may be stale.
+    """
+    Product.objects.filter(pk=instance.product_id).rebuild_stock()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_stock_caches(sender, **kwargs):
+    invalidate_inventory_summary()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_caches(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def invalidate_catalog_on_categories_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def schedule_image_derivatives(sender, instance, **kwargs):
+    """Queue derivative rendering when the uploaded image changes."""
+    source = instance.image.name if instance.image else ''
+    if source == instance.image_derivatives.get('source', ''):
+        return
+    if not source:
+        sender.objects.filter(pk=instance.pk).update(image_derivatives={})
+        return
+
+    label, pk = sender._meta.label, instance.pk
+    transaction.on_commit(lambda: build_image_derivatives(label, pk))
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def reindex_product_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_products([instance.pk])
+        return
+
+    # category.products.add()/remove()/clear(): pk_set holds product ids,
+    # except for clear, where they have to be collected beforehand.
+    if action == 'pre_clear':
+        instance._search_product_ids = list(instance.products.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        index_products(pk_set)
+    elif action == 'post_clear':
+        index_products(getattr(instance, '_search_product_ids', []))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        index_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def collect_category_products(sender, instance, **kwargs):
+    instance._search_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_deleted_category_products(sender, instance, **kwargs):
+    index_products(getattr(instance, '_search_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_home_for_product(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: refresh_products([pk]))
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def refresh_home_for_stock(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: refresh_products([product_id], stock_only=True))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def refresh_home_for_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            pk = instance.pk
+            transaction.on_commit(lambda: refresh_products([pk]))
+        return
+
+    if action == 'pre_clear':
+        instance._home_product_ids = list(instance.products.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        product_ids = list(pk_set) if action != 'post_clear' else getattr(instance, '_home_product_ids', [])
+        transaction.on_commit(lambda: refresh_products(product_ids))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_home_for_category(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: refresh_categories([pk]))
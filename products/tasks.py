@@ -0,0 +1,37 @@
+import logging
+from background_task import background
+from django.apps import apps
+from django.conf import settings
+from .cache_utils import bump_catalog_version
+from .home import refresh_products
+from .images import remove_derivatives, render_derivatives
+
+logger = logging.getLogger(__name__)
+
+
+@background(schedule=0)
+def build_image_derivatives(model_label, pk):
+    """Render thumbnail/card/detail derivatives for a Product or Category image."""
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).only('pk', 'image', 'image_derivatives').first()
+    if instance is None or not instance.image:
+        return
+
+    previous = instance.image_derivatives or {}
+    if previous.get('source') == instance.image.name and len(previous) > 1:
+        return  # already up to date
+
+    try:
+        derivatives = render_derivatives(settings.MEDIA_ROOT, instance.image.name)
+    except (OSError, ValueError) as e:
+        logger.warning("Image derivatives failed for %s %s: %s", model_label, pk, e)
+        return
+
+    if previous.get('source') and previous['source'] != instance.image.name:
+        remove_derivatives(settings.MEDIA_ROOT, previous)
+
+    # update() keeps the post_save receivers from rescheduling this task.
+    model.objects.filter(pk=pk).update(image_derivatives=derivatives)
+    bump_catalog_version()
+    if model_label == 'products.Product':
+        refresh_products([pk])
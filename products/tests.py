@@ -1,3 +1,740 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models.signals import pre_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .cache_utils import bump_catalog_version, get_cache
+from .catalog_io import CatalogImporter
+from .home import rebuild_collections
+from .models import Category, Product, ProductVariant
+from .tasks import build_image_derivatives
+
+
+class StockSummaryTests(TestCase):
+    def test_products_are_bucketed_on_product_and_variant_stock(self):
+        only_variants = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE', quantity=0)
+        ProductVariant.objects.create(product=only_variants, color='red', size='M', quantity=8)
+        low = Product.objects.create(name='Cap', slug='cap', price=50, sku='CAP', quantity=1)
+        ProductVariant.objects.create(product=low, color='red', size='S', quantity=2)
+        Product.objects.create(name='Sock', slug='sock', price=20, sku='SOCK', quantity=0)
+
+        summary = Product.objects.stock_summary(5)
+
+        self.assertEqual(summary['in_stock'], 1)
+        self.assertEqual(summary['low_stock'], 1)
+        self.assertEqual(summary['out_of_stock'], 1)
+        self.assertEqual(summary['unavailable'], 1)
+        self.assertEqual(summary['variants_in_stock'], 1)
+        self.assertEqual(summary['variants_low_stock'], 1)
+
+
+class VariantStockCounterTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE', quantity=0)
+
+    def stock(self, product=None):
+        return Product.objects.values_list('variant_quantity', 'available').get(pk=(product or self.product).pk)
+
+    def test_variant_saves_apply_deltas(self):
+        self.assertEqual(self.stock(), (0, False))
+        variant = ProductVariant.objects.create(product=self.product, color='red', size='M', quantity=3)
+        ProductVariant.objects.create(product=self.product, color='red', size='L', quantity=1)
+        self.assertEqual(self.stock(), (4, True))
+
+        variant.quantity = 1
+        variant.save()
+        self.assertEqual(self.stock(), (2, True))
+
+        other = Product.objects.create(name='Cap', slug='cap', price=50, sku='CAP')
+        variant.product = other
+        variant.save()
+        self.assertEqual(self.stock(), (1, True))
+        self.assertEqual(self.stock(other), (1, True))
+
+    def test_instance_and_queryset_deletes_release_stock(self):
+        first = ProductVariant.objects.create(product=self.product, color='red', size='M', quantity=3)
+        ProductVariant.objects.create(product=self.product, color='red', size='L', quantity=1)
+        ProductVariant.objects.create(product=self.product, color='blue', size='L', quantity=2)
+
+        first.delete()
+        self.assertEqual(self.stock(), (3, True))
+
+        ProductVariant.objects.filter(product=self.product).delete()
+        self.assertEqual(self.stock(), (0, False))
+
+    def test_stale_instances_apply_deltas_to_the_stored_row(self):
+        variant = ProductVariant.objects.create(product=self.product, color='red', size='M', quantity=5)
+        ProductVariant.objects.filter(pk=variant.pk).update(quantity=3)  # e.g. allocate_stock()
+        Product.objects.filter(pk=self.product.pk).rebuild_stock()
+
+        variant.quantity = 4
+        variant.save()
+        self.assertEqual(self.stock(), (4, True))
+
+        variant.quantity = 9
+        variant.color = 'blue'
+        variant.save(update_fields=['color'])
+        self.assertEqual(self.stock(), (4, True))
+
+        ProductVariant.objects.filter(pk=variant.pk).update(quantity=2)
+        Product.objects.filter(pk=self.product.pk).rebuild_stock()
+        variant.delete()
+        self.assertEqual(self.stock(), (0, False))
+
+    def test_product_save_does_not_overwrite_a_concurrent_variant_change(self):
+        def restock(sender, instance, **kwargs):
+            # Another request commits a variant while this save is under way.
+            pre_save.disconnect(restock, sender=Product)
+            ProductVariant.objects.create(product=instance, color='red', size='M', quantity=3)
+
+        pre_save.connect(restock, sender=Product)
+        self.addCleanup(pre_save.disconnect, restock, sender=Product)
+        self.product.name = 'Plain tee'
+        self.product.save()
+
+        self.assertEqual(self.stock(), (3, True))
+        self.assertEqual((self.product.variant_quantity, self.product.available), (3, True))
+
+    def test_product_quantity_drives_availability(self):
+        self.product.quantity = 2
+        self.product.save()
+        self.assertEqual(self.stock(), (0, True))
+
+        self.product.quantity = 0
+        self.product.save()
+        self.assertEqual(self.stock(), (0, False))
+
+    def test_rebuild_command_repairs_drift(self):
+        ProductVariant.objects.create(product=self.product, color='red', size='M', quantity=3)
+        Product.objects.update(variant_quantity=0, available=False)
+
+        call_command('rebuild_product_stock', stdout=StringIO())
+
+        self.assertEqual(self.stock(), (3, True))
+
+
+class InventoryStatusTests(TestCase):
+    url = '/api/products/inventory/'
+
+    def setUp(self):
+        get_cache().clear()
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        ProductVariant.objects.create(product=product, color='red', size='M', quantity=500)
+
+    @override_settings(INVENTORY_THRESHOLD_MAX=100)
+    def test_threshold_is_clamped(self):
+        summary = APIClient().get(self.url, {'threshold': 10 ** 9}).json()
+
+        self.assertEqual(summary['threshold'], 100)
+        self.assertEqual(summary['in_stock'], 1)
+
+    def test_threshold_must_be_a_non_negative_integer(self):
+        client = APIClient()
+        self.assertEqual(client.get(self.url, {'threshold': 'abc'}).status_code, 400)
+        self.assertEqual(client.get(self.url, {'threshold': -1}).status_code, 400)
+
+    def test_summary_follows_stock_changes(self):
+        client = APIClient()
+        self.assertEqual(client.get(self.url, {'threshold': 5}).json()['in_stock'], 1)
+
+        variant = ProductVariant.objects.get()
+        variant.quantity = 0
+        variant.save()  # products.signals drops the cached snapshot
+
+        self.assertEqual(client.get(self.url, {'threshold': 5}).json()['out_of_stock'], 1)
+
+
+class ResponseCacheStatsTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def test_stats_are_staff_only(self):
+        client = APIClient()
+        self.assertIn(client.get('/api/products/cache-stats/').status_code, (401, 403))
+        client.force_authenticate(get_user_model().objects.create_user('shopper@example.com', 'pw'))
+        self.assertEqual(client.get('/api/products/cache-stats/').status_code, 403)
+
+    def test_version_bumps_are_counted_as_invalidations(self):
+        bump_catalog_version()
+        bump_catalog_version()
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_superuser('staff@example.com', 'pw'))
+
+        stats = client.get('/api/products/cache-stats/').json()
+
+        self.assertEqual(stats['invalidations'], 2)
+        self.assertNotIn('evictions', stats)
+
+
+class CatalogImportTests(TestCase):
+    def import_csv(self, text, chunk_size=2000):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as feed:
+            feed.write(text)
+        self.addCleanup(os.remove, feed.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', feed.name, chunk_size=chunk_size, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_upserts_products_variants_and_categories(self):
+        header = 'sku,name,slug,price,product_quantity,categories,color,size,quantity\n'
+        self.import_csv(header + 'TEE,Tee,tee,100,0,Men|Tops,red,S,3\nTEE,Tee,tee,100,0,Men|Tops,red,M,4\n')
+        out, err = self.import_csv(header + 'TEE,Tee,tee,120,0,Men,red,S,5\n')
+
+        product = Product.objects.get(sku='TEE')
+        self.assertEqual(product.price, 120)
+        self.assertEqual(dict(product.variants.values_list('size', 'quantity')), {'S': 5, 'M': 4})
+        self.assertEqual(product.variant_quantity, 9)
+        self.assertEqual(list(product.categories.values_list('name', flat=True)), ['Men'])
+        self.assertIn('0 products created, 1 updated', out)
+        self.assertEqual(err, '')
+
+    def test_slug_conflicts_are_reported_and_skipped(self):
+        Product.objects.create(name='Old tee', slug='tee', price=10, sku='OLD')
+        header = 'sku,name,slug,price,color,size,quantity\n'
+        rows = (
+            'NEW,Tee,tee,100,red,S,1\n'     # taken by a stored product
+            'CAP,Cap,cap,50,,,\n'
+            'CAP2,Cap 2,cap,50,,,\n'        # taken earlier in the chunk
+            'BAD,Bad,bad,abc,,,\n'
+            'SOCK,Sock,sock,20,blue,L,2\n'  # next chunk
+        )
+        out, err = self.import_csv(header + rows, chunk_size=4)
+
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['CAP', 'OLD', 'SOCK'])
+        self.assertIn("row 1: slug 'tee' is already used by product OLD", err)
+        self.assertIn("row 3: slug 'cap' is already used by product CAP", err)
+        self.assertIn('row 4: price must be a number', err)
+        self.assertIn('3 rows skipped', out)
+
+    def test_bad_jsonl_lines_are_row_errors(self):
+        lines = [
+            '{"sku": "TEE", "name": "Tee", "price": "100", "color": "red", "size": "S", "quantity": 1}',
+            '{"sku": "CAP", "name": "Cap", "price": ',
+            '["not", "an", "object"]',
+            '{"sku": "SOCK", "name": "Sock", "price": "20"}',
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as feed:
+            feed.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, feed.name)
+        out, err = StringIO(), StringIO()
+
+        call_command('import_catalog', feed.name, chunk_size=2, stdout=out, stderr=err)
+
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['SOCK', 'TEE'])
+        self.assertIn('row 2: invalid JSON', err.getvalue())
+        self.assertIn('row 3: each line must be a JSON object', err.getvalue())
+        self.assertIn('2 rows skipped', out.getvalue())
+
+    def test_non_finite_prices_are_row_errors(self):
+        header = 'sku,name,slug,price,color,size,quantity\n'
+        out, err = self.import_csv(header + 'NAN,Nan,nan,NaN,,,\nINF,Inf,inf,-Infinity,,,\nTEE,Tee,tee,100,,,\n')
+
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['TEE'])
+        self.assertIn('row 1: price must be a number', err)
+        self.assertIn('row 2: price must be a number', err)
+        self.assertIn('2 rows skipped', out)
+
+    def test_caches_are_invalidated_when_the_import_fails(self):
+        header = 'sku,name,slug,price,color,size,quantity\n'
+        with mock.patch('products.catalog_io.bump_catalog_version') as bump, \
+                mock.patch.object(CatalogImporter, 'upsert_variants', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.import_csv(header + 'TEE,Tee,tee,100,red,S,1\n')
+
+        bump.assert_called_once()
+
+    def test_export_round_trips_through_import(self):
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        ProductVariant.objects.create(product=product, color='red', size='S', quantity=3)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as feed:
+            path = feed.name
+        self.addCleanup(os.remove, path)
+        call_command('export_catalog', output=path, stdout=StringIO())
+        ProductVariant.objects.update(quantity=0)
+
+        with open(path) as feed:
+            out, err = self.import_csv(feed.read())
+
+        self.assertEqual(ProductVariant.objects.get().quantity, 3)
+        self.assertIn('0 rows skipped', out)
+
+
+class CatalogQueryBudgetTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.men = Category.objects.create(name='Men')
+        self.tops = Category.objects.create(name='Tops')
+
+    def add_products(self, start, count):
+        for n in range(start, start + count):
+            product = Product.objects.create(name=f'Tee {n}', slug=f'tee-{n}', price=100, sku=f'TEE-{n}')
+            product.categories.set([self.men, self.tops])
+            for size in ('S', 'M', 'L'):
+                ProductVariant.objects.create(product=product, color='red', size=size, quantity=2)
+
+    def count_queries(self, url):
+        get_cache().clear()  # measure the database, not the response cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_flat(self, url, expected):
+        self.add_products(0, 2)
+        self.assertEqual(self.count_queries(url), expected)
+        self.add_products(2, 6)
+        self.assertEqual(self.count_queries(url), expected)
+
+    def test_product_list_does_not_grow_with_the_page(self):
+        self.assert_flat('/api/products/products/', 3)  # count, page, categories
+
+    def test_product_detail_prefetches_categories(self):
+        self.add_products(0, 1)
+        product = Product.objects.get()
+        self.assertEqual(self.count_queries(f'/api/products/products/{product.pk}/'), 2)
+
+    def test_compact_variants_side_load_each_product_once(self):
+        # count, page, then product-category links, products and categories in bulk
+        self.assert_flat('/api/products/variants/?compact=1', 5)
+
+        product = Product.objects.get(sku='TEE-0')
+        data = self.client.get(f'/api/products/variants/?compact=1&product={product.pk}').json()
+
+        self.assertEqual([variant['product'] for variant in data['results']], [product.pk] * 3)
+        self.assertEqual(len(data['included']['products']), 1)
+        self.assertEqual(len(data['included']['categories']), 2)
+
+class ConditionalGetTests(TestCase):
+    url = '/api/products/products/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+
+    def test_matching_etag_gets_304_without_queries(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.content, b'')
+
+    def test_catalog_change_invalidates_the_etag(self):
+        first = self.client.get(self.url)
+        Product.objects.create(name='Cap', slug='cap', price=50, sku='CAP')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_etag_is_per_url(self):
+        first = self.client.get(self.url)
+        response = self.client.get(self.url + '?is_new=true', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        first = self.client.get(self.url)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+
+        self.assertEqual(response.status_code, 304)
+
+
+class ProductSearchTests(TestCase):
+    url = '/api/products/products/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        shirts = Category.objects.create(name='Shirts')
+        Product.objects.create(name='Plain tee', slug='plain', price=10, sku='P1', description='Goes with a linen shirt')
+        Product.objects.create(name='Linen shirt', slug='linen', price=30, sku='L1').categories.set([shirts])
+        Product.objects.create(name='Oxford shirt', slug='oxford', price=40, sku='O1', is_new=True)
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [product['name'] for product in response.json()['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        names = self.names(self.client.get(self.url, {'q': 'linen'}))
+
+        self.assertEqual(names, ['Linen shirt', 'Plain tee'])
+
+    def test_terms_are_prefix_matched_and_all_required(self):
+        self.assertEqual(self.names(self.client.get(self.url, {'q': 'oxf shi'})), ['Oxford shirt'])
+        self.assertEqual(self.names(self.client.get(self.url, {'q': 'oxford linen'})), [])
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_cap_applies_after_the_other_filters(self):
+        # 'Linen shirt' outranks 'Oxford shirt' overall, but is filtered out here.
+        names = self.names(self.client.get(self.url, {'q': 'shirt', 'is_new': 'true'}))
+
+        self.assertEqual(names, ['Oxford shirt'])
+
+    def test_cursor_pagination_keeps_the_relevance_order(self):
+        response = self.client.get(self.url, {'q': 'linen', 'pagination': 'cursor'})
+
+        self.assertEqual(self.names(response), ['Linen shirt', 'Plain tee'])
+        self.assertEqual(response.json()['count'], 2)  # served with page numbers
+
+
+class FacetsTests(TestCase):
+    url = '/api/products/facets/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.men = Category.objects.create(name='Men')
+        for sku, price, variants in (
+            ('A', 499, [('red', 'S')]),
+            ('B', 500, [('red', 'M'), ('blue', 'M')]),  # on the edge between two bands
+            ('C', 999, [('blue', 'L')]),
+            ('D', 5000, []),
+        ):
+            product = Product.objects.create(name=sku, slug=sku.lower(), price=price, sku=sku, quantity=1)
+            for color, size in variants:
+                ProductVariant.objects.create(product=product, color=color, size=size, quantity=1)
+        Product.objects.get(sku='B').categories.set([self.men])
+
+    def facets(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_price_band_counts_match_the_band_filters(self):
+        bands = self.facets()['price']
+        self.assertEqual([band['count'] for band in bands], [1, 2, 0, 0, 1])
+
+        for band in bands:
+            params = {'min_price': band['min']}
+            if band['max'] is not None:
+                params['max_price'] = band['max']
+            self.assertEqual(self.facets(**params)['total'], band['count'], band)
+
+    def test_each_facet_ignores_its_own_selection(self):
+        facets = self.facets(color='red')
+
+        self.assertEqual(facets['total'], 2)
+        colors = {row['value']: row['count'] for row in facets['colors']}
+        self.assertEqual((colors['red'], colors['blue']), (2, 2))  # other colours stay pickable
+        sizes = {row['value']: row['count'] for row in facets['sizes']}
+        self.assertEqual((sizes['S'], sizes['M'], sizes['L']), (1, 1, 0))
+        self.assertEqual(facets['categories'], [{'id': self.men.pk, 'name': 'Men', 'slug': 'men', 'count': 1}])
+
+    def test_colour_and_size_must_match_the_same_variant(self):
+        self.assertEqual(self.facets(color='blue', size='S')['total'], 0)
+        self.assertEqual(self.facets(color='blue', size='M')['total'], 1)
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+        os.makedirs(os.path.join(media_root, 'products'))
+
+    def upload(self, name, size=(1200, 600), mode='RGBA'):
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(
+            os.path.join(self.media_root, name)
+        )
+        return name
+
+    def test_task_is_queued_when_the_image_changes(self):
+        with mock.patch('products.signals.build_image_derivatives') as task, \
+                self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE', image=self.upload('products/tee.png'))
+        task.assert_called_once_with('products.Product', product.pk)
+
+        build_image_derivatives.now('products.Product', product.pk)
+        product.refresh_from_db()
+        with mock.patch('products.signals.build_image_derivatives') as task, \
+                self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Plain tee'
+            product.save()
+        task.assert_not_called()  # derivatives are current for this image
+
+    def test_sizes_and_formats_are_rendered(self):
+        with mock.patch('products.signals.build_image_derivatives'):
+            product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE', image=self.upload('products/tee.png'))
+
+        build_image_derivatives.now('products.Product', product.pk)
+
+        product.refresh_from_db()
+        derivatives = product.image_derivatives
+        self.assertEqual(derivatives['source'], 'products/tee.png')
+        self.assertEqual(derivatives['card']['webp']['name'], 'products/tee__card.webp')
+        self.assertEqual((derivatives['card']['jpeg']['width'], derivatives['card']['jpeg']['height']), (400, 200))
+        self.assertEqual(derivatives['detail']['webp']['width'], 1000)
+        with Image.open(os.path.join(self.media_root, derivatives['thumbnail']['jpeg']['name'])) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.mode), ('JPEG', 'RGB'))  # alpha flattened
+
+        card = APIClient().get(f'/api/products/products/{product.pk}/').json()['images']['card']
+        self.assertTrue(card['webp']['url'].endswith('/media/products/tee__card.webp'))
+
+    def test_replaced_image_drops_the_old_derivatives(self):
+        with mock.patch('products.signals.build_image_derivatives'):
+            product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE', image=self.upload('products/tee.png'))
+            build_image_derivatives.now('products.Product', product.pk)
+            product.refresh_from_db()
+            old_card = os.path.join(self.media_root, product.image_derivatives['card']['webp']['name'])
+            product.image = self.upload('products/tee-2.jpg', mode='RGB')
+            product.save()
+
+        build_image_derivatives.now('products.Product', product.pk)
+
+        product.refresh_from_db()
+        self.assertEqual(product.image_derivatives['source'], 'products/tee-2.jpg')
+        self.assertFalse(os.path.exists(old_card))
+
+
+class KeysetPaginationTests(TestCase):
+    url = '/api/products/products/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        for n in range(5):
+            Product.objects.create(name=f'Tee {n}', slug=f'tee-{n}', price=100, sku=f'TEE-{n}')
+
+    def walk(self, url, **params):
+        pks, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            data = response.json()
+            self.assertNotIn('count', data)  # no COUNT(*) in cursor mode
+            pks += [row['id'] for row in data['results']]
+            pages += 1
+            if not data['next']:
+                return pks, pages
+            response = self.client.get(data['next'])
+
+    def test_pages_follow_the_index_order(self):
+        pks, pages = self.walk(self.url, pagination='cursor', page_size=2)
+
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(pks, expected)
+        self.assertEqual(pages, 3)
+
+    def test_new_products_do_not_shift_later_pages(self):
+        first = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 2}).json()
+        Product.objects.create(name='New', slug='new', price=100, sku='NEW')  # sorts before page one
+
+        second = self.client.get(first['next']).json()
+
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual([row['id'] for row in first['results'] + second['results']], expected[1:5])
+
+    def test_page_numbers_stay_the_default(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['count'], 5)
+
+    def test_variants_paginate_by_id(self):
+        product = Product.objects.first()
+        for size in ('S', 'M', 'L'):
+            ProductVariant.objects.create(product=product, color='red', size=size, quantity=1)
+
+        pks, _ = self.walk('/api/products/variants/', pagination='cursor', page_size=2)
+
+        self.assertEqual(pks, sorted(ProductVariant.objects.values_list('pk', flat=True)))
+
+
+class InventoryAdjustmentTests(TestCase):
+    url = '/api/products/inventory/adjust/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('stock@example.com', 'pw'))
+        self.tee = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE')
+        self.variant = ProductVariant.objects.create(product=self.tee, color='red', size='M', quantity=5)
+        self.cap = Product.objects.create(name='Cap', slug='cap', price=50, sku='CAP', quantity=2)
+
+    def adjust(self, rows):
+        return self.client.post(self.url, {'adjustments': rows}, format='json')
+
+    def test_rows_are_applied_in_order_with_one_result_each(self):
+        response = self.adjust([
+            {'variant_id': self.variant.pk, 'delta': -3},
+            {'variant_id': self.variant.pk, 'delta': -3},  # only 2 left by now
+            {'variant_id': self.variant.pk, 'absolute': 10},
+            {'variant_id': self.variant.pk, 'delta': 1},
+            {'sku': 'CAP', 'delta': -2},
+            {'sku': 'NOPE', 'delta': 1},
+            {'sku': 'CAP'},
+        ])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()['results']
+        self.assertEqual([row['status'] for row in results], [
+            'applied', 'insufficient_stock', 'applied', 'applied', 'applied', 'not_found', 'invalid',
+        ])
+        self.assertEqual([row['index'] for row in results], list(range(7)))
+        self.assertEqual(results[1]['quantity'], 2)
+        self.assertEqual(response.json()['summary'], {'applied': 4, 'insufficient_stock': 1, 'not_found': 1, 'invalid': 1})
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.quantity, 11)
+        self.assertEqual(Product.objects.values_list('variant_quantity', 'available').get(pk=self.tee.pk), (11, True))
+        self.assertEqual(Product.objects.values_list('quantity', 'available').get(pk=self.cap.pk), (0, False))
+
+    def test_requires_authentication_and_a_non_empty_list(self):
+        self.assertEqual(self.adjust([]).status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertIn(self.adjust([{'sku': 'CAP', 'delta': 1}]).status_code, (401, 403))
+
+    @override_settings(INVENTORY_ADJUST_MAX_ROWS=2)
+    def test_batch_size_is_limited(self):
+        self.assertEqual(self.adjust([{'sku': 'CAP', 'delta': 1}] * 3).status_code, 400)
+        self.assertEqual(Product.objects.get(pk=self.cap.pk).quantity, 2)
+
+
+class SparseFieldsetTests(TestCase):
+    url = '/api/products/products/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.men = Category.objects.create(name='Men')
+        product = Product.objects.create(name='Tee', slug='tee', price=100, sku='TEE', description='Soft cotton')
+        product.categories.set([self.men])
+        ProductVariant.objects.create(product=product, color='red', size='M', quantity=1)
+
+    def get(self, url, **params):
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results'], queries
+
+    def test_fields_trim_the_response_and_the_columns_loaded(self):
+        results, queries = self.get(self.url, fields='id,name')
+
+        self.assertEqual(results, [{'id': Product.objects.get().pk, 'name': 'Tee'}])
+        self.assertEqual(len(queries), 2)  # count and page; categories are not prefetched
+        self.assertNotIn('description', queries[-1]['sql'])
+
+    def test_nested_fields_are_pushed_down(self):
+        results, _ = self.get(self.url, fields='id,categories.name')
+
+        self.assertEqual(results[0]['categories'], [{'name': 'Men'}])
+
+    def test_unexpanded_relations_collapse_to_ids(self):
+        results, queries = self.get(self.url, fields='id,categories', expand='')
+
+        self.assertEqual(results[0]['categories'], [self.men.pk])
+        self.assertEqual(len(queries), 3)
+
+    def test_variant_product_details_only_when_expanded(self):
+        results, _ = self.get('/api/products/variants/', expand='')
+        self.assertNotIn('product_details', results[0])
+
+        results, _ = self.get('/api/products/variants/', expand='product_details', fields='id,product_details.name')
+        self.assertEqual(results[0], {'id': ProductVariant.objects.get().pk, 'product_details': {'name': 'Tee'}})
+
+
+@override_settings(HOME_COLLECTION_SIZE=2)
+class HomeCollectionsTests(TestCase):
+    url = '/api/products/home/'
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.men = Category.objects.create(name='Men')
+        self.women = Category.objects.create(name='Women')
+
+    def product(self, name, quantity=1, categories=(), **flags):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name=name, slug=name.lower(), sku=name.upper(), price=10, quantity=quantity, **flags
+            )
+            product.categories.set(categories)
+        return product
+
+    def home(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, items):
+        return [item['name'] for item in items]
+
+    def test_collections_are_ranked_capped_and_in_stock_only(self):
+        self.product('Old', is_featured=True, categories=[self.men])
+        self.product('Mid', is_featured=True, is_new=True, categories=[self.men])
+        self.product('Gone', quantity=0, is_featured=True, is_new=True, categories=[self.men])
+        self.product('Top', is_featured=True, categories=[self.men, self.women])
+
+        home = self.home()
+
+        self.assertEqual(self.names(home['featured']), ['Top', 'Mid'])
+        self.assertEqual(self.names(home['new_arrivals']), ['Mid'])
+        self.assertEqual(
+            [(c['name'], self.names(c['products'])) for c in home['categories']],
+            [('Men', ['Top', 'Mid']), ('Women', ['Top'])],
+        )
+
+    def test_home_is_served_from_the_cache(self):
+        self.product('Tee', is_featured=True)
+        rebuild_collections()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.home()['featured']), ['Tee'])
+
+    def test_product_changes_refresh_the_collections(self):
+        tee = self.product('Tee', is_featured=True, categories=[self.men])
+        self.home()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tee.name = 'Shirt'
+            tee.save()
+        self.assertEqual(self.names(self.home()['featured']), ['Shirt'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tee.quantity = 0
+            tee.save()
+        home = self.home()
+        self.assertEqual(home['featured'], [])
+        self.assertEqual(home['categories'], [])
+
+    def test_a_new_product_enters_only_above_the_floor(self):
+        self.product('A', is_new=True)
+        self.product('B', is_new=True)
+        self.home()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.product('C', is_new=True)
+        self.assertEqual(self.names(self.home()['new_arrivals']), ['C', 'B'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.names(self.home()['new_arrivals']), ['B', 'A'])
+
+    def test_deleted_category_leaves_the_home_page(self):
+        self.product('Tee', categories=[self.men, self.women])
+        self.home()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.women.delete()
+
+        self.assertEqual([c['name'] for c in self.home()['categories']], ['Men'])
@@ -1,6 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from .views import CategoryViewSet, ProductViewSet, ProductVariantViewSet,InventoryStatusView
+from .views import CategoryViewSet, ProductViewSet, ProductVariantViewSet,InventoryStatusView,FacetsView,ResponseCacheStatsView,InventoryAdjustmentView,HomeCollectionsView
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
@@ -11,5 +11,9 @@ router.register(r'variants', ProductVariantViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('inventory/', InventoryStatusView.as_view(), name='inventory-summary'),
+    path('inventory/adjust/', InventoryAdjustmentView.as_view(), name='inventory-adjust'),
+    path('home/', HomeCollectionsView.as_view(), name='product-home'),
+    path('facets/', FacetsView.as_view(), name='product-facets'),
+    path('cache-stats/', ResponseCacheStatsView.as_view(), name='catalog-cache-stats'),
 
 ]
\ No newline at end of file
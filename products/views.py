@@ -1,14 +1,34 @@
-from rest_framework import viewsets
+import hashlib
+from collections import Counter
+from functools import partial
+from urllib.parse import urlencode
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status, viewsets
 from .models import Category, Product, ProductVariant
 from .serializers import (
     CategorySerializer,
     ProductSerializer,
-    ProductVariantSerializer,ProductInventorySerializer
+    ProductVariantSerializer,ProductInventorySerializer,
+    CompactProductVariantSerializer,side_load_products,
+    InventoryAdjustmentSerializer,SparseFieldsetMixin
 )
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.response import Response
-from rest_framework.permissions import BasePermission, SAFE_METHODS,AllowAny
+from rest_framework.filters import OrderingFilter
+from rest_framework.permissions import BasePermission, SAFE_METHODS,AllowAny,IsAdminUser,IsAuthenticated
 from rest_framework.views import APIView
+from serverside.pagination import OptionalCursorPagination
+from .cache_utils import (
+    facets_key, get_cache, get_catalog_stamp, get_response_cache_stats,
+    inventory_summary_key, record_response_cache_event, response_key
+)
+from .facets import cache_key_fragment, compute_facets, parse_filters
+from .fieldsets import parse_fieldset, queryset_for_serializer
+from .home import get_home_blob
+from .inventory import apply_adjustments
+from .search import ProductSearchFilter
 
 class ReadOnlyOrAuthenticated(BasePermission):
     def has_permission(self, request, view):
@@ -16,36 +36,324 @@ class ReadOnlyOrAuthenticated(BasePermission):
             return True  
         return request.user and request.user.is_authenticated
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class QueryPlanMixin:
+    """
+    Build the queryset from a per-action plan.
+
+    `query_plans` maps a viewset action to the name of a queryset method
+    (see ProductQuerySet); any action not listed uses the 'write' plan, so
+    every endpoint runs a fixed number of queries regardless of page size.
+    """
+    query_plans = {
+        'list': 'for_list',
+        'retrieve': 'for_detail',
+        'write': 'for_write',
+    }
+
+    def get_query_plan(self):
+        return self.query_plans.get(self.action, self.query_plans['write'])
+
+    def get_fieldset(self):
+        return None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset = self.get_fieldset()
+        if fieldset:
+            # Only load what the trimmed serializer will read.
+            ordering = [name.lstrip('-') for name in getattr(self, 'cursor_ordering', ())]
+            serializer = self.get_serializer_class()(**fieldset)
+            planned = queryset_for_serializer(queryset, serializer, extra_columns=ordering)
+            if planned is not None:
+                return planned
+        return getattr(queryset, self.get_query_plan())()
+
+
+class SparseFieldsetViewMixin:
+    """
+    `?fields=a,b,nested.c` and `?expand=relation` on list and retrieve.
+
+    The selection trims the serializer and, through QueryPlanMixin, the
+    queryset: unselected columns stay deferred and unexpanded relations
+    are not prefetched.
+    """
+    fieldset_actions = ('list', 'retrieve')
+
+    def get_fieldset(self):
+        if self.action not in self.fieldset_actions or not issubclass(self.get_serializer_class(), SparseFieldsetMixin):
+            return None
+        params = self.request.query_params
+        fieldset = {
+            'fields': parse_fieldset(params.get('fields')),
+            'expand': parse_fieldset(params.get('expand')),
+        }
+        return fieldset if any(value is not None for value in fieldset.values()) else None
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_fieldset() or {})
+        return super().get_serializer(*args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified for list and retrieve, derived from the catalog
+    stamp (see products.cache_utils) rather than from the response body.
+
+    Matching If-None-Match / If-Modified-Since requests get a 304 before the
+    queryset or serializer is touched.
+    """
+
+    def get_validators(self, request):
+        version, modified = get_catalog_stamp()
+        # Absolute URL: image links in the body depend on the host.
+        resource = f"{version}:{request.accepted_renderer.format}:{request.build_absolute_uri()}"
+        return quote_etag(hashlib.md5(resource.encode()).hexdigest()), modified
+
+    def is_not_modified(self, request, etag, modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2).
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+        return if_modified_since is not None and modified <= if_modified_since
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, modified = self.get_validators(request)
+        if self.is_not_modified(request, etag, modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(modified)
+            response['Cache-Control'] = 'no-cache'  # always revalidate
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+
+class CachedResponseMixin:
+    """
+    Server-side cache of list/retrieve response data.
+
+    Entries are keyed by the normalized URL under the current catalog
+    version, so a catalog save or delete invalidates them all at once
+    without scanning for keys (see products.cache_utils).
+    """
+
+    def get_cache_url(self, request):
+        params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+        query = urlencode([(key, value) for key, values in params for value in values])
+        return f"{request.accepted_renderer.format}:{request.build_absolute_uri(request.path)}?{query}"
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_cache()
+        key = response_key(self.get_cache_url(request))
+        data = cache.get(key)
+        if data is not None:
+            record_response_cache_event('hits')
+            return Response(data)
+
+        record_response_cache_event('misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TTL)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+class CategoryViewSet(SparseFieldsetViewMixin, QueryPlanMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [ReadOnlyOrAuthenticated]
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(SparseFieldsetViewMixin, QueryPlanMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [ReadOnlyOrAuthenticated]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
+    filterset_fields = ['available', 'is_new', 'is_featured']
+    ordering_fields = ['created_at', 'price', 'name']
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('-created_at', '-id')  # see Product.Meta.indexes
+
+    def supports_cursor(self, request):
+        # Keyset pages would re-sort ?q= results by cursor_ordering and lose the relevance rank.
+        return not ProductSearchFilter.get_query(request)
 
-class ProductVariantViewSet(viewsets.ModelViewSet):
+class ProductVariantViewSet(SparseFieldsetViewMixin, QueryPlanMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = ProductVariant.objects.all()
     serializer_class = ProductVariantSerializer
     permission_classes = [AllowAny]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['product', 'color', 'size']
-    
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('id',)
+
+    def is_compact(self):
+        return self.request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
+
+    def get_query_plan(self):
+        if self.action == 'list' and self.is_compact():
+            return 'for_compact'
+        return super().get_query_plan()
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.is_compact():
+            return CompactProductVariantSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        """
+        With `?compact=1` each variant carries only its product id and the
+        referenced products/categories are side-loaded once under `included`.
+        """
+        if not self.is_compact():
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(
+            partial(self.cached_response, self.compact_list), request, *args, **kwargs
+        )
+
+    def compact_list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        variants = list(page if page is not None else queryset)
+        data = self.get_serializer(variants, many=True).data
+        included = side_load_products(
+            (variant.product_id for variant in variants),
+            context=self.get_serializer_context()
+        )
+
+        if page is not None:
+            response = self.get_paginated_response(data)
+            response.data['included'] = included
+            return response
+        return Response({'results': data, 'included': included})
+
 
 class InventoryStatusView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
-        LOW_STOCK_THRESHOLD = 5
+        try:
+            threshold = int(request.query_params.get('threshold', settings.LOW_STOCK_THRESHOLD))
+        except ValueError:
+            return Response({"error": "threshold must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if threshold < 0:
+            return Response({"error": "threshold must not be negative"}, status=status.HTTP_400_BAD_REQUEST)
+        # Each threshold is its own cache entry; keep the number of them bounded.
+        threshold = min(threshold, settings.INVENTORY_THRESHOLD_MAX)
+
+        # Snapshot is dropped by products.signals whenever stock changes.
+        key = inventory_summary_key(threshold)
+        cache = get_cache()
+        summary = cache.get(key)
+        if summary is None:
+            counts = Product.objects.stock_summary(threshold)
+            summary = {
+                "in_stock": counts['in_stock'],
+                "low_stock": counts['low_stock'],
+                "out_of_stock": counts['out_of_stock'],
+                "unavailable": counts['unavailable'],
+                "variants": {
+                    "in_stock": counts['variants_in_stock'],
+                    "low_stock": counts['variants_low_stock'],
+                    "out_of_stock": counts['variants_out_of_stock'],
+                },
+                "threshold": threshold,
+            }
+            cache.set(key, summary, settings.INVENTORY_SUMMARY_TTL)
 
-        in_stock = Product.objects.filter(quantity__gt=LOW_STOCK_THRESHOLD).count()
-        low_stock = Product.objects.filter(quantity__gt=0, quantity__lte=LOW_STOCK_THRESHOLD).count()
-        out_of_stock = Product.objects.filter(quantity=0).count()
+        return Response(summary)
+
+
+class InventoryAdjustmentView(APIView):
+    """
+    Bulk stock sync: POST {"adjustments": [{"variant_id"|"sku", "delta"|"absolute"}, ...]}.
+
+    All valid rows are applied in one transaction with set-based updates;
+    the response has one result per input row, in order.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        rows = request.data.get('adjustments') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({"error": "adjustments must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.INVENTORY_ADJUST_MAX_ROWS:
+            return Response(
+                {"error": f"At most {settings.INVENTORY_ADJUST_MAX_ROWS} adjustments per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(rows)
+        valid = []
+        for index, row in enumerate(rows):
+            serializer = InventoryAdjustmentSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'status': 'invalid', 'errors': serializer.errors}
+
+        applied = apply_adjustments([data for _, data in valid])
+        for (index, _), result in zip(valid, applied):
+            results[index] = result
 
         return Response({
-            "in_stock": in_stock,
-            "low_stock": low_stock,
-            "out_of_stock": out_of_stock
-        })
\ No newline at end of file
+            'results': [{'index': index, **result} for index, result in enumerate(results)],
+            'summary': Counter(result['status'] for result in results),
+        })
+
+
+class HomeCollectionsView(APIView):
+    """
+    Featured, new arrivals and per-category top products for the storefront
+    home page, served as the pre-rendered JSON kept by products.home.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return HttpResponse(get_home_blob(), content_type='application/json')
+
+
+class FacetsView(APIView):
+    """
+    Sidebar counts per colour, size, category and price band for the
+    filters in the query string (color, size, category, min_price,
+    max_price, available; list values comma-separated). max_price is
+    exclusive, as are the upper bounds of the price bands.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        filters = parse_filters(request.query_params)
+        key = facets_key(cache_key_fragment(filters))
+        cache = get_cache()
+        facets = cache.get(key)
+        if facets is None:
+            facets = compute_facets(filters)
+            cache.set(key, facets, settings.FACETS_CACHE_TTL)
+        return Response(facets)
+
+
+
+class ResponseCacheStatsView(APIView):
+    """Hit/miss/invalidation counters of the catalog response cache (staff only)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        stats = get_response_cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0
+        stats['backend'] = settings.CATALOG_CACHE_BACKEND
+        return Response(stats)
@@ -0,0 +1,68 @@
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination on the view's `cursor_ordering`, e.g. ('-created_at', '-id').
+
+    The leading field must be backed by an index whose column order matches
+    the ordering so every page is a range scan from the cursor position.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # Ignore ?ordering= here: cursors are only stable on the indexed key.
+        return tuple(getattr(view, 'cursor_ordering', ('-id',)))
+
+
+class OptionalCursorPagination(BasePagination):
+    """
+    Page-number pagination by default; keyset pagination when the client
+    opts in with `?pagination=cursor` (and on every `?cursor=` link after that).
+
+    Cursor mode skips the COUNT(*) and OFFSET scan, so page 500 costs the
+    same as page 1, at the price of having no `count` or random page access.
+    Views whose `supports_cursor(request)` returns False (e.g. a result
+    ordered by relevance, not by `cursor_ordering`) always get page numbers.
+    """
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.page_pagination = PageNumberPagination()
+        self.cursor_pagination = KeysetCursorPagination()
+        self.active = self.page_pagination
+
+    def use_cursor(self, request, view=None):
+        if view is not None and hasattr(view, 'supports_cursor') and not view.supports_cursor(request):
+            return False
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.active = self.cursor_pagination if self.use_cursor(request, view) else self.page_pagination
+        return self.active.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_pagination.get_paginated_response_schema(schema)
+
+    def to_html(self):
+        return self.active.to_html()
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.active, 'display_page_controls', False)
+
+    def get_schema_operation_parameters(self, view):
+        return self.page_pagination.get_schema_operation_parameters(view) + [{
+            'name': self.mode_query_param,
+            'required': False,
+            'in': 'query',
+            'description': "Set to 'cursor' for keyset pagination.",
+            'schema': {'type': 'string', 'enum': ['cursor']},
+        }] + self.cursor_pagination.get_schema_operation_parameters(view)
@@ -19,6 +19,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 from decouple import config, Csv
+from corsheaders.defaults import default_headers
+from django.core.exceptions import ImproperlyConfigured
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = config('SECRET_KEY')
 
@@ -31,6 +33,31 @@ ALLOWED_HOSTS = ['*']
 SSLCZ_STORE_ID = config('SSLCZ_STORE_ID')
 SSLCZ_STORE_PASS = config('SSLCZ_STORE_PASS')
 SSLCZ_SANDBOX = config('SSLCZ_SANDBOX', cast=bool)
+
+# Payment gateway client (checkout.gateway): 'sslcommerz', or 'fake' to run checkout offline
+PAYMENT_GATEWAY_BACKEND = config('PAYMENT_GATEWAY_BACKEND', default='sslcommerz')
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = config('PAYMENT_GATEWAY_CONNECT_TIMEOUT', default=3.05, cast=float)  # seconds
+PAYMENT_GATEWAY_READ_TIMEOUT = config('PAYMENT_GATEWAY_READ_TIMEOUT', default=10, cast=float)  # seconds
+PAYMENT_GATEWAY_POOL_SIZE = config('PAYMENT_GATEWAY_POOL_SIZE', default=10, cast=int)  # keep-alive connections
+PAYMENT_GATEWAY_RETRIES = config('PAYMENT_GATEWAY_RETRIES', default=2, cast=int)
+PAYMENT_GATEWAY_RETRY_RATIO = config('PAYMENT_GATEWAY_RETRY_RATIO', default=0.1, cast=float)  # retries per call, at most
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = config('PAYMENT_GATEWAY_BREAKER_THRESHOLD', default=5, cast=int)  # failures in a row
+PAYMENT_GATEWAY_BREAKER_RESET = config('PAYMENT_GATEWAY_BREAKER_RESET', default=30, cast=int)  # seconds
+PAYMENT_FAKE_LATENCY = config('PAYMENT_FAKE_LATENCY', default=0.0, cast=float)  # seconds, 'fake' backend only
+
+# Idempotency keys (checkout.idempotency) for order creation and payment callbacks
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=24 * 3600, cast=int)  # seconds a stored response is replayed
+IDEMPOTENCY_LOCK_TIMEOUT = config('IDEMPOTENCY_LOCK_TIMEOUT', default=60, cast=int)  # seconds before a stalled run is retried
+
+# Email outbox (checkout.outbox): `manage.py deliver_emails`, or `--schedule` to run every EMAIL_OUTBOX_INTERVAL
+EMAIL_OUTBOX_INTERVAL = config('EMAIL_OUTBOX_INTERVAL', default=10, cast=int)  # seconds
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=50, cast=int)
+EMAIL_OUTBOX_CONCURRENCY = config('EMAIL_OUTBOX_CONCURRENCY', default=4, cast=int)  # sends in flight per worker
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+EMAIL_OUTBOX_RETRY_BASE = config('EMAIL_OUTBOX_RETRY_BASE', default=30, cast=int)  # seconds, doubled per attempt
+EMAIL_OUTBOX_TIMEOUT = config('EMAIL_OUTBOX_TIMEOUT', default=10, cast=float)  # seconds per send
+EMAIL_OUTBOX_CLAIM_TIMEOUT = config('EMAIL_OUTBOX_CLAIM_TIMEOUT', default=300, cast=int)  # seconds before a stuck send is retried
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -52,6 +79,84 @@ INSTALLED_APPS = [
 ]
 
 
+# Inventory
+LOW_STOCK_THRESHOLD = config('LOW_STOCK_THRESHOLD', default=5, cast=int)
+INVENTORY_SUMMARY_TTL = config('INVENTORY_SUMMARY_TTL', default=30, cast=int)  # seconds
+INVENTORY_THRESHOLD_MAX = config('INVENTORY_THRESHOLD_MAX', default=100, cast=int)  # ?threshold= is clamped to this
+INVENTORY_ADJUST_MAX_ROWS = config('INVENTORY_ADJUST_MAX_ROWS', default=10000, cast=int)
+
+# Product search (?q=): cap on ranked matches returned by the full-text index
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=500, cast=int)
+
+# Facet counts are also invalidated on every catalog change
+FACETS_CACHE_TTL = config('FACETS_CACHE_TTL', default=300, cast=int)  # seconds
+HOME_COLLECTION_SIZE = config('HOME_COLLECTION_SIZE', default=12, cast=int)  # products per home collection
+HOME_COLLECTIONS_TTL = config('HOME_COLLECTIONS_TTL', default=3600, cast=int)  # seconds; full rebuild after this
+
+# Stale cart sweeper (carts.sweeper): `manage.py sweep_carts`, or `--schedule` to run every CART_SWEEP_INTERVAL
+CART_EMPTY_MAX_AGE_HOURS = config('CART_EMPTY_MAX_AGE_HOURS', default=24, cast=int)
+CART_ABANDONED_MAX_AGE_DAYS = config('CART_ABANDONED_MAX_AGE_DAYS', default=30, cast=int)
+CART_SWEEP_BATCH_SIZE = config('CART_SWEEP_BATCH_SIZE', default=500, cast=int)
+CART_SWEEP_INTERVAL = config('CART_SWEEP_INTERVAL', default=3600, cast=int)  # seconds
+
+# Stock reservations (carts.reservations): how long an add-to-cart holds stock
+CART_RESERVATION_TTL = config('CART_RESERVATION_TTL', default=900, cast=int)  # seconds
+CART_RESERVATION_REAP_INTERVAL = config('CART_RESERVATION_REAP_INTERVAL', default=60, cast=int)  # seconds
+
+# Where anonymous carts live (carts.storage): 'db', 'cache' (CART_CACHE_ALIAS) or 'cookie' (signed).
+# With 'cache' or 'cookie' a cart is written to the database at checkout or sign-in.
+CART_STORAGE_BACKEND = config('CART_STORAGE_BACKEND', default='db')
+CART_CACHE_ALIAS = config('CART_CACHE_ALIAS', default='default')  # must be shared across workers (see below)
+CART_ANONYMOUS_TTL = config('CART_ANONYMOUS_TTL', default=7 * 24 * 3600, cast=int)  # seconds
+
+# Catalog cache: versions, facets, inventory snapshots and cached catalog responses.
+# Versions are bumped by whichever process changes the catalog (web workers and
+# the process_tasks worker), so every process must share the cache: 'locmem' is
+# only correct for a single process (e.g. runserver without background tasks).
+# Use 'file', 'redis' or 'memcached' in any multi-process deployment.
+CATALOG_CACHE_BACKEND = config('CATALOG_CACHE_BACKEND', default='locmem')
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)  # web worker processes
+if CATALOG_CACHE_BACKEND == 'locmem' and WEB_CONCURRENCY > 1:
+    raise ImproperlyConfigured(
+        "CATALOG_CACHE_BACKEND='locmem' is per process; with WEB_CONCURRENCY > 1 "
+        "catalog invalidations would not reach the other workers. Use 'file', 'redis' or 'memcached'."
+    )
+CATALOG_CACHE_LOCATION = config('CATALOG_CACHE_LOCATION', default='')
+CATALOG_CACHE_ALIAS = 'catalog'
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=600, cast=int)  # seconds
+
+CATALOG_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'catalog'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/serverside_catalog_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+}
+_catalog_backend, _catalog_location = CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND]
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CATALOG_CACHE_ALIAS: {
+        'BACKEND': _catalog_backend,
+        'LOCATION': CATALOG_CACHE_LOCATION or _catalog_location,
+        'TIMEOUT': RESPONSE_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': 10000} if CATALOG_CACHE_BACKEND in ('locmem', 'file') else {},
+    },
+}
+
+# A cart in a per-process cache is lost whenever the next request lands on another worker.
+if (
+    CART_STORAGE_BACKEND == 'cache' and WEB_CONCURRENCY > 1
+    and CACHES.get(CART_CACHE_ALIAS, {}).get('BACKEND') == 'django.core.cache.backends.locmem.LocMemCache'
+):
+    raise ImproperlyConfigured(
+        f"CART_CACHE_ALIAS={CART_CACHE_ALIAS!r} is a per-process LocMemCache; with WEB_CONCURRENCY > 1 "
+        "anonymous carts would disappear between requests. Point it at a shared cache "
+        "(e.g. 'catalog' with CATALOG_CACHE_BACKEND='redis') or use CART_STORAGE_BACKEND='cookie'."
+    )
+
+
 BACKGROUND_TASK_RUN_ASYNC = True
 BACKGROUND_TASK_ASYNC_THREADS = 4
 
@@ -102,6 +207,8 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases